@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Load test for the match service (see fsa4streams.server).
+
+Start a server in this process (wsgiref or asyncio),
+serving the structure of a workload of :mod:`workloads`,
+then send requests from several client threads
+(each with its own connection),
+every request feeding the same events, then finishing,
+and print the throughput and latency percentiles.
+
+Examples::
+
+    python bench/load.py
+    python bench/load.py --clients 16 --requests 200 --events 100 --asyncio
+"""
+from __future__ import division, print_function
+
+from os.path import abspath, dirname
+import sys
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from argparse import ArgumentParser
+import json
+from threading import Thread
+from time import time
+try:
+    from http.client import HTTPConnection
+except ImportError: # Python 2
+    from httplib import HTTPConnection
+
+from fsa4streams.server import MatchService, make_server
+import workloads
+
+
+def start(service, use_asyncio):
+    """Start serving `service` in a thread,
+    and return its port and a function stopping it.
+    """
+    if not use_asyncio:
+        server = make_server(service, 'localhost', 0, quiet=True)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server.server_port, server.shutdown
+    import asyncio
+    from fsa4streams.aioserver import start_server
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(start_server(service, 'localhost', 0))
+    thread = Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    return (server.sockets[0].getsockname()[1],
+            lambda: loop.call_soon_threadsafe(loop.stop))
+
+def client(port, path, body, requests, latencies, errors):
+    connection = HTTPConnection('localhost', port)
+    for _ in range(requests):
+        start = time()
+        connection.request('POST', path, body)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time() - start)
+        if response.status != 200:
+            errors.append(response.status)
+    connection.close()
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--workload', default='deep_chain')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100,
+                        help='requests per client (default: %(default)s)')
+    parser.add_argument('--events', type=int, default=50,
+                        help='events per request (default: %(default)s)')
+    parser.add_argument('--asyncio', action='store_true')
+    args = parser.parse_args(argv)
+
+    for make in workloads.ALL:
+        workload = make()
+        if workload.name == args.workload:
+            break
+    else:
+        parser.error('unknown workload %r' % args.workload)
+    service = MatchService()
+    service.register(workload.name, workload.structure)
+    port, stop = start(service, args.asyncio)
+    events = workload.events(args.events)
+    body = b''.join( json.dumps(item).encode('utf-8') + b'\n'
+                     for item in events )
+    path = '/automata/%s' % workload.name
+    if workload.timestamped:
+        path += '?timestamped=1'
+
+    latencies = []
+    errors = []
+    threads = [ Thread(target=client, args=(port, path, body,
+                                            args.requests, latencies, errors))
+                for i in range(args.clients) ]
+    start_time = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - start_time
+    stop()
+
+    latencies.sort()
+    count = len(latencies)
+    print('%d requests in %.2fs: %.0f req/s, %.0f events/s, %d errors' % (
+        count, elapsed, count / elapsed, count * args.events / elapsed,
+        len(errors)))
+    for p in (50, 90, 99):
+        print('p%d latency: %.2f ms' % (p, 1000 * latencies[
+            min(count - 1, count * p // 100)]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Benchmark runner for fsa4streams.
+
+Run every workload of :mod:`workloads` at every requested stream size,
+print a summary, and store the results in a JSON file
+(in bench/results/ by default).
+Results of another run can be given with --compare,
+in which case the speed ratio of every measure is printed.
+
+Examples::
+
+    python bench/run.py
+    python bench/run.py --sizes 1e3,1e5,1e7 --workloads deep_chain
+    python bench/run.py --compare bench/results/<previous>.json
+"""
+from __future__ import division, print_function
+
+from os import makedirs
+from os.path import abspath, dirname, exists, join
+import sys
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from argparse import ArgumentParser
+from datetime import datetime
+import gc
+import json
+import platform
+from subprocess import CalledProcessError, check_output
+from time import time
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+from fsa4streams import FSA
+import workloads
+
+HERE = dirname(abspath(__file__))
+
+
+def bench_feed(workload, size):
+    """Feed events one by one, tracking the number of live tokens."""
+    fsa = FSA.from_dict(workload.structure)
+    tokens = fsa._tokens
+    peak = 0
+    matches = 0
+    events = workload.events(size)
+    start = time()
+    if workload.timestamped:
+        for event, timestamp in events:
+            matches += len(fsa.feed(event, timestamp))
+            live = len(tokens.running) + len(tokens.pending)
+            if live > peak:
+                peak = live
+    else:
+        for event in events:
+            matches += len(fsa.feed(event))
+            live = len(tokens.running) + len(tokens.pending)
+            if live > peak:
+                peak = live
+    matches += len(fsa.finish())
+    elapsed = time() - start
+    return {
+        'seconds': elapsed,
+        'events_per_sec': size / elapsed if elapsed else None,
+        'peak_tokens': peak,
+        'matches': matches,
+    }
+
+def _feed_all(workload, size):
+    fsa = FSA.from_dict(workload.structure)
+    events = workload.events(size)
+    if workload.timestamped:
+        return fsa.feed_all_timestamps(events)
+    return fsa.feed_all(events)
+
+def bench_feed_all(workload, size, memory):
+    """Feed all events at once (including finish)."""
+    start = time()
+    matches = len(_feed_all(workload, size))
+    elapsed = time() - start
+    ret = {
+        'seconds': elapsed,
+        'events_per_sec': size / elapsed if elapsed else None,
+        'matches': matches,
+    }
+    if memory and tracemalloc is not None:
+        # measured in a separate run, as tracing slows down allocations
+        gc.collect()
+        tracemalloc.start()
+        _feed_all(workload, size)
+        ret['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return ret
+
+def bench_tokens(workload, size, repeat=100):
+    """Export and reload the tokens of a busy FSA."""
+    fsa = FSA.from_dict(workload.structure)
+    events = workload.events(min(size, 1000))
+    if workload.timestamped:
+        for event, timestamp in events:
+            fsa.feed(event, timestamp)
+    else:
+        for event in events:
+            fsa.feed(event)
+    start = time()
+    for _ in range(repeat):
+        fsa.load_tokens_from_str(fsa.export_tokens_as_string(), force=True)
+    elapsed = time() - start
+    return {
+        'seconds': elapsed,
+        'ops_per_sec': repeat / elapsed if elapsed else None,
+        'tokens': len(fsa._tokens.running) + len(fsa._tokens.pending),
+    }
+
+def bench_check_structure(workload, repeat=20):
+    """Build an FSA from its structure, and check it.
+
+    The structure cache is disabled,
+    so that every repetition actually checks the structure.
+    """
+    cache = FSA.structure_cache
+    FSA.structure_cache = None
+    try:
+        start = time()
+        for _ in range(repeat):
+            FSA.from_dict(json.loads(json.dumps(workload.structure)))
+        elapsed = time() - start
+    finally:
+        FSA.structure_cache = cache
+    return {
+        'seconds': elapsed,
+        'ops_per_sec': repeat / elapsed if elapsed else None,
+    }
+
+
+def run(workload_names, sizes, memory=True):
+    results = []
+    for make in workloads.ALL:
+        workload = make()
+        if workload_names and workload.name not in workload_names:
+            continue
+        results.append(dict(workload=workload.name, size=None,
+                            operation='check_structure',
+                            **bench_check_structure(workload)))
+        report(results[-1])
+        for size in sizes:
+            results.append(dict(workload=workload.name, size=size,
+                                operation='feed',
+                                **bench_feed(workload, size)))
+            report(results[-1])
+            results.append(dict(workload=workload.name, size=size,
+                                operation='feed_all',
+                                **bench_feed_all(workload, size, memory)))
+            report(results[-1])
+        results.append(dict(workload=workload.name, size=None,
+                            operation='tokens',
+                            **bench_tokens(workload, max(sizes))))
+        report(results[-1])
+    return results
+
+def report(result):
+    speed = result.get('events_per_sec')
+    if speed is not None:
+        speed = '%12.0f ev/s' % speed
+    else:
+        speed = '%12.1f op/s' % (result.get('ops_per_sec') or 0)
+    extra = []
+    if 'peak_tokens' in result:
+        extra.append('peak tokens %d' % result['peak_tokens'])
+    if 'peak_memory' in result:
+        extra.append('peak memory %.1f MiB' % (result['peak_memory'] / 2**20))
+    print('%-18s %-16s %9s %s  %s' % (
+        result['workload'], result['operation'], result['size'] or '-',
+        speed, ', '.join(extra)))
+    sys.stdout.flush()
+
+def compare(results, previous):
+    print()
+    print('ratio to %s (> 1 is faster)' % previous['meta'].get('commit'))
+    old = dict( ((r['workload'], r['operation'], r['size']), r)
+                for r in previous['results'] )
+    for result in results:
+        key = (result['workload'], result['operation'], result['size'])
+        other = old.get(key)
+        if other is None:
+            continue
+        print('%-18s %-16s %9s %6.2f' % (
+            key[0], key[1], key[2] or '-',
+            other['seconds'] / result['seconds'] if result['seconds'] else 0))
+
+def git_commit():
+    try:
+        return check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                            cwd=HERE).decode().strip()
+    except (CalledProcessError, OSError):
+        return None
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='1e3,1e4,1e5',
+                        help='comma-separated stream sizes (default: %(default)s)')
+    parser.add_argument('--workloads', default='',
+                        help='comma-separated workload names (default: all)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure peak memory')
+    parser.add_argument('--output',
+                        help='JSON file for the results '
+                        '(default: bench/results/<date>-<commit>.json)')
+    parser.add_argument('--compare',
+                        help='JSON file of previous results to compare with')
+    args = parser.parse_args(argv)
+
+    sizes = [ int(float(size)) for size in args.sizes.split(',') ]
+    workload_names = [ name for name in args.workloads.split(',') if name ]
+    meta = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+    }
+    results = run(workload_names, sizes, not args.no_memory)
+
+    output = args.output
+    if output is None:
+        results_dir = join(HERE, 'results')
+        if not exists(results_dir):
+            makedirs(results_dir)
+        output = join(results_dir, '%s-%s.json' % (
+            datetime.now().strftime('%Y%m%d-%H%M%S'), meta['commit']))
+    with open(output, 'w') as f:
+        json.dump({ 'meta': meta, 'results': results }, f, indent=2)
+    print('results stored in', output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Synthetic automata and event streams for the benchmark suite.
+
+Every workload is a function returning a :class:`Workload`,
+made of an FSA structure (in the dict/JSON format)
+and a function generating a reproducible stream of events
+(or of (event, timestamp) pairs, if the workload is ``timestamped``).
+"""
+from __future__ import print_function, unicode_literals
+
+from random import Random
+
+
+class Workload(object):
+
+    def __init__(self, name, structure, events, timestamped=False):
+        self.name = name
+        self.structure = structure
+        self._events = events
+        self.timestamped = timestamped
+
+    def events(self, size, seed=42):
+        """Return an iterator over `size` events."""
+        return self._events(Random(seed), size)
+
+
+def deep_chain(depth=50):
+    """A single path of `depth` literal transitions.
+
+    The stream mostly follows the chain, with 10% of foreign events.
+    """
+    states = {}
+    for i in range(depth):
+        stateid = 'start' if i == 0 else 's%d' % i
+        target = 's%d' % (i+1) if i < depth-1 else 'finish'
+        states[stateid] = {
+            'max_noise': 1,
+            'transitions': [ { 'condition': 'e%d' % i, 'target': target } ],
+        }
+    states['finish'] = { 'terminal': True }
+
+    def events(rnd, size):
+        i = 0
+        for _ in range(size):
+            if rnd.random() < .1:
+                yield 'noise'
+            else:
+                yield 'e%d' % i
+                i = (i+1) % depth
+    return Workload('deep_chain', { 'states': states }, events)
+
+
+def wide_start(width=1000):
+    """A start state with `width` literal transitions,
+    each leading to a state waiting for an 'end' event.
+    """
+    states = {
+        'start': {
+            'transitions': [ { 'condition': 'e%d' % i, 'target': 's%d' % i }
+                             for i in range(width) ],
+        },
+        'finish': { 'terminal': True },
+    }
+    for i in range(width):
+        states['s%d' % i] = {
+            'max_noise': 3,
+            'transitions': [ { 'condition': 'end', 'target': 'finish' } ],
+        }
+
+    def events(rnd, size):
+        for _ in range(size):
+            if rnd.random() < .2:
+                yield 'end'
+            else:
+                yield 'e%d' % rnd.randrange(width)
+    return Workload('wide_start', { 'states': states }, events)
+
+
+def regexp_heavy(width=20, depth=5):
+    """A chain of `depth` states, each with `width` regexp transitions."""
+    states = {}
+    for i in range(depth):
+        stateid = 'start' if i == 0 else 's%d' % i
+        target = 's%d' % (i+1) if i < depth-1 else 'finish'
+        states[stateid] = {
+            'max_noise': 2,
+            'transitions': [ { 'condition': r'ev-%d-[a-z]+-%d' % (i, j),
+                               'target': target }
+                             for j in range(width) ],
+        }
+    states['finish'] = { 'terminal': True }
+
+    def events(rnd, size):
+        i = 0
+        for _ in range(size):
+            if rnd.random() < .25:
+                yield 'other-%d' % rnd.randrange(width)
+            else:
+                yield 'ev-%d-%s-%d' % (i, rnd.choice(('abc', 'xyz', 'k')),
+                                       rnd.randrange(width))
+                i = (i+1) % depth
+    return Workload('regexp_heavy',
+                    { 'states': states, 'default_matcher': 'regexp' },
+                    events)
+
+
+def nondeterministic(nstates=10, alphabet='abcd', fanout=3, lifetime=6,
+                     seed=1):
+    """A random graph where some events lead to `fanout` states.
+
+    As the number of tokens grows exponentially with their age,
+    they are dropped after `lifetime` events.
+    """
+    rnd = Random(seed)
+    stateids = [ 'start' ] + [ 's%d' % i for i in range(1, nstates) ]
+    states = {}
+    for stateid in stateids:
+        transitions = []
+        for event in alphabet:
+            # about one event out of three is nondeterministic
+            n = fanout if rnd.random() < .3 else 1
+            for target in rnd.sample(stateids[1:], n):
+                transitions.append({ 'condition': event, 'target': target })
+        states[stateid] = {
+            'max_noise': 1,
+            'max_total_noise': 3,
+            'max_total_duration': lifetime,
+            'terminal': rnd.random() < .3,
+            'transitions': transitions,
+        }
+    states['s1']['terminal'] = True
+
+    def events(rnd, size):
+        for _ in range(size):
+            yield rnd.choice(alphabet + 'z')
+    return Workload('nondeterministic',
+                    { 'states': states, 'allow_overlap': True },
+                    events)
+
+
+def deterministic(depth=10, width=4):
+    """A deterministic automaton without noise,
+    eligible to the fast path of :mod:`fsa4streams.dfa`.
+
+    Each state of the chain waits for one of `width` events,
+    and goes back to the start state on another one.
+    """
+    states = {}
+    for i in range(depth):
+        stateid = 'start' if i == 0 else 's%d' % i
+        target = 's%d' % (i+1) if i < depth-1 else 'finish'
+        transitions = [ { 'condition': 'e%d' % j, 'target': target }
+                        for j in range(width) ]
+        if i > 0:
+            transitions.append({ 'condition': 'reset', 'target': 'start' })
+        states[stateid] = { 'transitions': transitions }
+    states['finish'] = { 'terminal': True }
+
+    def events(rnd, size):
+        for _ in range(size):
+            if rnd.random() < .05:
+                yield 'reset'
+            else:
+                yield 'e%d' % rnd.randrange(width+1)
+    return Workload('deterministic', { 'states': states }, events)
+
+
+def noise_duration(depth=5):
+    """A chain of states with large max_noise and tight max_duration,
+    fed with timestamped events.
+    """
+    states = {}
+    for i in range(depth):
+        stateid = 'start' if i == 0 else 's%d' % i
+        target = 's%d' % (i+1) if i < depth-1 else 'finish'
+        states[stateid] = {
+            'transitions': [ { 'condition': 'e%d' % i, 'target': target } ],
+        }
+    states['finish'] = { 'terminal': True }
+
+    def events(rnd, size):
+        timestamp = 0
+        for _ in range(size):
+            timestamp += rnd.randint(0, 3)
+            yield 'e%d' % rnd.randrange(depth), timestamp
+    return Workload('noise_duration', {
+        'states': states,
+        'allow_overlap': True,
+        'state_defaults': {
+            'max_noise': 20,
+            'max_total_noise': 50,
+            'max_duration': 10,
+            'max_total_duration': 60,
+        },
+    }, events, timestamped=True)
+
+
+ALL = [ deep_chain, wide_start, regexp_heavy, nondeterministic, deterministic,
+        noise_duration ]
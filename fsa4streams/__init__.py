@@ -1,3 +1,4 @@
 from .fsa import FSA
+from .multi import MultiStreamFSA
 
 __version__ = "0.7a"
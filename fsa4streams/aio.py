@@ -0,0 +1,165 @@
+"""
+Asyncio front-end.
+
+This module requires Python 3.6 or later.
+
+:class:`AsyncFSA` makes an FSA consume an asynchronous iterator of events,
+and exposes the matches as an asynchronous iterator::
+
+    afsa = AsyncFSA(fsa)
+    async for match in afsa.iter_feed(events):
+        ...
+
+Events are read from the source by a separate task,
+into a bounded queue:
+when matches are not consumed fast enough, the queue fills up,
+and the source is not read anymore until there is room again.
+Queued events are processed in batches of bounded size,
+giving control back to the event loop between batches,
+so that bursts of events do not block it.
+
+With a `clock` (e.g. ``asyncio.get_event_loop().time``),
+events are timestamped when they are read from the source,
+and tokens exceeding their ``max_duration`` (or ``max_total_duration``)
+are expired by a timer, even if no event is coming
+(see :meth:`FSA.advance_clock <fsa4streams.fsa.FSA.advance_clock>`).
+"""
+import asyncio
+
+
+class AsyncFSA(object):
+    """Run an FSA on asynchronous iterators.
+
+    `fsa` is the :class:`~fsa4streams.fsa.FSA` to run (its own tokens are used),
+    `maxsize` is the maximum number of events read from the source
+    and not processed yet,
+    and `batch_size` is the maximum number of events processed
+    without giving control back to the event loop.
+
+    If provided, `clock` is a function returning the current time,
+    in the same unit as the duration constraints of the structure.
+    """
+
+    def __init__(self, fsa, maxsize=1024, batch_size=256, clock=None):
+        self.fsa = fsa
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.clock = clock
+
+    def iter_feed(self, source, finish=True):
+        """Ingest all events from the asynchronous iterator `source`,
+        and return an asynchronous iterator of matches.
+
+        If a `clock` was given, events are timestamped with it.
+        If `finish` is true, the matches returned by
+        :meth:`FSA.finish <fsa4streams.fsa.FSA.finish>`
+        are yielded once `source` is exhausted.
+        """
+        return self._iter_feed(source, self.clock, finish)
+
+    def iter_feed_timestamps(self, source, finish=True):
+        """Same as :meth:`iter_feed`,
+        but `source` yields (event, timestamp) pairs.
+
+        If a `clock` was given, it must be consistent with the timestamps,
+        as it is used to expire tokens between events.
+        """
+        return self._iter_feed(source, None, finish, True)
+
+    async def _iter_feed(self, source, stamp, finish, timestamped=False):
+        """Implementation of :meth:`iter_feed` and :meth:`iter_feed_timestamps`,
+        where `stamp` is the function timestamping events, if any.
+        """
+        fsa = self.fsa
+        tokens = fsa._tokens
+        clock = self.clock
+        batch_size = self.batch_size
+        timestamped = timestamped or stamp is not None
+        queue = asyncio.Queue(self.maxsize)
+        reader = asyncio.ensure_future(_read(source, queue, stamp))
+        getter = None
+        try:
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(queue.get())
+                timeout = None
+                if clock is not None and tokens.deadlines:
+                    timeout = _timeout(tokens.deadlines[0][0], clock())
+                await asyncio.wait([getter], timeout=timeout)
+                if not getter.done():
+                    if not queue.empty():
+                        # the getter has not resumed yet:
+                        # the queued events come before the deadline
+                        continue
+                    # no event before the next deadline
+                    now = clock()
+                    if tokens.clock is not None and now < tokens.clock:
+                        now = tokens.clock
+                    for match in fsa.advance_clock(now):
+                        yield match
+                    continue
+                item = getter.result()
+                getter = None
+                batch = []
+                while not isinstance(item, _Stop):
+                    if stamp is not None and tokens.clock is not None \
+                    and item[1] < tokens.clock:
+                        # the clock was advanced while the reader was
+                        # waiting for room in the queue with this event
+                        item = (item[0], tokens.clock)
+                    batch.append(item)
+                    if len(batch) == batch_size or queue.empty():
+                        break
+                    item = queue.get_nowait()
+                # the batch is processed at once, so that the tokens are
+                # up to date whenever a match is yielded
+                for _, match in list(fsa._run(tokens, batch, timestamped,
+                                              True)):
+                    yield match
+                if isinstance(item, _Stop):
+                    if item.error is not None:
+                        raise item.error
+                    break
+                # let other tasks run between batches
+                await asyncio.sleep(0)
+        finally:
+            reader.cancel()
+            if getter is not None:
+                getter.cancel()
+        if finish:
+            for match in fsa.finish():
+                yield match
+
+
+def _timeout(deadline, now):
+    """Return the delay until the clock exceeds `deadline`,
+    as tokens only expire strictly after their deadline
+    (see :meth:`Token.expired <fsa4streams.tokens.Token.expired>`).
+    """
+    if isinstance(deadline, int) and isinstance(now, int):
+        # wait for the next tick, else the timer would spin until then
+        return max(deadline + 1 - now, 0)
+    return max(deadline - now, 0)
+
+
+class _Stop(object):
+    """The end of the source, or the exception it raised."""
+    def __init__(self, error=None):
+        self.error = error
+
+async def _read(source, queue, stamp):
+    """Put all items of `source` in `queue`, then a _Stop.
+
+    If `stamp` is not None, events are paired with its result.
+    """
+    try:
+        async for item in source:
+            if stamp is not None:
+                item = (item, stamp())
+            await queue.put(item)
+    except asyncio.CancelledError:
+        raise
+    except Exception as error:
+        await queue.put(_Stop(error))
+    else:
+        await queue.put(_Stop())
@@ -0,0 +1,212 @@
+"""
+An asyncio HTTP server for :class:`~fsa4streams.server.MatchService`.
+
+This module requires Python 3.7 or later.
+
+It serves the same resources as the WSGI application
+(see :mod:`fsa4streams.server`),
+with a minimal HTTP/1.1 implementation from the standard library:
+request bodies can be chunked,
+responses to feed requests are chunked,
+and connections are kept alive.
+
+Events are processed as they are received,
+one network chunk at a time,
+and the resulting matches are sent immediately;
+a client that does not read its matches
+eventually stops the reading of its events.
+Requests on the same session are serialized,
+each of them from the beginning to the end of its body.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+from weakref import WeakValueDictionary
+
+from .server import HTTPError, INPUT_ERRORS, JSON, NDJSON, format_error, \
+    format_matches, parse_events
+
+
+async def start_server(service, host='localhost', port=12345):
+    """Start serving `service`, and return the asyncio server."""
+    # asyncio locks of the sessions being used, by (name, session)
+    locks = WeakValueDictionary()
+    async def handle(reader, writer):
+        try:
+            while await _handle_request(service, reader, writer, locks):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # broken connection or protocol error
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+def serve(service, host='localhost', port=12345):
+    """Serve `service` forever."""
+    async def run():
+        server = await start_server(service, host, port)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(run())
+
+
+async def _handle_request(service, reader, writer, locks):
+    """Handle one request, and return whether the connection can be reused."""
+    line = await reader.readline()
+    if not line:
+        return False
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        await _respond(writer, '400 Bad Request', {'error': 'Bad request line'})
+        return False
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    keep_alive = version == 'HTTP/1.1' \
+        and headers.get('connection', '').lower() != 'close'
+    path, _, query = target.partition('?')
+    query = parse_qs(query)
+    timestamped = query.get('timestamped', ['0'])[0] not in ('', '0')
+    body = _read_body(reader, headers)
+
+    try:
+        action, args = service.route(method, path)
+        if len(args) > 1:
+            # requests on a session are serialized by an asyncio lock,
+            # as the locks of the service can not be held across awaits
+            lock = locks.get(args)
+            if lock is None:
+                lock = locks[args] = asyncio.Lock()
+            async with lock:
+                return await _dispatch(service, writer, action, args, body,
+                                       timestamped, keep_alive)
+        return await _dispatch(service, writer, action, args, body,
+                               timestamped, keep_alive)
+    except HTTPError as ex:
+        # the body may not have been read
+        await _respond(writer, ex.status, { 'error': str(ex) }, close=True)
+        return False
+
+async def _dispatch(service, writer, action, args, body, timestamped,
+                    keep_alive):
+    """Perform `action`, and return whether the connection can be reused."""
+    if action == 'feed':
+        service._get(args[0])
+        complete = await _feed(service, writer, args, body, timestamped)
+        return keep_alive and complete
+    if action == 'register':
+        data = b''.join([ chunk async for chunk in body ])
+        try:
+            service.register(args[0], data.decode('utf-8'))
+        except ValueError as ex:
+            raise HTTPError('400 Bad Request', str(ex))
+        result = None
+    else:
+        async for _ in body:
+            pass
+        if action == 'finish':
+            matches = list(format_matches(service.finish(*args)))
+            await _respond(writer, '200 OK', b''.join(matches), NDJSON)
+            return keep_alive
+        result = getattr(service, action)(*args)
+    await _respond(writer, '200 OK', result)
+    return keep_alive
+
+async def _feed(service, writer, args, body, timestamped):
+    """Feed the lines of `body`, and send the matches in chunks.
+
+    Return False if the body could not be processed entirely
+    (because of malformed input).
+    """
+    name = args[0]
+    if len(args) > 1:
+        session = args[1]
+    else:
+        # an anonymous session, finished at the end
+        session = object()
+    writer.write(('HTTP/1.1 200 OK\r\n'
+                  'Content-Type: %s\r\n'
+                  'Transfer-Encoding: chunked\r\n\r\n' % NDJSON).encode())
+    try:
+        rest = b''
+        async for chunk in body:
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            if not _feed_lines(service, writer, name, lines, session,
+                               timestamped):
+                return False
+            await writer.drain()
+        if not _feed_lines(service, writer, name, [rest], session,
+                           timestamped):
+            return False
+        if len(args) == 1:
+            _write_chunk(writer,
+                         b''.join(format_matches(service.finish(name, session))))
+        return True
+    finally:
+        if len(args) == 1:
+            service.reset(name, session)
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+def _feed_lines(service, writer, name, lines, session, timestamped):
+    """Feed `lines` to `session`, and write the matches as a chunk.
+
+    Return False on malformed input.
+    """
+    data = []
+    ok = True
+    try:
+        events = parse_events(lines, timestamped)
+        for match in service.iter_feed(name, events, session, timestamped):
+            data.append(json.dumps(match).encode('utf-8') + b'\n')
+    except INPUT_ERRORS as ex:
+        data.append(format_error(ex))
+        ok = False
+    _write_chunk(writer, b''.join(data))
+    return ok
+
+def _write_chunk(writer, data):
+    if data:
+        writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+async def _respond(writer, status, result, content_type=JSON, close=False):
+    if isinstance(result, bytes):
+        data = result
+    else:
+        data = json.dumps(result).encode('utf-8')
+    head = ('HTTP/1.1 %s\r\n'
+            'Content-Type: %s\r\n'
+            'Content-Length: %d\r\n' % (status, content_type, len(data)))
+    if close:
+        head += 'Connection: close\r\n'
+    writer.write(head.encode('latin-1') + b'\r\n' + data)
+    await writer.drain()
+
+async def _read_body(reader, headers):
+    """Yield the body of a request, as chunks of bytes."""
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            data = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield data
+    else:
+        length = int(headers.get('content-length', 0))
+        while length > 0:
+            data = await reader.read(min(length, 65536))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', length)
+            length -= len(data)
+            yield data
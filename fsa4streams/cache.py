@@ -0,0 +1,160 @@
+"""
+Cache of checked and compiled structures.
+
+Checking and compiling a structure
+(and deep-copying it, for :meth:`FSA.from_dict <fsa4streams.fsa.FSA.from_dict>`)
+is much more expensive than running an FSA on a few events.
+:meth:`FSA.from_str <fsa4streams.fsa.FSA.from_str>`,
+:meth:`~fsa4streams.fsa.FSA.from_file` and
+:meth:`~fsa4streams.fsa.FSA.from_dict`
+therefore look up their structure in a process-wide :class:`StructureCache`
+(``FSA.structure_cache``, which can be set to None to disable it).
+
+Structures are identified by a hash of their canonical JSON form
+(and JSON strings by a hash of their text, to avoid parsing them again),
+so equal structures share the same entry.
+All FSAs created from the same entry share the structure and its compiled form;
+an FSA gets its own copy of the structure
+only when it is modified (see :class:`~fsa4streams.state.State`).
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from copy import deepcopy
+from hashlib import sha1
+import json
+from threading import Lock
+
+
+class StructureCache(object):
+    """A process-wide, size-bounded LRU cache of compiled structures.
+
+    At most `maxsize` structures are kept,
+    and the structures of as many JSON strings are remembered.
+    ``hits`` and ``misses`` count the lookups.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # hash of a JSON text -> key of its structure in _entries
+        self._texts = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._texts.clear()
+
+    def from_str(self, cls, json_str):
+        """Return a new instance of FSA subclass `cls` for `json_str`."""
+        text = json_str if isinstance(json_str, bytes) \
+            else json_str.encode('utf-8')
+        text_key = sha1(text).hexdigest()
+        entry = self._get_text(text_key)
+        if entry is None:
+            # the parsed structure is not shared with the caller, no copy needed
+            key, entry = self._lookup_structure(cls, json.loads(json_str),
+                                                False)
+            self._put_text(text_key, key)
+        return entry.instantiate(cls)
+
+    def from_dict(self, cls, structure):
+        """Return a new instance of FSA subclass `cls` for `structure`,
+        which is not modified nor kept.
+        """
+        try:
+            _, entry = self._lookup_structure(cls, structure, True)
+        except TypeError: # not JSON serializable
+            return cls(deepcopy(structure))
+        return entry.instantiate(cls)
+
+    def _lookup_structure(self, cls, structure, copy):
+        """Return the key and the entry of `structure`,
+        creating the entry if needed.
+        """
+        key = canonical_hash(structure)
+        entry = self._get(key)
+        if entry is None:
+            if copy:
+                structure = deepcopy(structure)
+            # raises ValueError if the structure is not valid
+            fsa = cls(structure)
+            entry = _Entry(fsa._structure, fsa._compile())
+            self._put(key, entry)
+        return key, entry
+
+    def _get_text(self, text_key):
+        """Return the entry of the JSON text hashed as `text_key`, or None.
+
+        Only hits are counted here;
+        on a miss, the lookup of the parsed structure is counted instead.
+        """
+        with self._lock:
+            texts = self._texts
+            entries = self._entries
+            key = texts.pop(text_key, None)
+            if key is None or key not in entries:
+                return None
+            texts[text_key] = key
+            entry = entries.pop(key)
+            entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def _put_text(self, text_key, key):
+        with self._lock:
+            texts = self._texts
+            texts[text_key] = key
+            while len(texts) > self.maxsize:
+                texts.popitem(last=False)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # most recently used last
+            self._entries[key] = entry
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            entries = self._entries
+            entries.pop(key, None)
+            entries[key] = entry
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+
+class _Entry(object):
+    """A checked structure and its compiled form, shared by several FSAs."""
+
+    __slots__ = ('structure', 'compiled')
+
+    def __init__(self, structure, compiled):
+        self.structure = structure
+        self.compiled = compiled
+
+    def instantiate(self, cls):
+        fsa = cls(self.structure, False)
+        fsa._compiled = self.compiled
+        fsa._shared = True
+        return fsa
+
+
+def canonical_hash(structure):
+    """Return the SHA-1 of the canonical JSON form of `structure`."""
+    canonical = json.dumps(structure, sort_keys=True, separators=(',', ':'),
+                           ensure_ascii=True)
+    return sha1(canonical.encode('ascii')).hexdigest()
+
+
+DEFAULT = StructureCache()
@@ -0,0 +1,311 @@
+"""
+Compiled form of an FSA structure.
+
+The JSON structure of an FSA (see :doc:`syntax`) is convenient to build,
+check and serialize, but not to run:
+every property of a state has to be looked up in the state itself,
+then in ``state_defaults``,
+then replaced by its default value.
+:class:`CompiledStructure` does this once and for all,
+producing an integer-indexed table of states,
+with resolved properties, pre-bound matchers
+(specialized for their condition when the matcher supports it,
+see :mod:`fsa4streams.matcher`)
+and resolved transition targets.
+
+A compiled structure is never modified;
+the :class:`~fsa4streams.fsa.FSA` rebuilds it
+whenever its structure is changed through its API.
+"""
+from __future__ import unicode_literals
+
+from .dfa import DFA
+from .history import retention
+from .matcher import DIRECTORY as matcher_directory, match_multiple_choices
+from .state import resolve_state_attribute
+
+
+class CompiledTransition(object):
+    """A transition whose target and matcher have been resolved.
+
+    ``data`` is the original transition (as found in the structure),
+    which is what matcher functions receive.
+    ``position`` is the rank of the transition in its state.
+    ``target`` is the index of the target state.
+    ``matcher`` is None for the default (equality) matcher.
+    """
+
+    __slots__ = ('data', 'position', 'condition', 'target', 'silent', 'matcher')
+
+    def __init__(self, data, position, target, matcher):
+        self.data = data
+        self.position = position
+        self.condition = data.get('condition')
+        self.target = target
+        self.silent = bool(data.get('silent'))
+        self.matcher = matcher
+
+    def match(self, event, token, fsa):
+        matcher = self.matcher
+        if matcher is None:
+            return self.condition == event
+        return matcher(self.data, event, token, fsa)
+
+
+class CompiledState(object):
+    """A state whose properties have been resolved.
+
+    ``final`` is true for terminal states without any transition;
+    tokens reaching them can be turned into a match immediately.
+    ``timed`` is true for states with a duration constraint.
+    ``history_limit`` is the number of items of the histories
+    exported for tokens in this state (None for all of them,
+    see :class:`~fsa4streams.history.Retention`).
+
+    Transitions using the default (equality) matcher
+    or the 'multiple-choices' matcher are indexed in ``dispatch``,
+    a dict mapping each event to the tuple of transitions it satisfies.
+    The other transitions are in ``scanned``,
+    and must be tried one by one.
+    """
+
+    __slots__ = ('index', 'id', 'terminal', 'max_noise', 'max_total_noise',
+                 'max_duration', 'max_total_duration',
+                 'transitions', 'default_transition', 'final', 'timed',
+                 'dispatch', 'scanned', 'history_limit')
+
+    def __init__(self, index, stateid):
+        self.index = index
+        self.id = stateid
+
+    def matching_transitions(self, event, token, fsa):
+        """Return the transitions satisfied by `event`, in their original order.
+        """
+        try:
+            indexed = self.dispatch.get(event, ())
+        except TypeError: # unhashable event
+            return [ t for t in self.transitions if t.match(event, token, fsa) ]
+        scanned = self.scanned
+        if not scanned:
+            return indexed
+        matched = [ t for t in scanned if t.match(event, token, fsa) ]
+        if not indexed:
+            return matched
+        return sorted(indexed + tuple(matched), key=_position)
+
+    def _build_dispatch(self):
+        dispatch = {}
+        scanned = []
+        for transition in self.transitions:
+            matcher = transition.matcher
+            condition = transition.condition
+            if matcher is None:
+                choices = (condition,)
+            elif matcher is match_multiple_choices \
+            and isinstance(condition, (list, tuple)):
+                choices = condition
+            else:
+                choices = None
+            if choices is None or not _all_hashable(choices):
+                scanned.append(transition)
+                continue
+            for choice in choices:
+                indexed = dispatch.get(choice, ())
+                if transition not in indexed:
+                    dispatch[choice] = indexed + (transition,)
+        self.dispatch = dispatch
+        self.scanned = tuple(scanned)
+
+    def __repr__(self):
+        return '<CompiledState %s %r>' % (self.index, self.id)
+
+
+def _position(transition):
+    return transition.position
+
+def _all_hashable(values):
+    try:
+        frozenset(values)
+    except TypeError:
+        return False
+    return True
+
+
+class CompiledStructure(object):
+    """The compiled form of an FSA structure.
+
+    The problems found while compiling the structure are stored in the
+    ``problems`` attribute; the compiled structure is only usable
+    if this list is empty.
+
+    ``states`` is the list of compiled states;
+    the ``start`` state always has index 0.
+    ``index`` maps every state identifier to its index.
+    ``history`` is the :class:`~fsa4streams.history.Retention` of the
+    histories of tokens, or None if they are kept in full.
+    """
+
+    def __init__(self, structure):
+        self.problems = problems = []
+        self._specialized_matchers = {}
+        self._dfa = None
+        self.allow_overlap = structure.get('allow_overlap', False)
+        self.default_matcher = default_matcher = \
+            structure.get('default_matcher')
+        if default_matcher is not None \
+        and default_matcher not in matcher_directory:
+            problems.append("Unsupported default matcher %r" % default_matcher)
+        try:
+            self.history = retention(structure.get('history'))
+        except ValueError as ex:
+            problems.append("%s" % ex)
+            self.history = None
+
+        states_data = structure['states']
+        if not 'start' in states_data:
+            problems.append("No start state")
+        stateids = sorted(states_data)
+        if 'start' in states_data:
+            stateids.remove('start')
+            stateids.insert(0, 'start')
+        self.index = index = dict(
+            (stateid, i) for i, stateid in enumerate(stateids)
+        )
+        self.states = states = [ CompiledState(i, stateid)
+                                 for i, stateid in enumerate(stateids) ]
+
+        terminals = 0
+        for state in states:
+            if self._compile_state(state, states_data[state.id], structure):
+                terminals += 1
+        if terminals == 0:
+            problems.append("No terminal state")
+            # NB: we do not check that the terminal state is reachable from starte state...
+            # TODO Should we?
+
+        self.start = states[0] if 'start' in index else None
+
+    def _compile_state(self, state, data, structure):
+        """Resolve the properties and transitions of `state`
+        from its `data` in `structure`, and return whether it is terminal.
+        """
+        problems = self.problems
+        resolve = lambda name, default: \
+            resolve_state_attribute(data, structure, name, default)
+        state.terminal = terminal = resolve('terminal', False)
+        state.max_noise = resolve('max_noise', 0)
+        state.max_total_noise = resolve('max_total_noise', None)
+        state.max_duration = resolve('max_duration', None)
+        state.max_total_duration = resolve('max_total_duration', None)
+        state.timed = bool(state.max_duration or state.max_total_duration)
+        transitions = data.get('transitions') or []
+        deftrans = resolve('default_transition', None)
+        if not transitions and not deftrans and not terminal:
+            problems.append("Non-terminal state %r has no transition" %
+                            state.id)
+            # NB: we do not check if it has only self-targeted transition
+            # which would be equally bad...
+            # TODO Should we?
+        if deftrans and state.max_noise != 0:
+            problems.append("State %r can not have both a default "
+                            "transition and max_noise > 0" % state.id)
+        state.transitions = tuple(
+            self._compile_transition(transition, position)
+            for position, transition in enumerate(transitions)
+        )
+        state._build_dispatch()
+        if deftrans:
+            state.default_transition = \
+                self._compile_transition(deftrans, None, True)
+        else:
+            state.default_transition = None
+        state.final = terminal and not transitions
+        history = self.history
+        if history is None:
+            state.history_limit = None
+        else:
+            state.history_limit = history.limit
+            self._check_retention(state)
+        return terminal
+
+    def _check_retention(self, state):
+        """Check that `state` is compatible with a restricted history.
+
+        When two tokens went through the same events,
+        the FSA uses their histories to decide which one inhibits the other;
+        it also checks the history of a token to know whether it supersedes
+        the pending match it inhibits.
+        A restricted history is therefore only allowed if tokens never share
+        their events, and never leave a terminal state silently:
+        transitions must be satisfied by distinct events
+        (so that tokens never fork, nor start in several states),
+        states must have no noise
+        (so that a new token can not catch up with an older one),
+        and transitions must not be silent.
+        """
+        problems = self.problems
+        spec = self.history.spec
+        if state.max_noise != 0:
+            problems.append("State %r can not have max_noise > 0 "
+                            "with history %r" % (state.id, spec))
+        for transition in state.transitions:
+            if transition.silent:
+                problems.append("Transition from %r can not be silent "
+                                "with history %r" % (state.id, spec))
+        if state.scanned and len(state.transitions) > 1:
+            problems.append("Transitions from %r must use indexable matchers "
+                            "with history %r" % (state.id, spec))
+        for event, transitions in state.dispatch.items():
+            if len(transitions) > 1:
+                problems.append("Event %r can not satisfy several transitions "
+                                "from %r with history %r"
+                                % (event, state.id, spec))
+
+    def dfa(self):
+        """Return the :class:`~fsa4streams.dfa.DFA` of this structure,
+        building it on the first call.
+        """
+        dfa = self._dfa
+        if dfa is None:
+            dfa = self._dfa = DFA(self)
+        return dfa
+
+    def _compile_transition(self, transition, position, default=False):
+        target = self.index.get(transition['target'])
+        if target is None:
+            self.problems.append("Transition to non-existing state %r" %
+                                 transition['target'])
+        matcher = None
+        matcher_name = transition.get('matcher')
+        if matcher_name is not None \
+        and matcher_name not in matcher_directory:
+            self.problems.append("Unsupported matcher %r" % matcher_name)
+        elif not default: # default transitions are never matched
+            matcher_name = matcher_name or self.default_matcher
+            matcher = matcher_directory.get(matcher_name)
+            compile_condition = getattr(matcher, 'compile', None)
+            if compile_condition is not None:
+                matcher = self._specialize_matcher(
+                    matcher_name, compile_condition, transition)
+        return CompiledTransition(transition, position, target, matcher)
+
+    def _specialize_matcher(self, matcher_name, compile_condition, transition):
+        """Return the matcher specialized for the condition of `transition`,
+        sharing it with any other transition having the same condition.
+        """
+        condition = transition.get('condition')
+        try:
+            key = (matcher_name, condition)
+            matcher = self._specialized_matchers.get(key)
+        except TypeError: # unhashable condition
+            key = matcher = None
+        if matcher is None:
+            try:
+                matcher = compile_condition(condition)
+            except ValueError as ex:
+                self.problems.append("Invalid condition in transition to %r: %s"
+                                     % (transition['target'], ex))
+                return None
+            if key is not None:
+                self._specialized_matchers[key] = matcher
+        return matcher
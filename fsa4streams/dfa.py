@@ -0,0 +1,373 @@
+"""
+Deterministic fast path.
+
+Many automata only use the default (equality) and 'multiple-choices'
+matchers, without noise, durations, default or silent transitions,
+and never have two transitions satisfied by the same event
+(nor restrict the history of their tokens).
+Running them does not require the general token machinery:
+every token follows a single path,
+and the only thing to remember about it
+is its current state and the last terminal state it went through.
+
+:class:`DFA` determinizes a compiled structure
+(by a subset construction from the 'start' state),
+and records why it is not eligible to the fast path, if it is not.
+Note that a subset containing more than one state makes the structure
+ineligible: the FSA reports a separate match for every path,
+which a powerset automaton can not distinguish.
+
+:meth:`DFA.run` then produces exactly the same matches as
+:meth:`FSA.feed <fsa4streams.fsa.FSA.feed>` would,
+and leaves the token set in the same state.
+The FSA uses it automatically when ingesting a batch of events at once
+(see :meth:`~fsa4streams.fsa.FSA.feed_batch`,
+:meth:`~fsa4streams.fsa.FSA.feed_all`...)
+while it is not busy and has no tracer.
+As the tokens are only stored back into the token set when the run stops,
+it is not used by generators such as
+:meth:`~fsa4streams.fsa.FSA.iter_feed`,
+which can be suspended while the FSA is in use.
+"""
+from __future__ import unicode_literals
+
+from .history import History
+from .tokens import Match, Token
+
+
+class DFA(object):
+    """The deterministic transition table of a compiled structure.
+
+    ``problems`` lists the reasons why the structure is not eligible
+    to the fast path; the other attributes are only meaningful if it is empty.
+    ``table`` is a list of dicts, one for each state (by index),
+    mapping events to the index of the target state;
+    like ``ids``, ``terminal`` and ``final``,
+    it is only filled for the states reached from the start state.
+    """
+
+    def __init__(self, compiled):
+        self.problems = problems = list(compiled.problems)
+        if problems:
+            return
+        if compiled.history is not None:
+            problems.append("Tokens have a restricted history %r"
+                            % (compiled.history.spec,))
+            return
+        states = compiled.states
+        self.states = states
+        self.allow_overlap = compiled.allow_overlap
+        # only filled for the states reached from the start state,
+        # so that the states of a MappedStructure are loaded lazily
+        self.ids = ids = [None] * len(states)
+        self.terminal = terminal = [False] * len(states)
+        self.final = final = [False] * len(states)
+        self.table = table = [None] * len(states)
+
+        # subset construction, from the start state;
+        # as it stops at non-singleton subsets, they are all singletons
+        seen = set([0])
+        todo = [0]
+        while todo:
+            state = states[todo.pop()]
+            index = state.index
+            ids[index] = state.id
+            terminal[index] = state.terminal
+            final[index] = state.final
+            table[index] = row = {}
+            self._check_state(state)
+            for event, transitions in state.dispatch.items():
+                if len(transitions) > 1:
+                    problems.append("Event %r leads from state %r to %s"
+                                    % (event, state.id,
+                                       _several(states, transitions)))
+                    continue
+                target = transitions[0].target
+                row[event] = target
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+
+    def _check_state(self, state):
+        problems = self.problems
+        if state.max_noise != 0:
+            problems.append("State %r has max_noise > 0" % state.id)
+        if state.max_total_noise is not None and state.max_total_noise < 0:
+            problems.append("State %r has a negative max_total_noise"
+                            % state.id)
+        if state.max_duration is not None \
+        or state.max_total_duration is not None:
+            problems.append("State %r has a duration constraint" % state.id)
+        if state.default_transition is not None:
+            problems.append("State %r has a default transition" % state.id)
+        states = self.states
+        for transition in state.transitions:
+            if transition.silent:
+                problems.append("Transition from %r to %r is silent"
+                                % (state.id, states[transition.target].id))
+        for transition in state.scanned:
+            problems.append("Transition from %r to %r can not be indexed "
+                            "(matcher %r)"
+                            % (state.id, states[transition.target].id,
+                               transition.data.get('matcher')))
+
+    def _lookup(self, index, event, fsa):
+        """Return the target of `event` from state `index`, or None."""
+        try:
+            return self.table[index].get(event)
+        except TypeError: # unhashable event
+            transitions = self.states[index].matching_transitions(event, None,
+                                                                  fsa)
+            return transitions[0].target if transitions else None
+
+    def run(self, tokens, items, timestamped, fsa):
+        """Make the empty token set `tokens` ingest all `items`,
+        and yield (index, match) pairs, like :meth:`FSA._run`.
+
+        Tokens are kept in a lightweight form,
+        and converted back into `tokens` when the run stops.
+        """
+        batch = _Batch(self, fsa)
+        lookup = self._lookup
+        table = self.table
+        start_row = table[0]
+        terminal = self.terminal
+        final = self.final
+        allow_overlap = self.allow_overlap
+        # tokens are stored with the same identifiers as in the token engine,
+        # so that matches are identical, and in the same order
+        running = {}
+        pending = {}
+        occupied = [0] * len(table)
+        buffer = batch.buffer
+        limit = 1024
+        next_id = tokens.next_id
+        clock = tokens.clock
+        batch.base = tokens.position
+        try:
+            for i, item in enumerate(items):
+                if timestamped:
+                    event, timestamp = item
+                    assert clock is None  or  timestamp >= clock
+                else:
+                    event = item
+                    timestamp = 0 if clock is None else clock+1
+                clock = timestamp
+                pos = batch.offset + len(buffer)
+                buffer.append(event)
+                matches = []
+                skip_create = False
+                arrived = None
+
+                for tokenid, run in list(running.items()):
+                    state = run.state
+                    try:
+                        target = table[state].get(event)
+                    except TypeError:
+                        target = lookup(state, event, fsa)
+                    if target is None:
+                        # noise; max_noise is 0, so the token is deleted
+                        del running[tokenid]
+                        occupied[state] -= 1
+                        inhibits = run.inhibits
+                        if terminal[state]:
+                            matches.append(batch.match(run, 1, inhibits))
+                            if inhibits is not None:
+                                pending.pop(inhibits, None)
+                        elif inhibits is not None:
+                            other = pending.pop(inhibits, None)
+                            if other is not None:
+                                matches.append(batch.match(other, 0, None))
+                        continue
+                    if state == 0:
+                        skip_create = True
+                    if terminal[state]:
+                        # keep a pending copy, replacing the previous one
+                        if run.inhibits is not None:
+                            pending.pop(run.inhibits, None)
+                        pending[next_id] = run.copy()
+                        run.inhibits = next_id
+                        next_id += 1
+                    occupied[state] -= 1
+                    occupied[target] += 1
+                    run.state = target
+                    run.updated = timestamp
+                    run.end = pos
+                    if final[target]:
+                        if arrived is None:
+                            arrived = []
+                        arrived.append(tokenid)
+
+                if not skip_create:
+                    try:
+                        target = start_row.get(event)
+                    except TypeError:
+                        target = lookup(0, event, fsa)
+                    if target is not None and not occupied[target]:
+                        running[next_id] = _Run(target, timestamp, pos)
+                        occupied[target] += 1
+                        if final[target]:
+                            if arrived is None:
+                                arrived = []
+                            arrived.append(next_id)
+                        next_id += 1
+
+                if arrived is not None:
+                    # tokens in a final state match immediately
+                    if len(arrived) > 1:
+                        # process them in the same order as the token engine
+                        arrived = set(arrived)
+                        arrived = [ tokenid for tokenid in running
+                                    if tokenid in arrived ]
+                    for tokenid in arrived:
+                        run = running.pop(tokenid)
+                        occupied[run.state] -= 1
+                        matches.append(batch.match(run, 0, run.inhibits))
+                        if run.inhibits is not None:
+                            pending.pop(run.inhibits, None)
+
+                if matches and not allow_overlap:
+                    max_updated = max( match['updated'] for match in matches )
+                    for tokenid, run in list(running.items()):
+                        if run.created <= max_updated:
+                            del running[tokenid]
+                            occupied[run.state] -= 1
+                    for tokenid, run in list(pending.items()):
+                        if run.created <= max_updated:
+                            del pending[tokenid]
+                    if len(matches) > 1:
+                        min_created = min( match['created']
+                                           for match in matches )
+                        matches = [ match for match in matches
+                                    if match['created'] == min_created ][:1]
+
+                if not running and not pending:
+                    next_id = 0
+
+                for match in matches:
+                    yield i, match
+
+                if len(buffer) >= limit:
+                    batch.trim(running, pending, pos+1)
+                    limit = 2*len(buffer) + 1024
+        finally:
+            batch.store(tokens, running, pending, next_id, clock)
+
+
+class _Batch(object):
+    """The events ingested during a :meth:`DFA.run`,
+    as far as they are needed to build the history of tokens.
+
+    ``offset`` is the position of the first event of ``buffer``,
+    and ``base`` is the position of the token set
+    (see :attr:`TokenSet.position`) when the run started.
+    """
+
+    def __init__(self, dfa, fsa):
+        self.dfa = dfa
+        self.fsa = fsa
+        self.buffer = []
+        self.offset = 0
+        self.base = 0
+
+    def trim(self, running, pending, default):
+        """Forget the events that are not in any token's history."""
+        first = default
+        for run in running.values():
+            if run.start < first:
+                first = run.start
+        for run in pending.values():
+            if run.start < first:
+                first = run.start
+        drop = first - self.offset
+        if drop > 0:
+            del self.buffer[:drop]
+            self.offset = first
+
+    def histories(self, run):
+        """Return the event and state histories of `run`, as lists."""
+        dfa = self.dfa
+        ids = dfa.ids
+        offset = self.offset
+        events = self.buffer[run.start-offset:run.end-offset+1]
+        states = []
+        state = run.first
+        for event in events[1:]:
+            states.append(ids[state])
+            state = dfa._lookup(state, event, self.fsa)
+        return events, states
+
+    def match(self, run, noise, inhibits):
+        """Return `run` as a :class:`Match`."""
+        events, states = self.histories(run)
+        base = self.base
+        ret = Match(start=base+run.start, end=base+run.end)
+        ret['state'] = self.dfa.ids[run.state]
+        ret['created'] = run.created
+        ret['updated'] = run.updated
+        ret['noise_state'] = noise
+        ret['noise_total'] = noise
+        ret['history_events'] = events
+        ret['history_states'] = states
+        if inhibits is not None:
+            ret['inhibits'] = '%d' % inhibits
+        return ret
+
+    def store(self, tokens, running, pending, next_id, clock):
+        """Convert all runs into tokens of `tokens`."""
+        states = self.dfa.states
+        base = self.base
+        inhibitors = {}
+        for tokenid, run in running.items():
+            events, history = self.histories(run)
+            running[tokenid] = Token(states[run.state], run.created,
+                                     run.updated, 0, 0,
+                                     History.from_list(events),
+                                     History.from_list(history),
+                                     run.inhibits,
+                                     base+run.start, base+run.end)
+            if run.inhibits is not None:
+                inhibitors[run.inhibits] = 1
+        for tokenid, run in pending.items():
+            events, history = self.histories(run)
+            pending[tokenid] = Token(states[run.state], run.created,
+                                     run.updated, 0, 0,
+                                     History.from_list(events),
+                                     History.from_list(history),
+                                     None, base+run.start, base+run.end)
+        tokens.running = running
+        tokens.pending = pending
+        tokens.inhibitors = inhibitors
+        tokens.deadlines = []
+        tokens.next_id = next_id
+        tokens.clock = clock
+        tokens.position = base + self.offset + len(self.buffer)
+
+
+class _Run(object):
+    """A token of the fast path.
+
+    ``first`` is the state where it was created,
+    ``start`` and ``end`` are the positions of its first and last events.
+    """
+
+    __slots__ = ('state', 'first', 'created', 'updated', 'start', 'end',
+                 'inhibits')
+
+    def __init__(self, state, timestamp, pos):
+        self.state = self.first = state
+        self.created = self.updated = timestamp
+        self.start = self.end = pos
+        self.inhibits = None
+
+    def copy(self):
+        ret = _Run(self.first, self.created, self.start)
+        ret.state = self.state
+        ret.updated = self.updated
+        ret.end = self.end
+        return ret
+
+
+def _several(states, transitions):
+    return "several states (%s)" % ", ".join(
+        repr(states[t.target].id) for t in transitions)
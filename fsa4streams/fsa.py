@@ -4,19 +4,32 @@ Finite State Automata
 from __future__ import unicode_literals
 
 from copy import deepcopy
-from itertools import chain
 import json
 import logging
-from uuid import uuid4
-
-from matcher import DIRECTORY as matcher_directory
-from state import State
+try:
+    from itertools import izip
+except ImportError: # Python 3
+    izip = zip
+
+from . import cache
+from .compiled import CompiledStructure
+from . import mapped
+from .history import EMPTY as EMPTY_HISTORY
+from .matcher import DIRECTORY as matcher_directory
+from . import snapshot
+from .state import State
+from .tokens import Token, TokenSet
+from .tracer import LoggingTracer
 
 LOG = logging.getLogger(__name__)
+_LOGGING_TRACER = LoggingTracer(LOG)
 
 class FSA(object):
     """A Finite State Automaton."""
 
+    # the cache used by the from_* methods (see :mod:`fsa4streams.cache`)
+    structure_cache = cache.DEFAULT
+
     # FSA constuction
 
     def __init__(self, structure, check_structure=True):
@@ -24,22 +37,62 @@ class FSA(object):
         DON'T USE THIS CONSTRUCTOR DIRECTLY.
         YOU SHOULD RATHER USE ONE OF THE from_* STATIC METHODS.
         """
-        self._structure = structure
-        self._tokens = { 'clock': None, 'running': {}, 'pending': {} }
+        self._structure_data = structure
+        self._shared = False
+        self._compiled = None
+        self._tokens = TokenSet()
+        self._checkpoint = None
+        self._fingerprint = None
+        self.tracer = None
+        self.sink = None
+        self.use_dfa = True
         if check_structure:
             self.check_structure(True)
 
     @classmethod
     def from_str(cls, json_str):
-        return cls(json.loads(json_str))
+        if cls.structure_cache is None:
+            return cls(json.loads(json_str))
+        return cls.structure_cache.from_str(cls, json_str)
 
     @classmethod
     def from_file(cls, json_filelike):
-        return cls(json.load(json_filelike))
+        if cls.structure_cache is None:
+            return cls(json.load(json_filelike))
+        return cls.structure_cache.from_str(cls, json_filelike.read())
 
     @classmethod
     def from_dict(cls, dictobj):
-        return cls(deepcopy(dictobj))
+        if cls.structure_cache is None:
+            return cls(deepcopy(dictobj))
+        return cls.structure_cache.from_dict(cls, dictobj)
+
+    @classmethod
+    def open_compiled(cls, path, structure=None):
+        """Return an FSA running the compiled structure in file `path`
+        (see :meth:`export_compiled`).
+
+        The file is mapped in memory, and its states are only loaded
+        when needed; the structure itself is only loaded if it is accessed.
+        If `structure` is provided, raise ValueError if the file
+        was not compiled from an equal structure.
+        """
+        compiled = mapped.MappedStructure(path)
+        if structure is not None \
+        and cache.canonical_hash(structure) != compiled.hash:
+            raise ValueError("%s was not compiled from this structure" % path)
+        fsa = cls(None, False)
+        fsa._compiled = compiled
+        return fsa
+
+    def export_compiled(self, path):
+        """Write the compiled structure of this FSA to file `path`,
+        to be opened with :meth:`open_compiled`
+        (see :mod:`fsa4streams.mapped`).
+
+        Raise ValueError if the structure is not valid.
+        """
+        mapped.write(path, self._structure, self._compiled_for_running())
 
     @classmethod
     def make_empty(cls, **kw):
@@ -56,57 +109,74 @@ class FSA(object):
         """
         if stateid in self._structure['states']:
             raise ValueError("State %r already present in FSA" % stateid)
+        self._own_structure()
         self._structure['states'][stateid] = data = { 'transitions': [] }
         data.update(kw)
+        self._structure_changed()
         return State(self, stateid)
 
     def check_structure(self, raises=True):
-        problems = []
-
-        default_matcher = self._structure.get('default_matcher')
-        if default_matcher is not None \
-        and default_matcher not in matcher_directory:
-            problems.append("Unsupported default matcher %r" % default_matcher)
-
-        states = self._structure['states']
-        if not 'start' in states:
-            problems.append("No start state")
-        terminals = 0
-        for stateid in states:
-            state = State(self, stateid)
-            terminal = state.terminal
-            transitions = list(state.transitions)
-            deftrans = state.default_transition
-            if terminal:
-                terminals += 1
-            if not transitions and not deftrans and not terminal:
-                problems.append("Non-terminal state %r has no transition" %
-                                stateid)
-                # NB: we do not check if it has only self-targeted transition
-                # which would be equally bad...
-                # TODO Should we?
-            if deftrans:
-                if state.max_noise != 0:
-                    problems.append("State %r can not have both a default "
-                                    "transition and max_noise > 0" % stateid)
-                transitions = chain(transitions, [deftrans])
-            for transition in transitions:
-                if transition['target'] not in states:
-                    problems.append("Transition to non-existing state %r" %
-                                    transition['target'])
-                matcher = transition.get('matcher')
-                if matcher is not None \
-                and matcher not in matcher_directory:
-                    problems.append("Unsupported matcher %r" % matcher)
-        if terminals == 0:
-            problems.append("No terminal state")
-            # NB: we do not check that the terminal state is reachable from starte state...
-            # TODO Should we?
-
+        problems = self._compile().problems
         if problems:
             raise ValueError("\n".join(problems))
         return problems
 
+    def check_dfa(self):
+        """
+        Return the list of reasons why the deterministic fast path
+        (see :mod:`fsa4streams.dfa`) can not be used with this FSA,
+        or an empty list if it can.
+
+        The fast path is used automatically (unless ``use_dfa`` is false)
+        when ingesting a batch of events while the FSA is not busy.
+        """
+        return list(self._compile().dfa().problems)
+
+    def _compile(self):
+        """Return the compiled form of this FSA's structure,
+        building it if the structure changed since it was last compiled.
+        """
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = CompiledStructure(self._structure)
+            if self._tokens.is_busy() and not compiled.problems:
+                self._tokens.rebind(compiled)
+        return compiled
+
+    def _compiled_for_running(self):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compile()
+        if compiled.problems:
+            raise ValueError("\n".join(compiled.problems))
+        return compiled
+
+    @property
+    def _structure(self):
+        structure = self._structure_data
+        if structure is None:
+            # opened with open_compiled: load it from the file
+            structure = self._structure_data = self._compiled.load_structure()
+        return structure
+
+    @_structure.setter
+    def _structure(self, structure):
+        self._structure_data = structure
+
+    def _own_structure(self):
+        """Must be called before self._structure is modified.
+
+        If the structure is shared with other FSAs (see :mod:`fsa4streams.cache`),
+        this FSA gets its own copy.
+        """
+        if self._shared:
+            self._structure = deepcopy(self._structure)
+            self._shared = False
+
+    def _structure_changed(self):
+        """Must be called whenever self._structure is modified."""
+        self._compiled = None
+
 
     # access to structure
 
@@ -120,10 +190,14 @@ class FSA(object):
     def allow_overlap(self, value):
         if type(value) is not bool:
             raise ValueError('FSA.allow_overlap must be a bool')
+        self._own_structure()
         self._structure['allow_overlap'] = value
+        self._structure_changed()
     @allow_overlap.deleter
     def allow_overlap(self):
+        self._own_structure()
         del self._structure['allow_overlap']
+        self._structure_changed()
 
     @property
     def default_matcher(self):
@@ -132,10 +206,14 @@ class FSA(object):
     def default_matcher(self, value):
         if value not in matcher_directory:
             raise ValueError('FSA.default_matcher must be in matcher.DIRECTORY')
+        self._own_structure()
         self._structure['default_matcher'] = value
+        self._structure_changed()
     @default_matcher.deleter
     def default_matcher(self):
+        self._own_structure()
         del self._structure['default_matcher']
+        self._structure_changed()
 
     def export_structure_as_dict(self):
         return deepcopy(self._structure)
@@ -150,50 +228,83 @@ class FSA(object):
     # tokens management
 
     def reset(self):
-        self._tokens['running'].clear()
-        self._tokens['pending'].clear()
-        self._tokens['clock'] = None
+        self._tokens.clear()
 
     def is_busy(self):
-        return len(self._tokens['running']) > 0 \
-            or len(self._tokens['pending']) > 0
+        return self._tokens.is_busy()
 
     def load_tokens_from_str(self, json_str, force=False):
-        if self.is_busy() and not force:
-            raise ValueError('Can not load a tokens on a busy FSA')
-        self._tokens = json.loads(json_str)
-        self._check_tokens()
+        self.load_tokens_from_dict(json.loads(json_str), force)
 
     def load_tokens_from_file(self, json_filelike, force=False):
+        self.load_tokens_from_dict(json.load(json_filelike), force)
+
+    def load_tokens_from_dict(self, dictobj, force=False):
         if self.is_busy() and not force:
             raise ValueError('Can not load a tokens on a busy FSA')
-        self._tokens = json.load(json_filelike)
-        self._check_tokens()
+        self._tokens.load_dict(dictobj, self._compiled_for_running())
 
-    def load_tokens_from_dict(self, dictobj, force=False):
+    def load_tokens_from_bytes(self, data, force=False):
+        """Load tokens from a binary snapshot
+        (bytes, bytearray or memoryview, see :mod:`fsa4streams.snapshot`)."""
         if self.is_busy() and not force:
             raise ValueError('Can not load a tokens on a busy FSA')
-        self._tokens = deepcopy(dictobj)
-        self._check_tokens()
-
-    def _check_tokens(self):
-        states = self._structure['states']
-        all_tokens = chain(self._tokens['running'].iteritems(),
-                           self._tokens['pending'].iteritems())
-        for tokenid, token in all_tokens:
-            if token['state'] not in states:
-                raise ValueError("Inconsistent position "
-                                 "(non-existing state %r)"
-                                     % token['state'])
+        snapshot.load(data, self._tokens, self._compiled_for_running())
 
     def export_tokens_as_dict(self):
-        return deepcopy(self._tokens)
+        return self._tokens.as_dict()
 
     def export_tokens_as_string(self, *args, **kw):
-        return json.dumps(self._tokens, *args, **kw)
+        return json.dumps(self._tokens.as_dict(), *args, **kw)
 
     def export_tokens_to_file(self, fp, *args, **kw):
-        return json.dump(self._tokens, fp, *args, **kw)
+        return json.dump(self._tokens.as_dict(), fp, *args, **kw)
+
+    def export_token_delta(self, since=None):
+        """Return the changes of the tokens since checkpoint `since`,
+        and make a new checkpoint.
+
+        The returned dict has the format described in
+        :meth:`TokenSet.as_delta <fsa4streams.tokens.TokenSet.as_delta>`,
+        plus the ``since`` checkpoint and the new ``checkpoint``.
+        Unchanged tokens are not serialized.
+
+        If `since` is None, the delta contains all tokens;
+        else it must be the last checkpoint of this FSA.
+        """
+        if since is not None and since != self._checkpoint:
+            raise ValueError('Unknown checkpoint %r' % (since,))
+        fingerprint = self._fingerprint if since is not None else None
+        ret = self._tokens.as_delta(fingerprint)
+        self._checkpoint = (self._checkpoint or 0) + 1
+        self._fingerprint = self._tokens.fingerprint()
+        ret['since'] = since
+        ret['checkpoint'] = self._checkpoint
+        return ret
+
+    def apply_token_delta(self, delta):
+        """Apply `delta` (see :meth:`export_token_delta`) to the tokens.
+
+        Unless its ``since`` checkpoint is None
+        (in which case the tokens are replaced),
+        the delta must be relative to the last checkpoint of this FSA.
+        Its new checkpoint becomes the last checkpoint of this FSA,
+        so that deltas can be replayed in order.
+        """
+        since = delta['since']
+        if since is None:
+            self._tokens.clear()
+        elif since != self._checkpoint:
+            raise ValueError('Delta from checkpoint %r can not be applied '
+                             'on checkpoint %r' % (since, self._checkpoint))
+        self._tokens.apply_delta(delta, self._compiled_for_running())
+        self._checkpoint = delta['checkpoint']
+        self._fingerprint = self._tokens.fingerprint()
+
+    def export_tokens_as_bytes(self):
+        """Return the tokens as a binary snapshot
+        (see :mod:`fsa4streams.snapshot`)."""
+        return snapshot.dump(self._tokens)
 
 
     # running the FSA
@@ -205,36 +316,46 @@ class FSA(object):
         else:
             return matcher_directory[transition_type](transition, event, token, self)
 
-    def _delete_token(self, tokenid, token, token_state,
-                      running, pending, matches, allow_match=True):
-        del running[tokenid]
-        is_match = token_state.terminal
+    def _delete_token(self, tokenid, token, tokens, pending, matches, trace,
+                      reason, allow_match=True):
+        """Remove running token `tokenid`,
+        turning it into a match if possible,
+        else tracing it as dropped for `reason`.
+        """
+        tokens.remove_running(tokenid)
+        is_match = token.state.terminal
         if is_match and allow_match:
-            LOG.debug('    matched')
             matches.append(token)
-        else:
-            LOG.debug('    was dropped')
-        otherid = token.get('inhibits')
+            if trace is not None:
+                trace.matched(tokenid, token)
+        elif trace is not None:
+            trace.dropped(tokenid, token, reason)
+        otherid = token.inhibits
         if otherid is None:
             return
         other = pending.get(otherid)
         if other is None:
             # it has already been deleted
             return
-        LOG.debug('    it was inhibiting a pending match in %r', other['state'])
         must_delete = is_match and (
-            other['state'] == token['state']
-            or other['state'] in token ['history_states']
+            other.state is token.state
+            # with a restricted history, 'other' can only be
+            # the pending copy of 'token' (see CompiledStructure)
+            or self._compiled.history is not None
+            or other.state.id in token.history_states
         )
         if must_delete:
             del pending[otherid]
+            if trace is not None:
+                trace.dropped(otherid, other, 'superseded')
         else:
-            if not [ t for t in running.itervalues() if t.get('inhibits') == otherid ]:
+            if not tokens.is_inhibited(otherid):
                 # noone else was inhibiting 'other',
                 # so 'other' is not inhibited anymore
                 del pending[otherid]
                 matches.append(other)
-                LOG.debug('      making it an actual match')
+                if trace is not None:
+                    trace.matched(otherid, other)
 
 
     def feed(self, event, timestamp=None):
@@ -249,12 +370,12 @@ class FSA(object):
         the default value is the previous timestamp + 1.
         Timestamps are used to check ``max_duration`` constraints.
         """
-        clock = self._tokens['clock']
-        running = self._tokens['running']
-        pending = self._tokens['pending']
-        skip_create = False
-        matches = []
+        return self._feed(self._tokens, event, timestamp)
 
+    def _feed(self, tokens, event, timestamp):
+        """Implementation of :meth:`feed` on any token set."""
+        compiled = self._compiled_for_running()
+        clock = tokens.clock
         if timestamp is None:
             if clock is None:
                 timestamp = 0
@@ -262,8 +383,45 @@ class FSA(object):
                 timestamp = clock+1
         else:
             assert clock is None  or  timestamp >= clock
+        matches = self._step(compiled, tokens, event, timestamp,
+                             self._get_tracer())
+        return self._output([ match.as_match() for match in matches ])
+
+    def _output(self, matches):
+        """Write the list of `matches` to the sink, if any, and return it."""
+        sink = self.sink
+        if sink is not None and matches:
+            for match in matches:
+                sink.write(match)
+        return matches
+
+    def _get_tracer(self):
+        """Return the tracer to use, or None if tracing is disabled."""
+        tracer = self.tracer
+        if tracer is None and LOG.isEnabledFor(logging.DEBUG):
+            tracer = _LOGGING_TRACER
+        return tracer
+
+    def _step(self, compiled, tokens, event, timestamp, trace):
+        """Make `tokens` ingest `event`,
+        and return the list of matching tokens (as Token instances).
+
+        `timestamp` must have been checked and computed by the caller,
+        and `trace` is the tracer to notify, or None.
+        """
+        states = compiled.states
+        history = compiled.history
+        running = tokens.running
+        pending = tokens.pending
+        position = tokens.position
+        delete_token = self._delete_token
+        skip_create = False
+        matches = []
 
-        LOG.debug('event %r at timestamp %s', event, timestamp)
+        if trace is not None:
+            trace.event(event, timestamp)
+
+        expired = tokens.pop_expired(timestamp) if tokens.deadlines else None
 
         # Make each running token take the event into account
         # - some of them will walk through a transition,
@@ -271,41 +429,39 @@ class FSA(object):
         # - the others will be removed.
         # A token removed from a final state is a match,
         # else it is plainly discarded.
-        for tokenid, token in running.items():
+        for tokenid, token in list(running.items()):
 
-            oldstateid = token['state']
-            LOG.debug('  token in %r', oldstateid)
-            oldstate = self[oldstateid]
+            oldstate = token.state
 
             # delete token if a max_duration has expired
-            if oldstate.max_total_duration \
-            and timestamp-token['created'] > oldstate.max_total_duration \
-            or oldstate.max_duration \
-            and timestamp-token['updated'] > oldstate.max_duration:
-                LOG.debug('    was dropped because it exceeded max_duration')
-                self._delete_token(tokenid, token, oldstate, running, pending, matches)
+            if expired and tokenid in expired:
+                delete_token(tokenid, token, tokens, pending, matches, trace,
+                             expired[tokenid])
                 continue
 
-
-            possible_transitions = [ t for t in oldstate.transitions
-                            if self.match(t, event, token) ]
+            possible_transitions = oldstate.matching_transitions(event, token,
+                                                                 self)
             if not possible_transitions:
                 deftrans = oldstate.default_transition
                 if deftrans:
-                    possible_transitions = [ deftrans ]
+                    possible_transitions = ( deftrans, )
 
             # deleting token (it may or may not match)
             if not possible_transitions:
-                LOG.debug('    added noise')
-                token['noise_state'] += 1
-                token['noise_total'] += 1
-                if token['noise_state'] > oldstate.max_noise \
-                or oldstate.max_total_noise is not None \
-                and token['noise_total'] > oldstate.max_total_noise:
-                    self._delete_token(tokenid, token, oldstate, running, pending, matches)
+                token.noise_state += 1
+                token.noise_total += 1
+                if trace is not None:
+                    trace.noise(tokenid, token)
+                if token.noise_state > oldstate.max_noise:
+                    delete_token(tokenid, token, tokens, pending, matches,
+                                 trace, 'max_noise')
+                elif oldstate.max_total_noise is not None \
+                and token.noise_total > oldstate.max_total_noise:
+                    delete_token(tokenid, token, tokens, pending, matches,
+                                 trace, 'max_total_noise')
                 continue
 
-            if oldstateid == 'start':
+            if oldstate.index == 0:
                 # an old token is on start,
                 # so any new token starting there would be redundant
                 skip_create = True
@@ -313,165 +469,342 @@ class FSA(object):
             # this token *might* be a match
             # if no further transition leads to a match;
             if oldstate.terminal:
-                LOG.debug('    keeping a pending match')
-                otherid = token.pop('inhibits', None)
-                if otherid:
+                otherid = token.inhibits
+                if otherid is not None:
+                    tokens.inhibit(token, None)
                     # pending token is overriden by this new match
                     previous = pending.pop(otherid, None)
                     # NB: inhibited token may have been deleted already
-                    if previous is not None:
-                        LOG.debug('      and dropping previous pending match in %r',
-                                  previous['state'])
+                    if previous is not None and trace is not None:
+                        trace.dropped(otherid, previous, 'superseded')
                 # create new pending token
-                newid = uuid4().hex
-                pending_token = deepcopy(token)
-                pending[newid] = pending_token
-                token['inhibits'] = newid
+                newid = tokens.new_id()
+                pending[newid] = token.copy()
+                tokens.inhibit(token, newid)
+                if trace is not None:
+                    trace.pending(newid, pending[newid], tokenid)
 
             # pushing token through first transition
-            newstateid = possible_transitions[0]['target']
-            LOG.debug('    moved to %r', newstateid)
-            token['state'] = newstateid
-            token['noise_state'] = 0
-            token['updated'] = timestamp
-            if not possible_transitions[0].get('silent'):
-                token['history_events'].append(event)
-                token['history_states'].append(oldstateid)
-            else:
-                LOG.debug('      (silently)')
+            transition = possible_transitions[0]
+            newstate = states[transition.target]
+            token.state = newstate
+            token.noise_state = 0
+            token.updated = timestamp
+            token.end = position
+            if not transition.silent:
+                if history is None:
+                    token.history_events = token.history_events.push(event)
+                    token.history_states = \
+                        token.history_states.push(oldstate.id)
+                else:
+                    history.push(token, event, oldstate.id, timestamp)
+            if trace is not None:
+                trace.moved(tokenid, token, oldstate, transition)
 
-            newstate = self[newstateid]
             if newstate.max_total_noise is not None \
-            and token['noise_total'] > newstate.max_total_noise:
-                LOG.debug('      and was dropped (max_total_noise exceeded)')
-                self._delete_token(tokenid, token, newstate, running, pending, matches, False)
-            if newstate.max_total_duration is not None \
-            and timestamp-token['created'] > newstate.max_total_duration:
-                LOG.debug('      and was dropped (max_total_duration exceeded)')
-                self._delete_token(tokenid, token, newstate, running, pending, matches, False)
+            and token.noise_total > newstate.max_total_noise:
+                delete_token(tokenid, token, tokens, pending, matches, trace,
+                             'max_total_noise', False)
+            elif newstate.max_total_duration is not None \
+            and timestamp-token.created > newstate.max_total_duration:
+                delete_token(tokenid, token, tokens, pending, matches, trace,
+                             'max_total_duration', False)
+            elif newstate.timed and (newstate is not oldstate
+                                     or newstate.max_duration):
+                # (otherwise, the deadline has not changed)
+                tokens.schedule(tokenid, token)
 
             # cloning token through other transitions (non-deterministic FSA)
             for transition in possible_transitions[1:]:
-                LOG.debug('    also moved to %r', transition['target'])
-                newtoken = deepcopy(token)
-                newtoken['state'] = transition['target']
-                newid = uuid4().hex
-                running[newid] = newtoken
+                newtoken = token.copy()
+                newtoken.state = states[transition.target]
+                newid = tokens.add_running(newtoken)
+                if trace is not None:
+                    trace.forked(newid, newtoken, tokenid)
 
         # Create a new token for each transition of the 'start' state
         # that is satisfied by the current event
         # (unless an existing token just left the start state).
         if not skip_create:
-            starting_transitions = [ t for t in self['start'].transitions
-                                     if self.match(t, event, None) ]
+            starting_transitions = compiled.start.matching_transitions(event,
+                                                                       None,
+                                                                       self)
             if starting_transitions:
-                forbidden = set( t['state'] for t in running.itervalues()
-                                 if t['noise_state'] == 0 )
+                forbidden = set( t.state for t in running.values()
+                                 if t.noise_state == 0 )
 
                 for transition in starting_transitions:
-                    if transition['target'] in forbidden:
+                    target = states[transition.target]
+                    if target in forbidden:
                         continue
-                    LOG.debug('  new token in %r', transition['target'])
-                    newtoken = {
-                        "state": transition['target'],
-                        "created": timestamp,
-                        "updated": timestamp,
-                        "noise_state": 0,
-                        "noise_total": 0,
-                        "history_events": [ event ],
-                        "history_states": []
-                    }
-                    newid = uuid4().hex
-                    running[newid] = newtoken
+                    if history is None:
+                        events = EMPTY_HISTORY.push(event)
+                    else:
+                        events = history.start(event, timestamp)
+                    newtoken = Token(target, timestamp, timestamp, 0, 0,
+                                     events, EMPTY_HISTORY, None,
+                                     position, position)
+                    newid = tokens.add_running(newtoken)
+                    if trace is not None:
+                        trace.created(newid, newtoken)
 
         # Immediately handle tokens on a final state with no transition
         # (no need to wait for the next event to do that...)
         # This may not result to an immediate match if another running token
         # has the exact same history...
-        for tokenid, token in running.items():
-            token_state = self[token['state']]
-            if token_state.terminal and len(token_state.transitions) == 0:
-                LOG.debug('  token now in %r (final)', token['state'])
-                inhibited = False
-                for otherid, other in running.items():
-                    if other is token:
-                        continue
-                    if other['history_events'] == token['history_events']:
-                        LOG.debug('    is kept pending (inhibited by token in %r)', other['state'])
-                        inhibitedid = other.get('inhibits')
-                        if inhibitedid is not None:
-                            dropped = pending.pop(inhibitedid, None)
-                            if dropped:
-                                if dropped['state'] == token['state'] \
-                                or dropped['state'] in token['history_states']:
-                                    LOG.debug('      dropping older pending token in %r',
-                                              dropped['state'])
-                                else:
-                                    matches.append(dropped)
-                                    LOG.debug('      freeing older pending token in %r to match',
-                                              dropped['state'])
-                        other['inhibits'] = tokenid
-                        inhibited = True
-                if inhibited:
-                    pending[tokenid] = token
-                    del running[tokenid]
-                else:
-                    self._delete_token(tokenid, token, token_state, running, pending, matches)
-
-        self._tokens['clock'] = timestamp
-
-        if matches and not self.allow_overlap:
-            # drop all remaining tokens overlapping with matches,
-            max_updated = max (match['updated'] for match in matches )
-            for d in (running, pending):
-                for tokenid, token in d.items():
-                    if token['created'] <= max_updated:
-                        del d[tokenid]
-                        LOG.debug('  dropping token %r to prevent overlap',
-                                  tokenid)
-            # drop all matches that are overlapped by another match
-            if len(matches) > 1:
-                min_created = min( match['created'] for match in matches)
-                matches = [ match for match in matches
-                            if match['created'] == min_created ]
-                if len(matches) > 1:
-                    matches = matches[:1]
-                LOG.debug("to prevent overlap, only 1 match kept")
+        finals = [ (tokenid, token) for tokenid, token in running.items()
+                   if token.state.final ]
+        if finals:
+            # index running tokens by history, to find the inhibitors
+            # (with a restricted history, there are none)
+            same_history = {}
+            if history is None:
+                for tokenid, token in running.items():
+                    same_history.setdefault(token.history_events, []) \
+                        .append(tokenid)
+        for tokenid, token in finals:
+            if tokenid not in running:
+                continue
+            inhibited = False
+            for otherid in same_history.get(token.history_events, ()):
+                other = running.get(otherid)
+                if other is None or other is token:
+                    continue
+                inhibitedid = other.inhibits
+                if inhibitedid is not None:
+                    dropped = pending.pop(inhibitedid, None)
+                    if dropped:
+                        if dropped.state is token.state \
+                        or dropped.state.id in token.history_states:
+                            if trace is not None:
+                                trace.dropped(inhibitedid, dropped,
+                                              'superseded')
+                        else:
+                            matches.append(dropped)
+                            if trace is not None:
+                                trace.matched(inhibitedid, dropped)
+                tokens.inhibit(other, tokenid)
+                if trace is not None and not inhibited:
+                    trace.pending(tokenid, token, otherid)
+                inhibited = True
+            if inhibited:
+                tokens.remove_running(tokenid)
+                pending[tokenid] = token
+            else:
+                delete_token(tokenid, token, tokens, pending, matches, trace,
+                             None)
+
+        tokens.clock = timestamp
+        tokens.position = position + 1
+
+        if matches and not compiled.allow_overlap:
+            matches = self._drop_overlaps(tokens, matches, trace)
+
+        if not running and not pending:
+            tokens.settle()
 
         return matches
 
+    def _drop_overlaps(self, tokens, matches, trace):
+        """Drop all tokens overlapping with `matches`,
+        and return the matches that are not overlapped by another one.
+        """
+        running = tokens.running
+        pending = tokens.pending
+        # drop all remaining tokens overlapping with matches,
+        max_updated = max (match.updated for match in matches )
+        for tokenid, token in list(running.items()):
+            if token.created <= max_updated:
+                tokens.remove_running(tokenid)
+                if trace is not None:
+                    trace.dropped(tokenid, token, 'overlap')
+        for tokenid, token in list(pending.items()):
+            if token.created <= max_updated:
+                del pending[tokenid]
+                if trace is not None:
+                    trace.dropped(tokenid, token, 'overlap')
+        # drop all matches that are overlapped by another match
+        if len(matches) > 1:
+            min_created = min( match.created for match in matches)
+            kept = [ match for match in matches
+                     if match.created == min_created ][:1]
+            if trace is not None:
+                for match in matches:
+                    if match is not kept[0]:
+                        trace.dropped(None, match, 'overlap')
+            matches = kept
+        return matches
+
+    def advance_clock(self, timestamp):
+        """
+        I advance my clock to `timestamp` without any event,
+        and return the list of matching tokens
+        produced by the tokens expiring in the meantime.
+
+        ``timestamp`` must be greater or equal than all previous timestamps.
+        This makes matches available as soon as possible
+        when no event is coming,
+        as tokens are otherwise only expired by the next event.
+        """
+        return self._advance_clock(self._tokens, timestamp)
+
+    def _advance_clock(self, tokens, timestamp):
+        """Implementation of :meth:`advance_clock` on any token set."""
+        compiled = self._compiled_for_running()
+        clock = tokens.clock
+        assert clock is None  or  timestamp >= clock
+        trace = self._get_tracer()
+        if trace is not None:
+            trace.advanced(timestamp)
+        matches = []
+        if tokens.deadlines:
+            expired = tokens.pop_expired(timestamp)
+            running = tokens.running
+            pending = tokens.pending
+            for tokenid in sorted(expired):
+                self._delete_token(tokenid, running[tokenid], tokens, pending,
+                                   matches, trace, expired[tokenid])
+        tokens.clock = timestamp
+        if matches and not compiled.allow_overlap:
+            matches = self._drop_overlaps(tokens, matches, trace)
+        tokens.settle()
+        return self._output([ match.as_match() for match in matches ])
+
+    def _run(self, tokens, items, timestamped=False, eager=False):
+        """Make `tokens` ingest all `items`,
+        and return an iterator of (index, match) pairs,
+        where index is the rank of the item in `items`.
+
+        If `timestamped` is true, items are (event, timestamp) pairs,
+        else they are events.
+        `eager` must only be true if the caller consumes the whole iterator
+        before anything else uses `tokens`:
+        the DFA fast path, which is then allowed,
+        only stores its tokens back into `tokens` when the run stops.
+        """
+        compiled = self._compiled_for_running()
+        trace = self._get_tracer()
+        run = None
+        if eager and self.use_dfa and trace is None and not tokens.is_busy():
+            dfa = compiled.dfa()
+            if not dfa.problems:
+                run = dfa.run(tokens, items, timestamped, self)
+        if run is None:
+            run = self._run_tokens(compiled, tokens, items, timestamped, trace)
+        return self._with_sink(run)
+
+    def _with_sink(self, run):
+        """Return `run` (an iterator of (index, match) pairs, see :meth:`_run`),
+        writing its matches to the sink, if any."""
+        sink = self.sink
+        if sink is None:
+            return run
+        return _write_run(run, sink.write)
+
+    def _run_tokens(self, compiled, tokens, items, timestamped, trace):
+        """Implementation of :meth:`_run` with the token engine."""
+        step = self._step
+        clock = tokens.clock
+        if not timestamped:
+            timestamp = -1 if clock is None else clock
+            for i, event in enumerate(items):
+                timestamp += 1
+                matches = step(compiled, tokens, event, timestamp, trace)
+                if matches:
+                    for match in matches:
+                        yield i, match.as_match()
+        else:
+            for i, (event, timestamp) in enumerate(items):
+                assert clock is None  or  timestamp >= clock
+                clock = timestamp
+                matches = step(compiled, tokens, event, timestamp, trace)
+                if matches:
+                    for match in matches:
+                        yield i, match.as_match()
+
+    def feed_batch(self, events, timestamps=None):
+        """
+        I ingest all `events` (a sequence or an iterable),
+        and return a list of (index, match) pairs,
+        where index is the rank in `events` of the event that produced match.
+
+        If provided,
+        `timestamps` must be a sequence or an iterable with the same length as `events`,
+        following the same rule as in :meth:`feed`.
+        Unlike :meth:`feed_all`, this method does not call :meth:`finish`.
+        """
+        if timestamps is None:
+            run = self._run(self._tokens, events, False, True)
+        else:
+            run = self._run(self._tokens, izip(events, timestamps), True, True)
+        return list(run)
+
     def feed_all(self, iterable, finish=True):
-        ret = []
-        for event in iterable:
-            ret += self.feed(event)
-        if finish:
-            ret += self.finish()
-            self.reset()
-        return ret
+        return list(self._iter_feed(iterable, False, finish, True))
 
     def feed_all_timestamps(self, iterable, finish=True):
-        ret = []
-        for event, timestamp in iterable:
-            ret += self.feed(event, timestamp)
+        return list(self._iter_feed(iterable, True, finish, True))
+
+    def iter_feed(self, iterable, finish=True):
+        """
+        I ingest all events from `iterable`, like :meth:`feed_all`,
+        but I am a generator yielding every match as soon as it is produced.
+
+        As I consume `iterable` lazily, I can be used on unbounded streams.
+        If `finish` is true, the matches returned by :meth:`finish`
+        are yielded once `iterable` is exhausted.
+        The tokens are up to date whenever I yield a match
+        (so I do not use the fast path of :mod:`fsa4streams.dfa`).
+        """
+        return self._iter_feed(iterable, False, finish)
+
+    def iter_feed_timestamps(self, iterable, finish=True):
+        """
+        Same as :meth:`iter_feed`,
+        but `iterable` yields (event, timestamp) pairs,
+        like in :meth:`feed_all_timestamps`.
+        """
+        return self._iter_feed(iterable, True, finish)
+
+    def _iter_feed(self, iterable, timestamped, finish, eager=False):
+        for _, match in self._run(self._tokens, iterable, timestamped, eager):
+            yield match
         if finish:
-            ret += self.finish()
+            for match in self.finish():
+                yield match
             self.reset()
-        return ret
 
     def finish(self):
-        LOG.debug('finishing')
-        running = self._tokens['running']
-        pending = self._tokens['pending']
+        return self._finish(self._tokens)
+
+    def _finish(self, tokens, output=True):
+        """Implementation of :meth:`finish` on any token set.
+
+        The matches are written to the sink, if any, only if `output` is true.
+        """
+        trace = self._get_tracer()
+        if trace is not None:
+            trace.finishing()
+        running = tokens.running
+        pending = tokens.pending
         matches = []
-        for tokenid, token in running.items():
-            LOG.debug('  token in %r', token['state'])
-            token_state = self[token['state']]
-            self._delete_token(tokenid, token, token_state,
-                               running, pending, matches)
-        if matches and not self.allow_overlap:
-            min_created = min( match['created'] for match in matches)
+        if running:
+            compiled = self._compiled_for_running()
+        for tokenid, token in list(running.items()):
+            self._delete_token(tokenid, token,
+                               tokens, pending, matches, trace, 'finish')
+        if matches and not compiled.allow_overlap:
+            min_created = min( match.created for match in matches)
             matches = [ match for match in matches
-                        if match['created'] == min_created ]
-        self.reset()
-        LOG.debug('  returns %s match(es)', len(matches))
+                        if match.created == min_created ]
+        tokens.clear()
+        matches = [ match.as_match() for match in matches ]
+        if output:
+            self._output(matches)
         return matches
+
+
+def _write_run(run, write):
+    for i, match in run:
+        write(match)
+        yield i, match
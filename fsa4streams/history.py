@@ -0,0 +1,235 @@
+"""
+Persistent histories of tokens.
+
+A :class:`History` is an immutable linked list,
+where each node points to the history before its last item.
+Appending an item creates a new node sharing the whole previous history,
+so forking a token (or keeping a pending copy of it) costs O(1)
+whatever the length of its history.
+Histories are converted to plain lists only when tokens are exported
+or returned as matches.
+
+Histories are hashable (provided that their items are hashable,
+unhashable items being ignored by the hash),
+so that tokens with the same history can be found in O(1).
+The hash of each node is computed at most once, and only when needed.
+"""
+from __future__ import unicode_literals
+
+
+class History(object):
+    """An immutable sequence of items, sharing its prefixes.
+
+    The empty history is :data:`EMPTY`;
+    other histories are built with :meth:`push`.
+    """
+
+    __slots__ = ('value', 'parent', 'length', 'hashcode')
+
+    def __init__(self, value, parent, length):
+        self.value = value
+        self.parent = parent
+        self.length = length
+        self.hashcode = None
+
+    def push(self, value):
+        """Return a new history, made of this one followed by `value`."""
+        return History(value, self, self.length + 1)
+
+    @classmethod
+    def from_list(cls, values):
+        ret = EMPTY
+        for value in values:
+            ret = ret.push(value)
+        return ret
+
+    def to_list(self, limit=None):
+        """Return the items of this history (only the last `limit` ones,
+        if `limit` is not None), as a list.
+        """
+        count = self.length
+        if limit is not None and limit < count:
+            count = limit
+        ret = [None] * count
+        node = self
+        for i in range(count-1, -1, -1):
+            ret[i] = node.value
+            node = node.parent
+        return ret
+
+    def tail(self, prefix):
+        """Return the list of values pushed on `prefix` to make this history,
+        or None if this history was not built from `prefix`.
+        """
+        count = self.length - prefix.length
+        if count < 0:
+            return None
+        ret = [None] * count
+        node = self
+        for i in range(count-1, -1, -1):
+            ret[i] = node.value
+            node = node.parent
+        if node is not prefix:
+            return None
+        return ret
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __contains__(self, value):
+        node = self
+        while node.length:
+            if node.value == value:
+                return True
+            node = node.parent
+        return False
+
+    def __eq__(self, other):
+        if not isinstance(other, History):
+            return NotImplemented
+        if self.length != other.length:
+            return False
+        node1, node2 = self, other
+        # once both reach the same node, they share all previous items
+        while node1 is not node2:
+            if node1.value != node2.value:
+                return False
+            node1 = node1.parent
+            node2 = node2.parent
+        return True
+
+    def __hash__(self):
+        hashcode = self.hashcode
+        if hashcode is not None:
+            return hashcode
+        # compute missing hashes from the oldest to the newest node
+        uncached = []
+        node = self
+        while node.hashcode is None:
+            uncached.append(node)
+            node = node.parent
+        hashcode = node.hashcode
+        for node in reversed(uncached):
+            try:
+                value_hash = hash(node.value)
+            except TypeError:
+                value_hash = 0
+            hashcode = node.hashcode = hash((hashcode, value_hash))
+        return hashcode
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        if ret is NotImplemented:
+            return ret
+        return not ret
+
+    def __repr__(self):
+        return 'History(%r)' % (self.to_list(),)
+
+
+EMPTY = History(None, None, 0)
+EMPTY.hashcode = 0
+
+
+class Retention(object):
+    """A policy restricting the histories kept by tokens,
+    described by the ``history`` attribute of a structure (see :doc:`syntax`):
+
+    * ``"timestamps"``: ``history_events`` holds the timestamps of the events
+      instead of the events;
+    * ``{"first": n}``: only the first `n` events (and states) are kept;
+    * ``{"last": n}``: only the last `n` events (and states) are kept;
+    * ``"none"``: no history is kept, only the counters of the tokens.
+
+    ``"full"`` (the default) is represented by None rather than a Retention.
+
+    Histories are how the FSA tells apart tokens that went through the same
+    events, so a restricted history is only allowed in structures
+    where this never happens (the others are rejected by
+    :meth:`FSA.check_structure <fsa4streams.fsa.FSA.check_structure>`).
+
+    ``start(event, timestamp)`` returns the history of events of a new token,
+    and ``push(token, event, stateid, timestamp)`` records in `token`
+    that it left state `stateid` on `event`.
+    ``limit`` is the number of items returned when exporting histories
+    (None if they are exported in full).
+    Internally, the "last" policy lets histories grow up to ``2*limit`` items
+    before truncating them, so that each event costs O(1).
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.limit = None
+        if spec == 'timestamps':
+            self.start = _start_timestamps
+            self.push = _push_timestamps
+            return
+        if spec == 'none':
+            self.start = _start_none
+            self.push = _push_none
+            return
+        if isinstance(spec, dict) and len(spec) == 1:
+            (kind, count), = spec.items()
+            if kind in ('first', 'last') and isinstance(count, int) \
+            and not isinstance(count, bool) and count > 0:
+                self.count = count
+                self.start = _start_events
+                if kind == 'first':
+                    self.push = self._push_first
+                else:
+                    self.limit = count
+                    self.push = self._push_last
+                return
+        raise ValueError("Unsupported history %r" % (spec,))
+
+    def __repr__(self):
+        return 'Retention(%r)' % (self.spec,)
+
+    def _push_first(self, token, event, stateid, timestamp):
+        count = self.count
+        # states are one step behind events (none is left by the first event)
+        if token.history_events.length < count:
+            token.history_events = token.history_events.push(event)
+        if token.history_states.length < count:
+            token.history_states = token.history_states.push(stateid)
+
+    def _push_last(self, token, event, stateid, timestamp):
+        count = self.count
+        events = token.history_events.push(event)
+        if events.length >= 2*count:
+            events = History.from_list(events.to_list(count))
+        token.history_events = events
+        states = token.history_states.push(stateid)
+        if states.length >= 2*count:
+            states = History.from_list(states.to_list(count))
+        token.history_states = states
+
+
+def retention(spec):
+    """Return the :class:`Retention` described by `spec`,
+    or None if `spec` is None or ``"full"``.
+
+    Raise ValueError if `spec` is not supported.
+    """
+    if spec is None or spec == 'full':
+        return None
+    return Retention(spec)
+
+def _start_events(event, timestamp):
+    return EMPTY.push(event)
+
+def _start_timestamps(event, timestamp):
+    return EMPTY.push(timestamp)
+
+def _push_timestamps(token, event, stateid, timestamp):
+    token.history_events = token.history_events.push(timestamp)
+    token.history_states = token.history_states.push(stateid)
+
+def _start_none(event, timestamp):
+    return EMPTY
+
+def _push_none(token, event, stateid, timestamp):
+    pass
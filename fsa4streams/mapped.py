@@ -0,0 +1,204 @@
+"""
+Memory-mapped compiled structures.
+
+Parsing, checking and compiling the JSON structure of a very large automaton
+takes time and memory in every process using it.
+:meth:`FSA.export_compiled <fsa4streams.fsa.FSA.export_compiled>`
+writes a checked structure to a binary file,
+which :meth:`FSA.open_compiled <fsa4streams.fsa.FSA.open_compiled>`
+maps read-only in memory:
+the pages of the file are shared by all the processes opening it,
+and each state is only decoded and compiled when a token first reaches it.
+
+The file starts with a header::
+
+    magic    4 bytes    b'FSAC'
+    version  uint32     1
+    count    uint32     number of states
+    meta     2 x uint64 offset and length of the metadata
+    table    uint64     offset of the state table
+
+(all integers are little-endian).
+The metadata is a JSON object,
+with the canonical hash of the structure (``hash``)
+and the structure without its states (``structure``).
+The state table has one entry per state, in the order of the compiled states
+(``start`` first, then by increasing identifier),
+made of the offset and length of the UTF-8 identifier of the state,
+and the offset and length of its JSON data (as in the structure).
+
+The state identifiers are looked up by a binary search in the table.
+"""
+from __future__ import unicode_literals
+
+import json
+import mmap
+from struct import Struct
+
+from .cache import canonical_hash
+from .compiled import CompiledState, CompiledStructure
+from .history import retention
+
+MAGIC = b'FSAC'
+VERSION = 1
+
+_HEADER = Struct(str('<4sIIQQQ'))
+_ENTRY = Struct(str('<QIQI'))
+
+
+def write(path, structure, compiled):
+    """Write `structure` and its `compiled` form to file `path`."""
+    if compiled.problems:
+        raise ValueError("\n".join(compiled.problems))
+    meta = dict( (key, value) for key, value in structure.items()
+                 if key != 'states' )
+    meta = _dumps({ 'hash': canonical_hash(structure), 'structure': meta })
+    states_data = structure['states']
+    blobs = []
+    entries = []
+    offset = _HEADER.size + _ENTRY.size * len(compiled.states) + len(meta)
+    for state in compiled.states:
+        stateid = state.id.encode('utf-8')
+        data = _dumps(states_data[state.id])
+        entries.append(_ENTRY.pack(offset, len(stateid),
+                                   offset + len(stateid), len(data)))
+        blobs.append(stateid)
+        blobs.append(data)
+        offset += len(stateid) + len(data)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(entries),
+                             _HEADER.size + _ENTRY.size * len(entries),
+                             len(meta), _HEADER.size))
+        f.write(b''.join(entries))
+        f.write(meta)
+        f.write(b''.join(blobs))
+
+
+class MappedStructure(CompiledStructure):
+    """A compiled structure read from a memory-mapped file (see :func:`write`).
+
+    ``index`` is a read-only mapping, searching the file;
+    ``states`` are compiled on first access.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buf) < _HEADER.size:
+            raise ValueError("Not a compiled structure: %s" % path)
+        magic, version, count, meta_offset, meta_length, table = \
+            _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a compiled structure: %s" % path)
+        if version != VERSION:
+            raise ValueError("Unsupported compiled structure version %d"
+                             % version)
+        meta = json.loads(buf[meta_offset:meta_offset+meta_length]
+                          .decode('utf-8'))
+        self.hash = meta['hash']
+        self._structure = structure = meta['structure']
+        self._table = table
+        self._count = count
+        self.problems = []
+        self._specialized_matchers = {}
+        self._dfa = None
+        self.allow_overlap = structure.get('allow_overlap', False)
+        self.default_matcher = structure.get('default_matcher')
+        self.history = retention(structure.get('history'))
+        self.index = _MappedIndex(self)
+        self.states = [ _MappedState(self, i) for i in range(count) ]
+        self.start = self.states[0]
+
+    def load_structure(self):
+        """Return the full structure, in the JSON format."""
+        ret = json.loads(json.dumps(self._structure))
+        ret['states'] = dict( (self._read_id(i), self._read_data(i))
+                              for i in range(self._count) )
+        return ret
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._map, self._table + _ENTRY.size * i)
+
+    def _read_id(self, i):
+        offset, length, _, _ = self._entry(i)
+        return self._map[offset:offset+length].decode('utf-8')
+
+    def _read_data(self, i):
+        _, _, offset, length = self._entry(i)
+        return json.loads(self._map[offset:offset+length].decode('utf-8'))
+
+    def _load_state(self, state):
+        index = state.index
+        state.id = self._read_id(index)
+        self._compile_state(state, self._read_data(index), self._structure)
+
+
+class _MappedState(CompiledState):
+    """A compiled state, compiled from the file on first access."""
+
+    __slots__ = ('_mapped',)
+
+    def __init__(self, mapped, index):
+        self.index = index
+        self._mapped = mapped
+
+    def __getattr__(self, name):
+        # only called for the slots that are not set yet
+        if name not in CompiledState.__slots__ or name == 'index':
+            raise AttributeError(name)
+        self._mapped._load_state(self)
+        return getattr(self, name)
+
+
+class _MappedIndex(object):
+    """A read-only mapping from state identifiers to indexes,
+    searching the state table of a :class:`MappedStructure`.
+    """
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+
+    def get(self, stateid, default=None):
+        mapped = self._mapped
+        if stateid == 'start':
+            return 0
+        try:
+            key = stateid.encode('utf-8')
+        except AttributeError:
+            return default
+        buf = mapped._map
+        # identifiers after 'start' are sorted
+        low, high = 1, mapped._count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, _, _ = mapped._entry(middle)
+            current = buf[offset:offset+length]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return middle
+        return default
+
+    def __getitem__(self, stateid):
+        ret = self.get(stateid)
+        if ret is None:
+            raise KeyError(stateid)
+        return ret
+
+    def __contains__(self, stateid):
+        return self.get(stateid) is not None
+
+    def __len__(self):
+        return self._mapped._count
+
+    def __iter__(self):
+        mapped = self._mapped
+        for i in range(mapped._count):
+            yield mapped._read_id(i)
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')) \
+        .encode('utf-8')
@@ -4,9 +4,19 @@
 
    It originally contains all the matchers contained in this module.
 
+A matcher is a function accepting a transition, an event, a token and an FSA,
+and returning a truthy value if the event satisfies the transition.
+
+A matcher may also have a ``compile`` attribute:
+a function accepting a transition condition,
+and returning a matcher specialized for that condition.
+It is used once, when the structure of an FSA is compiled,
+and should raise a ValueError if the condition is invalid;
+such errors are reported by :meth:`~fsa4streams.fsa.FSA.check_structure`.
+
 """
 
-from re import match as re_match
+import re
 
 def match_multiple_choices(transition, event, _token, _fsa):
     """
@@ -24,10 +34,23 @@ def match_regexp(transition, event, _token, _fsa):
 
     With this matcher,
     transition conditions are interpreted as regular expressions.
-    Note that the *whole* event must match the regular expression
-    (this is ensured by automatically prepending ``^`` and appending ``$`` to the condition).
+    Note that the *whole* event must match the regular expression.
     """
-    return re_match('^%s$' % transition['condition'], event)
+    return _compile_regexp(transition['condition'])(None, event, None, None)
+
+def _compile_regexp(condition):
+    try:
+        regexp = re.compile(condition)
+    except (re.error, TypeError) as ex:
+        raise ValueError("Invalid regular expression %r: %s" % (condition, ex))
+    fullmatch = getattr(regexp, 'fullmatch', None)
+    if fullmatch is None: # Python 2
+        fullmatch = re.compile('(?:%s)\\Z' % condition).match
+    def match_compiled_regexp(_transition, event, _token, _fsa):
+        return fullmatch(event)
+    return match_compiled_regexp
+
+match_regexp.compile = _compile_regexp
 
 DIRECTORY = {
     'multiple-choices': match_multiple_choices,
@@ -0,0 +1,240 @@
+"""
+Running one automaton on many independent streams.
+"""
+from __future__ import unicode_literals
+
+import json
+
+from .fsa import FSA
+from . import snapshot
+from .tokens import TokenSet
+
+
+class MultiStreamFSA(object):
+    """Run the same FSA structure on many independent streams.
+
+    Each stream is identified by a key (any hashable value),
+    and behaves as if it was fed to its own :class:`~fsa4streams.fsa.FSA`;
+    but all streams share a single structure, compiled once.
+
+    Streams are created on the fly when they receive their first event.
+    The state of a stream with no running or pending token
+    is reduced to its clock and position
+    (see :class:`~fsa4streams.tokens.TokenSet`).
+    """
+
+    def __init__(self, fsa):
+        """
+        `fsa` provides the structure shared by all streams;
+        its own tokens are not used.
+        You can also use one of the from_* static methods.
+        """
+        self._fsa = fsa
+        self._compiled = None
+        self._streams = {}
+        self._iterating = {}
+
+    @classmethod
+    def from_str(cls, json_str):
+        return cls(FSA.from_str(json_str))
+
+    @classmethod
+    def from_file(cls, json_filelike):
+        return cls(FSA.from_file(json_filelike))
+
+    @classmethod
+    def from_dict(cls, dictobj):
+        return cls(FSA.from_dict(dictobj))
+
+    @property
+    def fsa(self):
+        return self._fsa
+
+    def __len__(self):
+        return len(self._streams)
+
+    def __contains__(self, key):
+        return key in self._streams
+
+    def keys(self):
+        return list(self._streams)
+
+    def is_busy(self, key):
+        tokens = self._streams.get(key)
+        return isinstance(tokens, TokenSet) and tokens.is_busy()
+
+    def clock(self, key):
+        """Return the timestamp of the last event of stream `key`."""
+        tokens = self._streams.get(key)
+        if isinstance(tokens, TokenSet):
+            return tokens.clock
+        if tokens is None:
+            return None
+        return tokens[0]
+
+    def feed(self, key, event, timestamp=None):
+        """Feed `event` to stream `key`, as :meth:`FSA.feed` would."""
+        tokens = self._get_tokens(key)
+        try:
+            return self._fsa._feed(tokens, event, timestamp)
+        finally:
+            self._store_tokens(key, tokens)
+
+    def feed_all(self, key, iterable, finish=True):
+        return list(self._iter_feed(key, iterable, False, finish, True))
+
+    def feed_all_timestamps(self, key, iterable, finish=True):
+        return list(self._iter_feed(key, iterable, True, finish, True))
+
+    def iter_feed(self, key, iterable, finish=True):
+        """Feed `iterable` to stream `key`, as :meth:`FSA.iter_feed` would."""
+        return self._iter_feed(key, iterable, False, finish)
+
+    def iter_feed_timestamps(self, key, iterable, finish=True):
+        """Feed `iterable` to stream `key`,
+        as :meth:`FSA.iter_feed_timestamps` would."""
+        return self._iter_feed(key, iterable, True, finish)
+
+    def _iter_feed(self, key, iterable, timestamped, finish, eager=False):
+        tokens = self._get_tokens(key)
+        # while this generator is suspended, the stream must be visible
+        # (and kept as a TokenSet, even when idle) to other methods
+        self._streams[key] = tokens
+        self._iterating[key] = self._iterating.get(key, 0) + 1
+        try:
+            for _, match in self._fsa._run(tokens, iterable, timestamped,
+                                           eager):
+                yield match
+        finally:
+            count = self._iterating.pop(key) - 1
+            if count:
+                self._iterating[key] = count
+            if self._streams.get(key) is tokens:
+                # else the stream was finished or reset in the meantime
+                self._store_tokens(key, tokens)
+        if finish:
+            for match in self.finish(key):
+                yield match
+
+    def advance_clock(self, key, timestamp):
+        """Advance the clock of stream `key`,
+        as :meth:`FSA.advance_clock` would."""
+        tokens = self._get_tokens(key)
+        try:
+            return self._fsa._advance_clock(tokens, timestamp)
+        finally:
+            self._store_tokens(key, tokens)
+
+    def finish(self, key):
+        """Finish stream `key`, return its last matches and forget it."""
+        tokens = self._streams.pop(key, None)
+        if not isinstance(tokens, TokenSet):
+            return []
+        self._check_compiled()
+        return self._fsa._finish(tokens)
+
+    def finish_all(self):
+        """Finish all streams,
+        and return a dict mapping their keys to their last matches.
+
+        Streams without any match are not included in the result.
+        """
+        ret = {}
+        for key in list(self._streams):
+            matches = self.finish(key)
+            if matches:
+                ret[key] = matches
+        return ret
+
+    def evict(self, before):
+        """Finish all streams whose last event is older than `before`.
+
+        Return a dict mapping the keys of evicted streams
+        to their last matches
+        (streams without any match are not included).
+        """
+        ret = {}
+        idle = []
+        for key in self._streams:
+            clock = self.clock(key)
+            if clock is None or clock < before:
+                idle.append(key)
+        for key in idle:
+            matches = self.finish(key)
+            if matches:
+                ret[key] = matches
+        return ret
+
+    def reset(self, key=None):
+        """Forget stream `key` (or all streams if `key` is None)
+        without finishing it."""
+        if key is None:
+            self._streams.clear()
+        else:
+            self._streams.pop(key, None)
+
+    def export_tokens_as_dict(self, key):
+        return self._exported_tokens(key).as_dict()
+
+    def export_tokens_as_string(self, key, *args, **kw):
+        return json.dumps(self.export_tokens_as_dict(key), *args, **kw)
+
+    def load_tokens_from_dict(self, key, dictobj, force=False):
+        if self.is_busy(key) and not force:
+            raise ValueError('Can not load a tokens on a busy stream')
+        tokens = TokenSet()
+        tokens.load_dict(dictobj, self._check_compiled())
+        self._store_tokens(key, tokens)
+
+    def load_tokens_from_str(self, key, json_str, force=False):
+        self.load_tokens_from_dict(key, json.loads(json_str), force)
+
+    def export_tokens_as_bytes(self, key):
+        return snapshot.dump(self._exported_tokens(key))
+
+    def load_tokens_from_bytes(self, key, data, force=False):
+        if self.is_busy(key) and not force:
+            raise ValueError('Can not load a tokens on a busy stream')
+        tokens = TokenSet()
+        snapshot.load(data, tokens, self._check_compiled())
+        self._store_tokens(key, tokens)
+
+    def _exported_tokens(self, key):
+        tokens = self._streams.get(key)
+        if not isinstance(tokens, TokenSet):
+            tokens = _idle_tokens(tokens)
+        return tokens
+
+    def _check_compiled(self):
+        """Rebind all tokens if the structure was recompiled."""
+        compiled = self._fsa._compiled_for_running()
+        if compiled is not self._compiled:
+            if self._compiled is not None:
+                for tokens in self._streams.values():
+                    if isinstance(tokens, TokenSet):
+                        tokens.rebind(compiled)
+            self._compiled = compiled
+        return compiled
+
+    def _get_tokens(self, key):
+        self._check_compiled()
+        tokens = self._streams.get(key)
+        if not isinstance(tokens, TokenSet):
+            tokens = _idle_tokens(tokens)
+        return tokens
+
+    def _store_tokens(self, key, tokens):
+        if tokens.is_busy() or key in self._iterating:
+            self._streams[key] = tokens
+        else:
+            self._streams[key] = (tokens.clock, tokens.position)
+
+
+def _idle_tokens(state):
+    """Return a new token set from the (clock, position) pair `state`,
+    or from None for a new stream.
+    """
+    tokens = TokenSet()
+    if state is not None:
+        tokens.clock, tokens.position = state
+    return tokens
@@ -0,0 +1,275 @@
+"""
+Running an FSA on many streams in parallel.
+
+Streams that are independent from each other
+(one per user, one per file...)
+can be processed by several processes.
+:func:`parallel_feed_all` sends the structure of the FSA once to each
+process of a pool, where it is compiled once and reused for every stream.
+
+A single long stream can also be split into consecutive chunks,
+processed speculatively by :func:`parallel_feed_chunks`.
+
+
+Note that custom matchers (see :mod:`fsa4streams.matcher`)
+must be registered in the worker processes as well;
+this is automatic on platforms where processes are forked,
+otherwise they must be registered when their module is imported.
+"""
+from __future__ import unicode_literals
+
+from bisect import bisect_right
+from collections import deque
+from multiprocessing import Pool
+
+from .fsa import FSA
+from . import snapshot
+from .tokens import TokenSet
+
+# set in each worker process by _init_worker
+_WORKER_FSA = None
+_WORKER_TIMESTAMPED = None
+_WORKER_LOAD = None
+
+def parallel_feed_all(fsa, partitions, processes=None, timestamped=False,
+                      load=None, ordered=True):
+    """Run `fsa` on every partition of `partitions` in a pool of processes,
+    and yield (key, matches) pairs as soon as they are available.
+
+    `partitions` is an iterable of (key, events) pairs (or a dict),
+    where events is processed as by :meth:`FSA.feed_all`
+    (or by :meth:`FSA.feed_all_timestamps` if `timestamped` is true).
+    Keys and events must be picklable;
+    to avoid sending large lists of events to the workers,
+    a module-level function can be provided as `load`:
+    it is then called in the worker with the second item of every pair
+    (e.g. a filename) and must return the events.
+
+    `processes` is the number of worker processes
+    (by default, the number of CPUs).
+    If `ordered` is false, results are yielded in the order they are
+    completed, rather than in the order of `partitions`.
+
+    The tokens of `fsa` itself are not used,
+    but the matches are written to its sink, if any
+    (see :mod:`fsa4streams.sink`), as they are yielded.
+    """
+    if isinstance(partitions, dict):
+        partitions = partitions.items()
+    structure = fsa.export_structure_as_string()
+    pool = Pool(processes, _init_worker, (structure, timestamped, load))
+    try:
+        if ordered:
+            results = pool.imap(_feed_partition, partitions)
+        else:
+            results = pool.imap_unordered(_feed_partition, partitions)
+        for key, matches in results:
+            yield key, fsa._output(matches)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parallel_feed_chunks(fsa, chunks, processes=None, timestamped=False,
+                         load=None):
+    """Run `fsa` on the concatenation of `chunks` in a pool of processes,
+    and yield the same matches as :meth:`FSA.iter_feed` would
+    (or :meth:`FSA.iter_feed_timestamps` if `timestamped` is true),
+    in the same order.
+
+    `chunks` is an iterable of consecutive parts of a single stream,
+    each of them being a list of events (or of (event, timestamp) pairs);
+    as in :func:`parallel_feed_all`, a module-level function can be provided
+    as `load`, to load the events of every chunk in the worker processes.
+
+    Every chunk is processed speculatively,
+    as if no token was running at its beginning.
+    The tokens left at the end of the previous chunk
+    are then used to check this assumption:
+    if there are any, the beginning of the chunk is processed again
+    (in the calling process) until the FSA becomes idle at a position where
+    the speculative run was idle as well;
+    from that position on, both runs behave identically
+    (see :meth:`TokenSet.settle <fsa4streams.tokens.TokenSet.settle>`).
+    This is efficient when tokens are short-lived compared to chunks,
+    so that the FSA is regularly idle.
+
+    Chunks are processed by the token engine (not the fast path),
+    and the events of a chunk may be loaded a second time
+    when it must be processed again.
+    The tokens left at the end of every chunk are sent back
+    as a binary snapshot (see :mod:`fsa4streams.snapshot`),
+    so events must be JSON values.
+    The tokens of `fsa` itself are not used.
+    """
+    compiled = fsa._compiled_for_running()
+    structure = fsa.export_structure_as_string()
+    submitted = deque()
+    def submit():
+        for chunk in chunks:
+            submitted.append(chunk)
+            yield chunk
+    pool = Pool(processes, _init_worker, (structure, timestamped, load))
+    try:
+        tokens = TokenSet()
+        offset = 0
+        for result in pool.imap(_feed_chunk, submit()):
+            chunk = submitted.popleft()
+            if not result.length:
+                continue
+            result.shift(offset, timestamped)
+            if timestamped:
+                assert tokens.clock is None  or  result.first >= tokens.clock
+            start = 0
+            if tokens.is_busy():
+                # the speculation failed: catch up until both runs are idle
+                events = chunk if load is None else load(chunk)
+                stop = []
+                items = _until_idle(tokens, events, result.busy, stop)
+                run = fsa._run_tokens(compiled, tokens, items,
+                                      timestamped, None)
+                for _, match in fsa._with_sink(run):
+                    yield match
+                if not stop:
+                    offset += result.length
+                    continue
+                start = stop[0] + 1
+            run = ( (i, match) for i, match in result.matches if i >= start )
+            for _, match in fsa._with_sink(run):
+                yield match
+            snapshot.load(result.tokens, tokens, compiled)
+            result.restore(tokens, offset, timestamped)
+            offset += result.length
+        pool.close()
+        for match in fsa._finish(tokens):
+            yield match
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _init_worker(structure, timestamped, load):
+    global _WORKER_FSA, _WORKER_TIMESTAMPED, _WORKER_LOAD
+    _WORKER_FSA = FSA.from_str(structure)
+    _WORKER_FSA._compiled_for_running()
+    _WORKER_TIMESTAMPED = timestamped
+    _WORKER_LOAD = load
+
+def _feed_partition(partition):
+    key, events = partition
+    if _WORKER_LOAD is not None:
+        events = _WORKER_LOAD(events)
+    fsa = _WORKER_FSA
+    try:
+        if _WORKER_TIMESTAMPED:
+            return key, fsa.feed_all_timestamps(events)
+        return key, fsa.feed_all(events)
+    finally:
+        fsa.reset()
+
+def _feed_chunk(chunk):
+    events = chunk if _WORKER_LOAD is None else _WORKER_LOAD(chunk)
+    fsa = _WORKER_FSA
+    tokens = TokenSet()
+    if not _WORKER_TIMESTAMPED:
+        tokens.clock = -1
+    result = _Speculation()
+    items = result.track(tokens, events, _WORKER_TIMESTAMPED)
+    result.matches = list(fsa._run_tokens(fsa._compiled_for_running(), tokens,
+                                          items, _WORKER_TIMESTAMPED, None))
+    result.tokens = snapshot.dump(tokens)
+    result.positions = dict( (tokenid, (token.start, token.end))
+                             for group in (tokens.running, tokens.pending)
+                             for tokenid, token in group.items() )
+    return result
+
+def _until_idle(tokens, items, busy, stop):
+    """Yield `items` until `tokens` becomes idle
+    at a position outside all `busy` ranges;
+    this position is then appended to `stop`.
+    """
+    starts = [ span[0] for span in busy ]
+    for i, item in enumerate(items):
+        yield item
+        if not tokens.next_id:
+            k = bisect_right(starts, i) - 1
+            if k < 0 or busy[k][1] <= i:
+                stop.append(i)
+                return
+
+
+class _Speculation(object):
+    """The result of processing a chunk from an idle token set.
+
+    ``matches`` is a list of (position, match) pairs,
+    ``busy`` is the list of (start, stop) ranges of positions
+    after which the token set was busy,
+    ``tokens`` is the binary snapshot of the final token set
+    (see :mod:`fsa4streams.snapshot`),
+    ``positions`` maps the identifiers of its tokens
+    to their ``start`` and ``end`` offsets, which snapshots do not keep,
+    ``first`` is the first timestamp (if timestamped)
+    and ``length`` is the number of events.
+    """
+
+    def __init__(self):
+        self.matches = []
+        self.busy = []
+        self.tokens = None
+        self.positions = {}
+        self.first = None
+        self.length = 0
+
+    def track(self, tokens, items, timestamped):
+        """Yield all `items`, tracking when `tokens` is busy.
+
+        As identifiers are reset whenever the token set becomes idle,
+        it is busy exactly when ``next_id`` is not 0.
+        """
+        busy = self.busy
+        start = None
+        i = -1
+        for item in items:
+            if i < 0 and timestamped:
+                self.first = item[1]
+            yield item
+            i += 1
+            if tokens.next_id:
+                if start is None:
+                    start = i
+            elif start is not None:
+                busy.append((start, i))
+                start = None
+        if start is not None:
+            busy.append((start, i+1))
+        self.length = i+1
+
+    def shift(self, offset, timestamped):
+        """Shift the offsets of all matches by `offset`,
+        and their timestamps as well unless `timestamped` is true.
+        """
+        for _, match in self.matches:
+            match.start += offset
+            match.end += offset
+            if not timestamped:
+                match['created'] += offset
+                match['updated'] += offset
+
+    def restore(self, tokens, offset, timestamped):
+        """Make `tokens`, loaded from ``tokens``,
+        continue the stream after this chunk, starting at `offset`.
+        """
+        tokens.position = offset + self.length
+        positions = self.positions
+        for group in (tokens.running, tokens.pending):
+            for tokenid, token in group.items():
+                start, end = positions[tokenid]
+                token.start = start + offset
+                token.end = end + offset
+                if not timestamped:
+                    token.created += offset
+                    token.updated += offset
+        if not timestamped:
+            tokens.clock += offset
+            tokens._rebuild_deadlines()
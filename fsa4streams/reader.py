@@ -0,0 +1,191 @@
+"""
+Streaming event readers.
+
+:func:`iter_events` reads events one by one from a JSON archive,
+so that it can be replayed without loading it in memory::
+
+    fsa.feed_all(iter_events('events.ndjson.gz'))
+    fsa.feed_all_timestamps(iter_events('events.json', timestamp='ts'))
+
+Two formats are supported:
+
+* ``'ndjson'``: one JSON value per line (empty lines are ignored);
+* ``'array'``: a top-level JSON array, parsed one element at a time.
+
+With ``format='auto'``, the format is guessed from the extension of the file
+(``.ndjson``, ``.jsonl`` or ``.json``, possibly followed by ``.gz``),
+or else from its first character (``[`` for an array).
+NB: a NDJSON stream of arrays must be read with ``format='ndjson'``.
+"""
+from __future__ import unicode_literals
+
+import codecs
+import gzip
+import json
+import re
+
+CHUNK_SIZE = 65536
+
+_SPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def iter_events(source, format='auto', timestamp=None, event=None):
+    """Yield the events read from `source`.
+
+    `source` is a file name (gzip files are detected),
+    a binary file object (including ``gzip.open`` objects),
+    or a connected socket.
+
+    If `event` is not None, every record is replaced by ``record[event]``
+    (e.g. a field name, or an index for records like ``[event, timestamp]``).
+    If `timestamp` is not None, (event, ``record[timestamp]``) pairs are
+    yielded instead, as expected by
+    :meth:`FSA.feed_all_timestamps <fsa4streams.fsa.FSA.feed_all_timestamps>`.
+
+    Raise ValueError on malformed JSON, or if the format is not supported.
+    """
+    if format not in ('auto', 'ndjson', 'array'):
+        raise ValueError("Unsupported format %r" % format)
+    stream, close = _open(source)
+    try:
+        first = b''
+        if format == 'auto':
+            format = _guess_format(source)
+        if format == 'auto':
+            first = _first_byte(stream)
+            format = 'array' if first == b'[' else 'ndjson'
+        if format == 'ndjson':
+            records = _iter_ndjson(stream, first)
+        else:
+            records = _iter_array(stream, first)
+        for record in records:
+            if timestamp is not None:
+                yield (record if event is None else record[event],
+                       record[timestamp])
+            elif event is not None:
+                yield record[event]
+            else:
+                yield record
+    finally:
+        if close:
+            stream.close()
+
+
+def _open(source):
+    """Return a binary stream for `source`,
+    and whether it must be closed by the reader.
+    """
+    if hasattr(source, 'recv'):
+        return source.makefile('rb'), True
+    if hasattr(source, 'read'):
+        return source, False
+    stream = open(source, 'rb')
+    if stream.read(2) == b'\x1f\x8b':
+        stream.close()
+        return gzip.open(source, 'rb'), True
+    stream.seek(0)
+    return stream, True
+
+def _guess_format(source):
+    """Return the format suggested by the name of `source`,
+    or 'auto' (meaning "array if it starts with '['").
+    """
+    name = source if isinstance(source, (type(''), bytes)) \
+        else getattr(source, 'name', None)
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'replace')
+    if isinstance(name, type('')):
+        name = name.lower()
+        if name.endswith('.gz'):
+            name = name[:-3]
+        if name.endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        if name.endswith('.json'):
+            return 'array'
+    return 'auto'
+
+def _first_byte(stream):
+    """Read `stream` up to its first non-whitespace byte, and return it."""
+    while True:
+        byte = stream.read(1)
+        if byte not in (b' ', b'\t', b'\n', b'\r'):
+            return byte
+
+def _iter_ndjson(stream, first=b''):
+    """Yield the JSON values of the lines of `stream`,
+    `first` being the beginning of the first line.
+    """
+    if first:
+        line = first + stream.readline()
+        if line.strip():
+            yield _loads(line)
+    for line in stream:
+        if line.strip():
+            yield _loads(line)
+
+def _loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+def _iter_array(stream, first=b''):
+    """Yield the elements of the JSON array in `stream`,
+    `first` being the bytes already read from it.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = decoder.decode(first)
+    eof = False
+    size = CHUNK_SIZE
+
+    def more(buf):
+        chunk = stream.read(size)
+        return buf + decoder.decode(chunk, not chunk), not chunk
+
+    # opening bracket
+    while True:
+        pos = _SPACE.match(buf).end()
+        if pos < len(buf) or eof:
+            break
+        buf, eof = more(buf)
+    if buf[pos:pos+1] != '[':
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    expect_value = True
+    empty = True
+    while True:
+        pos = _SPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            buf, eof = more(buf[pos:])
+            pos = 0
+            continue
+        char = buf[pos]
+        if char == ']' and (empty or not expect_value):
+            return
+        if not expect_value:
+            if char != ',':
+                raise ValueError("Expected ',' or ']' in JSON array")
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            value, end = _DECODER.raw_decode(buf, pos)
+        except ValueError:
+            end = None
+        # a value ending with the buffer may be truncated (e.g. a number)
+        if end is None or not eof and (end == len(buf)
+                                       or buf[end] in _NUMBER_CHARS):
+            if eof:
+                raise ValueError("Invalid JSON value at %r" % buf[pos:pos+20])
+            # the value is larger than the buffer
+            size = max(size, 2 * (len(buf) - pos))
+            buf, eof = more(buf[pos:])
+            pos = 0
+            continue
+        size = CHUNK_SIZE
+        yield value
+        pos = end
+        expect_value = empty = False
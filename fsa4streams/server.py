@@ -0,0 +1,327 @@
+"""
+A match service over HTTP.
+
+:class:`MatchService` holds named automata, checked and compiled once
+when they are registered, and is a WSGI application exposing them::
+
+    GET    /automata                        list of names
+    PUT    /automata/<name>                 register a structure
+                                            (if the service is writable)
+    GET    /automata/<name>                 structure
+    DELETE /automata/<name>                 unregister (if writable)
+    POST   /automata/<name>                 feed events, then finish
+    POST   /automata/<name>/sessions/<id>   feed events to a session
+    GET    /automata/<name>/sessions/<id>   tokens of a session
+    DELETE /automata/<name>/sessions/<id>   finish a session
+
+Events are sent as newline-delimited JSON (one event per line,
+or one [event, timestamp] pair per line with ``?timestamped=1``),
+and matches are streamed back as newline-delimited JSON
+as soon as they are produced.
+Request bodies must be delimited by a Content-Length header,
+or by the end of the input if the WSGI server supports chunked requests
+(``wsgi.input_terminated``);
+otherwise the request fails with ``411 Length Required``.
+
+A session keeps its tokens across requests
+(see :class:`~fsa4streams.multi.MultiStreamFSA`),
+until it is finished.
+Requests on the same session are serialized.
+
+Run ``python -m fsa4streams.server NAME=STRUCTURE.json...``
+to serve automata with a multi-threaded wsgiref server
+(see also :mod:`fsa4streams.aioserver`).
+"""
+from __future__ import print_function, unicode_literals
+
+from argparse import ArgumentParser
+import json
+from threading import Lock
+try:
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError: # Python 2
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+from wsgiref import simple_server
+
+from .fsa import FSA
+from .multi import MultiStreamFSA
+
+NDJSON = str('application/x-ndjson')
+JSON = str('application/json')
+
+
+class HTTPError(Exception):
+    """An error to be reported to the client with the given status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class MatchService(object):
+    """A registry of named automata, and a WSGI application serving them.
+
+    If `writable` is true,
+    automata can be registered and unregistered over HTTP.
+    """
+
+    def __init__(self, writable=False):
+        self.writable = writable
+        self._automata = {}
+        self._locks = {}
+        self._lock = Lock()
+
+    def register(self, name, structure):
+        """Register `structure` (an FSA, a dict or a JSON string) as `name`,
+        replacing any automaton with the same name (and its sessions).
+
+        Raise ValueError if the structure is not valid.
+        """
+        if isinstance(structure, FSA):
+            fsa = structure
+            fsa.check_structure()
+        else:
+            try:
+                if isinstance(structure, dict):
+                    fsa = FSA.from_dict(structure)
+                else:
+                    fsa = FSA.from_str(structure)
+            except (KeyError, TypeError, AttributeError) as ex:
+                # not an object with a 'states' object,
+                # or malformed states or transitions
+                raise ValueError("Invalid structure (%s: %s)"
+                                 % (type(ex).__name__, ex))
+        fsa._compiled_for_running()
+        with self._lock:
+            self._automata[name] = MultiStreamFSA(fsa)
+
+    def unregister(self, name):
+        with self._lock:
+            multi = self._get(name)
+            del self._automata[name]
+            for key in list(self._locks):
+                if key[0] is multi:
+                    del self._locks[key]
+
+    def names(self):
+        return sorted(self._automata)
+
+    def structure(self, name):
+        return self._get(name).fsa.export_structure_as_dict()
+
+    def iter_feed(self, name, events, session=None, timestamped=False):
+        """Feed `events` to automaton `name`, and yield matches.
+
+        If `session` is None, the events are processed as a whole stream
+        (finish included);
+        else they are fed to the given session, which is kept.
+        """
+        multi = self._get(name)
+        # the stream is private, or locked, while it is fed:
+        # nothing else can see its tokens before the run stops
+        if session is None:
+            key = object()
+            try:
+                for match in multi._iter_feed(key, events, timestamped, True,
+                                              True):
+                    yield match
+            finally:
+                multi.reset(key)
+            return
+        with self._session_lock(multi, session):
+            for match in multi._iter_feed(session, events, timestamped, False,
+                                          True):
+                yield match
+
+    def finish(self, name, session):
+        """Finish `session` of automaton `name`, and return its last matches."""
+        multi = self._get(name)
+        with self._session_lock(multi, session):
+            matches = multi.finish(session)
+        with self._lock:
+            self._locks.pop((multi, session), None)
+        return matches
+
+    def reset(self, name, session):
+        """Forget `session` of automaton `name` without finishing it."""
+        multi = self._get(name)
+        with self._session_lock(multi, session):
+            multi.reset(session)
+        with self._lock:
+            self._locks.pop((multi, session), None)
+
+    def export_session(self, name, session):
+        multi = self._get(name)
+        with self._session_lock(multi, session):
+            return multi.export_tokens_as_dict(session)
+
+    def _get(self, name):
+        multi = self._automata.get(name)
+        if multi is None:
+            raise HTTPError('404 Not Found', 'No automaton named %r' % name)
+        return multi
+
+    def _session_lock(self, multi, session):
+        with self._lock:
+            return self._locks.setdefault((multi, session), Lock())
+
+    def route(self, method, path):
+        """Return the name of the action for `method` on `path`,
+        and the arguments of this action.
+        """
+        parts = path.strip('/').split('/')
+        if parts[0] != 'automata' or len(parts) not in (1, 2, 4) \
+        or len(parts) == 4 and parts[2] != 'sessions':
+            raise HTTPError('404 Not Found', 'No such resource')
+        args = tuple(parts[1::2])
+        actions = ACTIONS[len(parts)]
+        action = actions.get(method)
+        if action is None:
+            raise HTTPError('405 Method Not Allowed',
+                            'Allowed methods: %s' % ', '.join(sorted(actions)))
+        if action in ('register', 'unregister') and not self.writable:
+            raise HTTPError('403 Forbidden', 'This service is read-only')
+        return action, args
+
+    def __call__(self, environ, start_response):
+        try:
+            action, args = self.route(environ['REQUEST_METHOD'],
+                                      environ.get('PATH_INFO', ''))
+            query = parse_qs(environ.get('QUERY_STRING', ''))
+            timestamped = query.get('timestamped', ['0'])[0] not in ('', '0')
+            if action == 'feed':
+                self._get(args[0])
+                events = parse_events(read_lines(environ), timestamped)
+                session = args[1] if len(args) > 1 else None
+                matches = self.iter_feed(args[0], events, session, timestamped)
+                start_response(str('200 OK'), [(str('Content-Type'), NDJSON)])
+                return format_matches(matches)
+            if action == 'register':
+                body = b''.join(read_lines(environ)).decode('utf-8')
+                try:
+                    self.register(args[0], body)
+                except ValueError as ex:
+                    raise HTTPError('400 Bad Request', str(ex))
+                result = None
+            elif action == 'finish':
+                start_response(str('200 OK'), [(str('Content-Type'), NDJSON)])
+                return format_matches(self.finish(*args))
+            else:
+                result = getattr(self, action)(*args)
+            start_response(str('200 OK'), [(str('Content-Type'), JSON)])
+            return [ json.dumps(result).encode('utf-8') ]
+        except HTTPError as ex:
+            start_response(str(ex.status), [(str('Content-Type'), JSON)])
+            return [ json.dumps({ 'error': str(ex) }).encode('utf-8') ]
+
+
+# actions by number of path segments and method
+ACTIONS = {
+    1: { 'GET': 'names' },
+    2: { 'GET': 'structure', 'PUT': 'register', 'DELETE': 'unregister',
+         'POST': 'feed' },
+    4: { 'GET': 'export_session', 'POST': 'feed', 'DELETE': 'finish' },
+}
+
+
+def read_lines(environ):
+    """Return an iterator over the lines of the body of a WSGI request.
+
+    Raise HTTPError if the end of the body can not be known.
+    """
+    stream = environ['wsgi.input']
+    length = environ.get('CONTENT_LENGTH')
+    if length:
+        return _read_length(stream, int(length))
+    if environ.get('wsgi.input_terminated'):
+        return iter(stream.readline, b'')
+    raise HTTPError('411 Length Required',
+                    'The body must have a Content-Length '
+                    'or be sent in chunks')
+
+def _read_length(stream, length):
+    while length > 0:
+        line = stream.readline(min(length, 65536))
+        if not line:
+            break
+        length -= len(line)
+        yield line
+
+def parse_events(lines, timestamped=False):
+    """Yield the events (or (event, timestamp) pairs) in `lines`,
+    one JSON value per non-empty line.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line.decode('utf-8'))
+        if timestamped:
+            event, timestamp = item
+            item = (event, timestamp)
+        yield item
+
+def format_matches(matches):
+    """Yield every match in `matches` as a line of JSON.
+
+    If an error occurs on malformed input,
+    it is reported as a last line (see :func:`format_error`).
+    """
+    try:
+        for match in matches:
+            yield json.dumps(match).encode('utf-8') + b'\n'
+    except INPUT_ERRORS as ex:
+        yield format_error(ex)
+
+# errors caused by malformed events or timestamps
+INPUT_ERRORS = (ValueError, TypeError, AssertionError)
+
+def format_error(ex):
+    """Return `ex` as a line of JSON ``{"error": message}``."""
+    message = str(ex) or type(ex).__name__
+    return json.dumps({ 'error': message }).encode('utf-8') + b'\n'
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Serve automata over HTTP.")
+    parser.add_argument('automata', nargs='*', metavar='NAME=FILE',
+                        help='automata to register, with their JSON structure')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--writable', action='store_true',
+                        help='allow to register automata over HTTP')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='use the asyncio server instead of wsgiref')
+    args = parser.parse_args(argv)
+    service = MatchService(args.writable)
+    for spec in args.automata:
+        name, _, filename = spec.partition('=')
+        with open(filename) as f:
+            service.register(name, f.read())
+    print("Listening on http://%s:%s/" % (args.host, args.port))
+    if args.asyncio:
+        from .aioserver import serve
+        serve(service, args.host, args.port)
+    else:
+        make_server(service, args.host, args.port).serve_forever()
+
+def make_server(service, host='localhost', port=12345, quiet=False):
+    """Return a multi-threaded wsgiref server for `service`.
+
+    If `quiet` is true, requests are not logged.
+    """
+    handler = QuietHandler if quiet else simple_server.WSGIRequestHandler
+    return simple_server.make_server(host, port, service, ThreadingWSGIServer,
+                                     handler)
+
+class ThreadingWSGIServer(ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Match sinks.
+
+A sink receives the matches of an FSA, and stores or forwards them in batches.
+It is attached to an FSA through its ``sink`` attribute::
+
+    with NDJSONSink('matches.ndjson', projection='compact') as sink:
+        fsa.sink = sink
+        fsa.feed_all(events)
+
+in which case every match returned by the FSA
+(including by :meth:`~fsa4streams.fsa.FSA.advance_clock`
+and :meth:`~fsa4streams.fsa.FSA.finish`,
+by a :class:`~fsa4streams.multi.MultiStreamFSA` built on that FSA,
+and by the functions of :mod:`fsa4streams.parallel` run with that FSA)
+is also written to the sink.
+A :class:`~fsa4streams.vectorized.VectorizedFSA`, which returns its matches
+as arrays rather than dicts, never writes to the sink.
+A sink can also consume a single run::
+
+    sink.write_all(fsa.iter_feed(events))
+
+Matches are buffered, and written when ``batch_size`` of them are waiting,
+or when the sink is flushed or closed.
+
+The ``projection`` of a sink selects what is written for each match:
+
+* None: the match itself;
+* ``'compact'``: a dict with its ``state``, ``created`` and ``updated``
+  timestamps, and the ``start`` and ``end`` offsets in the stream
+  of its first and last events (see :func:`compact`),
+  dropping the potentially long ``history_events`` and ``history_states``;
+* a function, returning what is written for the match it receives.
+"""
+from __future__ import unicode_literals
+
+from collections import deque
+import json
+import os
+import re
+
+
+def compact(match):
+    """Return the compact projection of `match`.
+
+    ``start`` and ``end`` are the offsets of the first and last events
+    of the match in the stream, whether it is timestamped or not
+    (see :class:`~fsa4streams.tokens.Match`);
+    they are None if unknown, e.g. when `match` is a plain dict.
+    """
+    return {
+        'state': match['state'],
+        'created': match['created'],
+        'updated': match['updated'],
+        'start': getattr(match, 'start', None),
+        'end': getattr(match, 'end', None),
+    }
+
+PROJECTIONS = {
+    None: None,
+    'compact': compact,
+}
+
+
+class Sink(object):
+    """Base class of sinks.
+
+    Subclasses override :meth:`_write_batch`.
+    """
+
+    def __init__(self, batch_size=1000, projection=None):
+        if not callable(projection):
+            try:
+                projection = PROJECTIONS[projection]
+            except KeyError:
+                raise ValueError("Unknown projection %r" % (projection,))
+        self.batch_size = batch_size
+        self.projection = projection
+        self.closed = False
+        self._batch = []
+
+    def write(self, match):
+        """Write one match."""
+        if self.projection is not None:
+            match = self.projection(match)
+        batch = self._batch
+        batch.append(match)
+        if len(batch) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, matches):
+        """Write all matches from iterable `matches`,
+        and return their number.
+        """
+        count = 0
+        for count, match in enumerate(matches, 1):
+            self.write(match)
+        return count
+
+    def flush(self):
+        """Write the buffered matches."""
+        batch = self._batch
+        if batch:
+            self._batch = []
+            self._write_batch(batch)
+
+    def close(self):
+        """Flush the sink and release its resources."""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def _write_batch(self, batch):
+        """Write the (projected) matches of list `batch`."""
+        raise NotImplementedError()
+
+
+class CallbackSink(Sink):
+    """A sink calling `callback` with every batch (a list of matches)."""
+
+    def __init__(self, callback, batch_size=1000, projection=None):
+        super(CallbackSink, self).__init__(batch_size, projection)
+        self.callback = callback
+
+    def _write_batch(self, batch):
+        self.callback(batch)
+
+
+class RingBufferSink(Sink):
+    """An in-memory sink keeping the last `maxlen` matches.
+
+    Matches are not batched.
+    """
+
+    def __init__(self, maxlen=1000, projection=None):
+        super(RingBufferSink, self).__init__(1, projection)
+        self._matches = deque(maxlen=maxlen)
+
+    @property
+    def matches(self):
+        """The list of the last matches, oldest first."""
+        return list(self._matches)
+
+    def clear(self):
+        self._matches.clear()
+
+    def write(self, match):
+        if self.projection is not None:
+            match = self.projection(match)
+        self._matches.append(match)
+
+    def _write_batch(self, batch):
+        self._matches.extend(batch)
+
+
+class NDJSONSink(Sink):
+    """A sink writing one JSON match per line.
+
+    `output` is a file name (the file is opened in append mode)
+    or a binary file object (which is not closed by the sink).
+    Every batch is written with a single call to its ``write`` method.
+    """
+
+    def __init__(self, output, batch_size=1000, projection=None):
+        super(NDJSONSink, self).__init__(batch_size, projection)
+        if hasattr(output, 'write'):
+            self._file = output
+            self._owned = False
+        else:
+            self._file = open(output, 'ab')
+            self._owned = True
+
+    def close(self):
+        if not self.closed:
+            super(NDJSONSink, self).close()
+            if self._owned:
+                self._file.close()
+            else:
+                self._file.flush()
+
+    def flush(self):
+        super(NDJSONSink, self).flush()
+        self._file.flush()
+
+    def _write_batch(self, batch):
+        self._write_data(_encode(batch))
+
+    def _write_data(self, data):
+        self._file.write(data)
+
+
+class RotatingSink(NDJSONSink):
+    """A sink writing one JSON match per line to a sequence of files.
+
+    `pattern` is the name of the files, containing a ``%d`` placeholder
+    replaced by 0, 1, 2...
+    If files matching `pattern` already exist
+    (e.g. after the process has restarted),
+    the one with the highest number is appended to.
+    A new file is started when the current one reaches `max_bytes`
+    (files may exceed it by one batch).
+    If `backup_count` is not None,
+    only the last `backup_count` files are kept besides the current one.
+    """
+
+    def __init__(self, pattern, max_bytes=64 << 20, backup_count=None,
+                 batch_size=1000, projection=None):
+        self.pattern = pattern
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.index = _last_index(pattern)
+        super(RotatingSink, self).__init__(self.filename, batch_size,
+                                           projection)
+        self._size = os.path.getsize(self.filename)
+
+    @property
+    def filename(self):
+        """The name of the current file."""
+        return self.pattern % self.index
+
+    def _write_data(self, data):
+        if self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def _rotate(self):
+        self._file.close()
+        self.index += 1
+        self._file = open(self.filename, 'ab')
+        self._size = os.path.getsize(self.filename)
+        if self.backup_count is not None:
+            old = self.index - self.backup_count - 1
+            if old >= 0:
+                try:
+                    os.remove(self.pattern % old)
+                except OSError:
+                    pass
+
+
+def _last_index(pattern):
+    """Return the highest number of the existing files of `pattern`,
+    or 0 if there is none.
+    """
+    directory, name = os.path.split(pattern)
+    regexp = re.compile('([0-9]+)'.join( re.escape(part.replace('%%', '%'))
+                                         for part in name.split('%d') ) + '$')
+    ret = 0
+    for filename in os.listdir(directory or os.curdir):
+        match = regexp.match(filename)
+        if match is not None:
+            ret = max(ret, int(match.group(1)))
+    return ret
+
+def _encode(batch):
+    dumps = json.dumps
+    return ''.join([ '%s\n' % dumps(match, separators=(',', ':'))
+                     for match in batch ]).encode('utf-8')
@@ -0,0 +1,411 @@
+"""
+Compact binary snapshots of token sets.
+
+:meth:`FSA.export_tokens_as_bytes <fsa4streams.fsa.FSA.export_tokens_as_bytes>`
+and :meth:`~fsa4streams.fsa.FSA.load_tokens_from_bytes`
+are equivalent to their JSON counterparts
+(loading a snapshot gives the same tokens as loading the JSON export),
+but faster and smaller:
+
+* strings (state identifiers, string events...) are stored once,
+  and referred to by their index;
+* integers (timestamps, counters, identifiers...) are stored as varints;
+* histories are stored as a table of nodes,
+  each node referring to its parent,
+  so that the prefixes shared by several tokens are stored once
+  (and still shared once loaded).
+
+A snapshot is made of a header (``FSAT`` followed by the format version),
+then of the following sections:
+
+* the string table: a count, then the length and UTF-8 bytes of each string;
+* the clock (as a value, see below) and the next token identifier;
+* the history nodes, as a count of chains, then the chains:
+  in a chain, each node is the parent of the next one;
+  a chain is stored as the distance from its first node to the parent of that node
+  (the empty history having index 0, and the n-th node index n),
+  then twice its number of nodes (plus one if the chain is compact),
+  then the values of its nodes:
+  one string index per byte if the chain is compact, else one value per node;
+* the running tokens, then the pending tokens: a count, then for each token
+  its identifier, the string index of its state, a flags byte,
+  its ``created`` timestamp, its ``updated`` timestamp
+  (as a varint difference with ``created`` if flag 2 is set),
+  its noise counters,
+  the node indexes of its event and state histories,
+  and the identifier of the token it inhibits (if flag 1 is set).
+
+Values (events and timestamps) are JSON-like,
+and stored as a type byte followed by their content.
+
+Loading accepts bytes, bytearrays and memoryviews,
+and does not copy them (except on Python 2).
+"""
+from __future__ import unicode_literals
+
+from operator import attrgetter
+from struct import Struct
+import sys
+
+from .history import EMPTY as EMPTY_HISTORY, History
+from .tokens import Token
+
+MAGIC = b'FSAT'
+VERSION = 1
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STRING, _LIST, _DICT = range(8)
+_INHIBITS = 1
+_DELTA = 2
+
+_DOUBLE = Struct(str('<d'))
+_value = attrgetter('value')
+
+if sys.version_info[0] >= 3:
+    _text = str
+    _integer = int
+else: # Python 2
+    _text = (str, unicode)
+    _integer = (int, long)
+
+
+def dump(tokens):
+    """Return the snapshot of token set `tokens`, as bytes."""
+    return _Dumper().dump(tokens)
+
+def load(data, tokens, compiled):
+    """Replace the content of token set `tokens` by snapshot `data`.
+
+    `compiled` is the compiled structure the tokens must be bound to.
+    Raise ValueError if `data` is not a valid snapshot.
+    """
+    if isinstance(data, memoryview):
+        if sys.version_info[0] >= 3:
+            data = data.cast('B')
+        else:
+            data = bytearray(data.tobytes())
+    elif not isinstance(data, bytearray) and sys.version_info[0] < 3:
+        data = bytearray(data)
+    try:
+        _Loader(data, compiled).load(tokens)
+    except (IndexError, KeyError, UnicodeDecodeError) as ex:
+        raise ValueError("Invalid snapshot (%s)" % ex)
+
+
+class _Dumper(object):
+
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+        self.nodes = { id(EMPTY_HISTORY): 0 }
+        self.chains = 0
+
+    def dump(self, tokens):
+        out = self.out
+        self.value(tokens.clock)
+        self.varint(tokens.next_id)
+        nodes = bytearray()
+        tokens_out = bytearray()
+        # histories first, so that tokens can refer to their nodes
+        self.out = nodes
+        refs = []
+        for group in (tokens.running, tokens.pending):
+            for token in group.values():
+                refs.append((self.history(token.history_events),
+                             self.history(token.history_states)))
+        self.out = tokens_out
+        i = 0
+        for group in (tokens.running, tokens.pending):
+            self.varint(len(group))
+            for tokenid, token in group.items():
+                self.token(tokenid, token, refs[i])
+                i += 1
+        # the string table is only complete now
+        header = bytearray(MAGIC)
+        header.append(VERSION)
+        self.out = header
+        strings = sorted(self.strings.items(), key=lambda item: item[1])
+        self.varint(len(strings))
+        for string, _ in strings:
+            encoded = string.encode('utf-8')
+            self.varint(len(encoded))
+            header += encoded
+        header += out
+        self.varint(self.chains)
+        header += nodes
+        header += tokens_out
+        return bytes(header)
+
+    def history(self, history):
+        """Dump the chain of nodes of `history` not dumped yet,
+        and return the index of its last node.
+        """
+        nodes = self.nodes
+        index = nodes.get(id(history))
+        if index is not None:
+            return index
+        chain = [None] * history.length
+        node = history
+        for i in range(history.length-1, -1, -1):
+            chain[i] = node
+            node = node.parent
+        # the nodes already dumped are a prefix of the chain
+        low, high = 0, len(chain) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if id(chain[middle]) in nodes:
+                low = middle + 1
+            else:
+                high = middle
+        parent = nodes[id(chain[low-1])] if low else 0
+        chain = chain[low:]
+        self.chains += 1
+        self.varint(len(nodes) - parent)
+        values = list(map(_value, chain))
+        strings = self.strings
+        try:
+            indexes = list(map(strings.get, values))
+            if None in indexes:
+                for value in set(values):
+                    if isinstance(value, _text):
+                        self.string(value)
+                indexes = list(map(strings.get, values))
+            compact = None not in indexes and max(indexes) < 0x100
+        except TypeError: # unhashable values
+            compact = False
+        if compact:
+            self.varint(len(chain) << 1 | 1)
+            self.out += bytearray(indexes)
+        else:
+            self.varint(len(chain) << 1)
+            for value in values:
+                self.value(value)
+        first = len(nodes)
+        nodes.update(zip(map(id, chain), range(first, first + len(chain))))
+        return len(nodes) - 1
+
+    def token(self, tokenid, token, refs):
+        self.varint(tokenid)
+        self.varint(self.string(token.state.id))
+        created = token.created
+        updated = token.updated
+        flags = 0
+        if token.inhibits is not None:
+            flags |= _INHIBITS
+        delta = isinstance(created, _integer) and isinstance(updated, _integer) \
+            and not isinstance(created, bool) and updated >= created
+        if delta:
+            flags |= _DELTA
+        self.out.append(flags)
+        self.value(created)
+        if delta:
+            self.varint(updated - created)
+        else:
+            self.value(updated)
+        self.varint(token.noise_state)
+        self.varint(token.noise_total)
+        self.varint(refs[0])
+        self.varint(refs[1])
+        if token.inhibits is not None:
+            self.varint(token.inhibits)
+
+    def string(self, string):
+        if isinstance(string, bytes):
+            string = string.decode('utf-8')
+        strings = self.strings
+        index = strings.get(string)
+        if index is None:
+            index = strings[string] = len(strings)
+        return index
+
+    def varint(self, value):
+        out = self.out
+        if value < 0x80:
+            out.append(value)
+            return
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def value(self, value):
+        out = self.out
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, _integer):
+            out.append(_INT)
+            # zigzag encoding
+            self.varint(value << 1 if value >= 0 else ((-value) << 1) - 1)
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _DOUBLE.pack(value)
+        elif isinstance(value, _text):
+            out.append(_STRING)
+            self.varint(self.string(value))
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            self.varint(len(value))
+            for item in value:
+                self.value(item)
+        elif isinstance(value, dict):
+            out.append(_DICT)
+            self.varint(len(value))
+            for key, item in value.items():
+                if not isinstance(key, _text):
+                    raise TypeError("Keys must be strings, not %r" % (key,))
+                self.varint(self.string(key))
+                self.value(item)
+        else:
+            raise TypeError("%r can not be stored in a snapshot" % (value,))
+
+
+class _Loader(object):
+
+    def __init__(self, data, compiled):
+        self.data = data
+        self.pos = 0
+        self.compiled = compiled
+
+    def load(self, tokens):
+        data = self.data
+        if bytes(data[:4]) != MAGIC:
+            raise ValueError("Not a snapshot")
+        if data[4] != VERSION:
+            raise ValueError("Unsupported snapshot version %d" % data[4])
+        self.pos = 5
+        varint = self.varint
+        self.strings = strings = []
+        for _ in range(varint()):
+            length = varint()
+            pos = self.pos
+            strings.append(_decode(data[pos:pos+length]))
+            self.pos = pos + length
+        clock = self.value()
+        next_id = varint()
+        nodes = [ EMPTY_HISTORY ]
+        append = nodes.append
+        value = self.value
+        for _ in range(varint()):
+            index = len(nodes) - varint()
+            if not 0 <= index < len(nodes):
+                raise ValueError("Invalid snapshot (bad history node)")
+            node = nodes[index]
+            length = node.length
+            count = varint()
+            compact = count & 1
+            count >>= 1
+            if compact:
+                pos = self.pos
+                indexes = data[pos:pos+count]
+                if len(indexes) < count:
+                    raise ValueError("Invalid snapshot (truncated)")
+                values = [ strings[i] for i in indexes ]
+                self.pos = pos + count
+            else:
+                values = [ value() for _ in range(count) ]
+            for event in values:
+                length += 1
+                node = History(event, node, length)
+                append(node)
+        self.nodes = nodes
+        running = self.tokens()
+        pending = self.tokens()
+        inhibitors = {}
+        for token in running.values():
+            if token.inhibits is not None:
+                inhibitors[token.inhibits] = inhibitors.get(token.inhibits, 0) + 1
+        tokens.clock = clock
+        tokens.position = 0
+        tokens.running = running
+        tokens.pending = pending
+        tokens.next_id = next_id
+        tokens.inhibitors = inhibitors
+        tokens._rebuild_deadlines()
+
+    def tokens(self):
+        varint = self.varint
+        value = self.value
+        strings = self.strings
+        nodes = self.nodes
+        compiled = self.compiled
+        states = compiled.states
+        ret = {}
+        for _ in range(varint()):
+            tokenid = varint()
+            stateid = strings[varint()]
+            index = compiled.index.get(stateid)
+            if index is None:
+                raise ValueError("Inconsistent position "
+                                 "(non-existing state %r)" % stateid)
+            flags = self.data[self.pos]
+            self.pos += 1
+            created = value()
+            if flags & _DELTA:
+                updated = created + varint()
+            else:
+                updated = value()
+            noise_state = varint()
+            noise_total = varint()
+            events = nodes[varint()]
+            history = nodes[varint()]
+            inhibits = varint() if flags & _INHIBITS else None
+            ret[tokenid] = Token(states[index], created, updated,
+                                 noise_state, noise_total, events, history,
+                                 inhibits)
+        return ret
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        byte = data[pos]
+        if byte < 0x80:
+            self.pos = pos + 1
+            return byte
+        ret = 0
+        shift = 0
+        while byte >= 0x80:
+            ret |= (byte & 0x7f) << shift
+            shift += 7
+            pos += 1
+            byte = data[pos]
+        self.pos = pos + 1
+        return ret | (byte << shift)
+
+    def value(self):
+        data = self.data
+        tag = data[self.pos]
+        self.pos += 1
+        if tag == _STRING:
+            return self.strings[self.varint()]
+        if tag == _INT:
+            zigzag = self.varint()
+            return zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _FLOAT:
+            ret, = _DOUBLE.unpack_from(data, self.pos)
+            self.pos += 8
+            return ret
+        if tag == _LIST:
+            return [ self.value() for _ in range(self.varint()) ]
+        if tag == _DICT:
+            ret = {}
+            for _ in range(self.varint()):
+                key = self.strings[self.varint()]
+                ret[key] = self.value()
+            return ret
+        raise ValueError("Invalid value type %d" % tag)
+
+
+def _decode(data):
+    if isinstance(data, bytearray):
+        return data.decode('utf-8')
+    return _text(data, 'utf-8') if sys.version_info[0] >= 3 \
+        else bytes(data).decode('utf-8')
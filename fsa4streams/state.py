@@ -1,22 +1,43 @@
+from copy import deepcopy
+try:
+    from collections.abc import MutableSequence
+except ImportError: # Python 2
+    from collections import MutableSequence
+
 _NOT_SET = object()
 
+def resolve_state_attribute(data, structure, name, default):
+    """Look up attribute `name` of a state,
+    first in the state `data` itself,
+    then in the ``state_defaults`` of the `structure`,
+    and finally fall back to `default`.
+    """
+    ret = data.get(name, _NOT_SET)
+    if ret is _NOT_SET:
+        defaults = structure.get('state_defaults')
+        if defaults:
+            ret = defaults.get(name, _NOT_SET)
+    if ret is _NOT_SET:
+        ret = default
+    return ret
+
 def _make_state_property(name, default, check_value, doc):
     def getter(self):
-        ret = self._data.get(name, _NOT_SET)
-        if ret is _NOT_SET:
-            defaults = self._fsa._structure.get('state_defaults')
-            if defaults:
-                ret = defaults.get(name, _NOT_SET)
-        if ret is _NOT_SET:
-            ret = default
-        return ret
+        return resolve_state_attribute(self._data, self._fsa._structure,
+                                       name, default)
 
     def setter(self, value):
         if not check_value(value):
             raise ValueError('Invalid value for State.%s: %r'
-                             % name, value)
+                             % (name, value))
+        self._fsa._own_structure()
+        self._data[name] = value
+        self._fsa._structure_changed()
+
     def deleter(self):
+        self._fsa._own_structure()
         del self._data[name]
+        self._fsa._structure_changed()
 
     return property(getter, setter, deleter, doc)
 
@@ -27,7 +48,12 @@ class State(object):
     def __init__(self, fsa, stateid):
         self._fsa = fsa
         self._id = stateid
-        self._data = fsa._structure['states'][stateid]
+        fsa._structure['states'][stateid] # raise KeyError if missing
+
+    @property
+    def _data(self):
+        # looked up every time, as the FSA may copy its structure
+        return self._fsa._structure['states'][self._id]
 
     @property
     def fsa(self):
@@ -44,22 +70,22 @@ class State(object):
 
     max_noise = _make_state_property('max_noise',
                                      0,
-                                     lambda v: type(v) is int  and  int >=0,
+                                     lambda v: type(v) is int  and  v >=0,
                                      "TODO doc")
 
     max_total_noise = _make_state_property('max_total_noise',
                                      None,
-                                     lambda v: type(v) is int  and  int >=0,
+                                     lambda v: type(v) is int  and  v >=0,
                                      "TODO doc")
 
     max_duration = _make_state_property('max_duration',
                                         None,
-                                        lambda v: type(v) is int  and  int >0,
+                                        lambda v: type(v) is int  and  v >0,
                                         "TODO doc")
 
     max_total_duration = _make_state_property('max_total_duration',
                                         None,
-                                        lambda v: type(v) is int  and  int >0,
+                                        lambda v: type(v) is int  and  v >0,
                                         "TODO doc")
 
     default_transition = _make_state_property('default_transition',
@@ -70,10 +96,13 @@ class State(object):
     @property
     def transitions(self):
         """TODO doc"""
-        ret = self._data.get('transitions')
-        if ret is None:
-            ret = self._data['transitions'] = []
-        return ret
+        return _Transitions(self)
+
+    @transitions.setter
+    def transitions(self, value):
+        self._fsa._own_structure()
+        self._data['transitions'] = list(value)
+        self._fsa._structure_changed()
 
     def add_state(self, *args, **kw):
         """Shortcut method to self.fsa.add_state,
@@ -97,7 +126,7 @@ class State(object):
             'target': target,
         }
         transition.update(kw)
-        self._data['transitions'].append(transition)
+        self.transitions.append(transition)
         return self
 
     def set_default_transition(self, target, **kw):
@@ -110,5 +139,60 @@ class State(object):
             'target': target,
         }
         transition.update(kw)
+        self._fsa._own_structure()
         self._data['default_transition'] = transition
+        self._fsa._structure_changed()
         return self
+
+
+class _Transitions(MutableSequence):
+    """The transitions of a state, as returned by :attr:`State.transitions`.
+
+    Reading them does not copy the structure of the FSA,
+    which may be shared (see :mod:`fsa4streams.cache`);
+    modifying them does, and invalidates its compiled form.
+    Items are copies, so a transition must be replaced
+    rather than modified in place.
+    """
+
+    def __init__(self, state):
+        self._state = state
+
+    def _list(self):
+        return self._state._data.get('transitions') or []
+
+    def _modify(self, method, *args):
+        fsa = self._state._fsa
+        fsa._own_structure()
+        data = self._state._data
+        transitions = data.get('transitions')
+        if transitions is None:
+            transitions = data['transitions'] = []
+        getattr(transitions, method)(*args)
+        fsa._structure_changed()
+
+    def __len__(self):
+        return len(self._list())
+
+    def __getitem__(self, index):
+        return deepcopy(self._list()[index])
+
+    def __setitem__(self, index, value):
+        self._modify('__setitem__', index, value)
+
+    def __delitem__(self, index):
+        self._modify('__delitem__', index)
+
+    def insert(self, index, value):
+        self._modify('insert', index, value)
+
+    def __eq__(self, other):
+        if isinstance(other, _Transitions):
+            other = other._list()
+        return self._list() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._list())
@@ -0,0 +1,519 @@
+"""
+Internal representation of tokens.
+
+While running, an FSA represents its tokens as :class:`Token` instances,
+identified by integers.
+They are converted to the dict/JSON format
+(see :meth:`~fsa4streams.fsa.FSA.export_tokens_as_dict`)
+only when exported or returned as matches (see :class:`Match`).
+"""
+from __future__ import unicode_literals
+
+from heapq import heapify, heappop, heappush
+import re
+
+from .history import History
+
+_INT_ID = re.compile(r'^(0|[1-9][0-9]*)$')
+
+def _int_id(key):
+    """Return `key` as an integer identifier, or None if not applicable."""
+    if isinstance(key, int):
+        return key if key >= 0 else None
+    if _INT_ID.match(key):
+        return int(key)
+    return None
+
+
+class Match(dict):
+    """A match, in the dict/JSON format of tokens.
+
+    In addition, ``start`` and ``end`` are the offsets,
+    in the stream ingested by the token set,
+    of the first and last events consumed by the match
+    (see :attr:`TokenSet.position`),
+    or None if unknown (for tokens loaded from an export).
+    They are attributes rather than keys,
+    so that the dict/JSON format is unchanged.
+    """
+
+    __slots__ = ('start', 'end')
+
+    def __init__(self, data=(), start=None, end=None):
+        dict.__init__(self, data)
+        self.start = start
+        self.end = end
+
+
+class Token(object):
+    """A token running through an FSA.
+
+    ``state`` is the :class:`~fsa4streams.compiled.CompiledState`
+    where the token currently is.
+    ``history_events`` and ``history_states`` are
+    :class:`~fsa4streams.history.History` instances,
+    so they can be shared by copies of this token.
+    ``inhibits`` is the identifier of the pending token inhibited by this one,
+    if any.
+    ``start`` and ``end`` are the offsets of the events
+    where ``created`` and ``updated`` were set (see :class:`Match`).
+    """
+
+    __slots__ = ('state', 'created', 'updated', 'noise_state', 'noise_total',
+                 'history_events', 'history_states', 'inhibits',
+                 'start', 'end')
+
+    def __init__(self, state, created, updated, noise_state, noise_total,
+                 history_events, history_states, inhibits=None,
+                 start=None, end=None):
+        self.state = state
+        self.created = created
+        self.updated = updated
+        self.noise_state = noise_state
+        self.noise_total = noise_total
+        self.history_events = history_events
+        self.history_states = history_states
+        self.inhibits = inhibits
+        self.start = start
+        self.end = end
+
+    def copy(self):
+        return Token(self.state, self.created, self.updated,
+                     self.noise_state, self.noise_total,
+                     self.history_events, self.history_states,
+                     self.inhibits, self.start, self.end)
+
+    def deadline(self):
+        """Return the timestamp after which this token will have expired,
+        or None if its state has no duration constraint.
+        """
+        state = self.state
+        ret = None
+        if state.max_total_duration:
+            ret = self.created + state.max_total_duration
+        if state.max_duration:
+            deadline = self.updated + state.max_duration
+            if ret is None or deadline < ret:
+                ret = deadline
+        return ret
+
+    def expired(self, timestamp):
+        """Return the name of the duration constraint violated at `timestamp`
+        ('max_total_duration' or 'max_duration'), or None.
+        """
+        state = self.state
+        if state.max_total_duration \
+        and timestamp-self.created > state.max_total_duration:
+            return 'max_total_duration'
+        if state.max_duration \
+        and timestamp-self.updated > state.max_duration:
+            return 'max_duration'
+        return None
+
+    def __getitem__(self, key):
+        # for matchers written when tokens were plain dicts
+        if key == 'state':
+            return self.state.id
+        if key in ('history_events', 'history_states'):
+            return getattr(self, key).to_list(self.state.history_limit)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def as_dict(self, factory=dict):
+        """Convert this token to the dict/JSON format.
+
+        `factory` is the type of the returned dict.
+        """
+        state = self.state
+        limit = state.history_limit
+        ret = factory()
+        ret['state'] = state.id
+        ret['created'] = self.created
+        ret['updated'] = self.updated
+        ret['noise_state'] = self.noise_state
+        ret['noise_total'] = self.noise_total
+        ret['history_events'] = self.history_events.to_list(limit)
+        ret['history_states'] = self.history_states.to_list(limit)
+        if self.inhibits is not None:
+            ret['inhibits'] = '%d' % self.inhibits
+        return ret
+
+    def as_match(self):
+        """Convert this token to a :class:`Match`."""
+        ret = self.as_dict(Match)
+        ret.start = self.start
+        ret.end = self.end
+        return ret
+
+    @classmethod
+    def from_dict(cls, data, compiled, ids):
+        """Build a token from the dict/JSON format.
+
+        `ids` maps the identifiers used in the dict format
+        to the integer identifiers of the token set.
+        """
+        stateid = data['state']
+        index = compiled.index.get(stateid)
+        if index is None:
+            raise ValueError("Inconsistent position "
+                             "(non-existing state %r)" % stateid)
+        return cls(compiled.states[index],
+                   data['created'], data['updated'],
+                   data['noise_state'], data['noise_total'],
+                   History.from_list(data['history_events']),
+                   History.from_list(data['history_states']),
+                   ids.get(data.get('inhibits')))
+
+
+class TokenSet(object):
+    """The running and pending tokens of an FSA, and its clock.
+
+    ``position`` is the number of events ingested
+    since this token set was created, cleared or loaded,
+    i.e. the offset of the next event (see :class:`Match`).
+
+    ``running`` and ``pending`` map integer identifiers to tokens.
+    Identifiers are allocated by :meth:`new_id`, in increasing order,
+    and start again from 0 whenever no token is left (see :meth:`settle`),
+    so that an idle token set is entirely described by its clock.
+
+    ``inhibitors`` maps the identifier of every inhibited pending token
+    to the number of *running* tokens inhibiting it.
+    To keep it up to date,
+    running tokens must be added with :meth:`add_running`,
+    removed with :meth:`remove_running`,
+    and their ``inhibits`` attribute must be changed with :meth:`inhibit`.
+
+    ``deadlines`` is a heap of (deadline, identifier) pairs,
+    used to find expired running tokens without checking all of them
+    (see :meth:`pop_expired`).
+    A running token must be (re-)scheduled with :meth:`schedule`
+    whenever its state or ``updated`` attribute changes;
+    outdated entries are simply ignored.
+    """
+
+    __slots__ = ('clock', 'running', 'pending', 'next_id', 'inhibitors',
+                 'deadlines', 'position')
+
+    def __init__(self):
+        self.clock = None
+        self.position = 0
+        self.running = {}
+        self.pending = {}
+        self.next_id = 0
+        self.inhibitors = {}
+        self.deadlines = []
+
+    def new_id(self):
+        ret = self.next_id
+        self.next_id = ret + 1
+        return ret
+
+    def clear(self):
+        self.running.clear()
+        self.pending.clear()
+        self.inhibitors.clear()
+        del self.deadlines[:]
+        self.clock = None
+        self.next_id = 0
+        self.position = 0
+
+    def settle(self):
+        """Forget identifiers and deadlines if no token is left."""
+        if not self.running and not self.pending:
+            self.next_id = 0
+            del self.deadlines[:]
+
+    def add_running(self, token):
+        """Add `token` to the running tokens, and return its new id."""
+        tokenid = self.next_id
+        self.next_id = tokenid + 1
+        self.running[tokenid] = token
+        if token.inhibits is not None:
+            inhibitors = self.inhibitors
+            inhibitors[token.inhibits] = inhibitors.get(token.inhibits, 0) + 1
+        if token.state.timed:
+            self.schedule(tokenid, token)
+        return tokenid
+
+    def remove_running(self, tokenid):
+        """Remove the running token `tokenid` and return it."""
+        token = self.running.pop(tokenid)
+        if token.inhibits is not None:
+            self._release(token.inhibits)
+        return token
+
+    def inhibit(self, token, pendingid):
+        """Make the running `token` inhibit pending token `pendingid`
+        (or no token if `pendingid` is None)
+        instead of the one it previously inhibited.
+        """
+        if token.inhibits is not None:
+            self._release(token.inhibits)
+        token.inhibits = pendingid
+        if pendingid is not None:
+            inhibitors = self.inhibitors
+            inhibitors[pendingid] = inhibitors.get(pendingid, 0) + 1
+
+    def is_inhibited(self, pendingid):
+        """Whether any running token inhibits pending token `pendingid`."""
+        return pendingid in self.inhibitors
+
+    def _release(self, pendingid):
+        inhibitors = self.inhibitors
+        count = inhibitors[pendingid] - 1
+        if count:
+            inhibitors[pendingid] = count
+        else:
+            del inhibitors[pendingid]
+
+    def schedule(self, tokenid, token):
+        """Record the deadline of running token `tokenid`, if any."""
+        deadline = token.deadline()
+        if deadline is None:
+            return
+        deadlines = self.deadlines
+        heappush(deadlines, (deadline, tokenid))
+        if len(deadlines) > 2*len(self.running) + 64:
+            # too many outdated entries
+            self._rebuild_deadlines()
+
+    def pop_expired(self, timestamp):
+        """Remove from ``deadlines`` all the running tokens expired at `timestamp`.
+
+        Return a dict mapping their identifier
+        to the duration constraint they violate (see :meth:`Token.expired`).
+        The tokens themselves are *not* removed.
+        """
+        deadlines = self.deadlines
+        running = self.running
+        expired = {}
+        postponed = []
+        while deadlines and deadlines[0][0] <= timestamp:
+            deadline, tokenid = heappop(deadlines)
+            token = running.get(tokenid)
+            if token is None or token.deadline() != deadline:
+                continue # outdated entry
+            reason = token.expired(timestamp)
+            if reason is None:
+                # deadline reached but not exceeded
+                postponed.append((deadline, tokenid))
+            else:
+                expired[tokenid] = reason
+        for entry in postponed:
+            heappush(deadlines, entry)
+        return expired
+
+    def _rebuild_deadlines(self):
+        deadlines = []
+        for tokenid, token in self.running.items():
+            deadline = token.deadline()
+            if deadline is not None:
+                deadlines.append((deadline, tokenid))
+        heapify(deadlines)
+        self.deadlines = deadlines
+
+    def is_busy(self):
+        return len(self.running) > 0  or  len(self.pending) > 0
+
+    def rebind(self, compiled):
+        """Make all tokens point to the states of `compiled`.
+
+        This is required when the structure has been recompiled.
+        """
+        for token in self.all_tokens():
+            index = compiled.index.get(token.state.id)
+            if index is None:
+                raise ValueError("Inconsistent position "
+                                 "(non-existing state %r)" % token.state.id)
+            token.state = compiled.states[index]
+        self._rebuild_deadlines()
+
+    def all_tokens(self):
+        for token in self.running.values():
+            yield token
+        for token in self.pending.values():
+            yield token
+
+    def as_dict(self):
+        """Convert this token set to the dict/JSON format."""
+        return {
+            'clock': self.clock,
+            'running': dict( ('%d' % tokenid, token.as_dict())
+                             for tokenid, token in self.running.items() ),
+            'pending': dict( ('%d' % tokenid, token.as_dict())
+                             for tokenid, token in self.pending.items() ),
+        }
+
+    def load_dict(self, data, compiled):
+        """Replace the content of this token set by `data`,
+        in the dict/JSON format.
+
+        Integer identifiers are kept;
+        other identifiers are replaced by new integers.
+        The identifiers of pending tokens that have already been deleted,
+        but are still inhibited by a running token,
+        are kept as well,
+        and new identifiers are allocated after them.
+        """
+        running = data.get('running') or {}
+        pending = data.get('pending') or {}
+        keys = list(running) + list(pending)
+        known = set(keys)
+        for tdata in list(running.values()) + list(pending.values()):
+            otherid = tdata.get('inhibits')
+            if otherid is not None and otherid not in known:
+                # inhibited token has already been deleted
+                keys.append(otherid)
+                known.add(otherid)
+        ids = dict( (key, _int_id(key)) for key in keys )
+        if None not in ids.values():
+            next_id = max(ids.values()) + 1 if ids else 0
+        else:
+            ids = dict( (key, i) for i, key in enumerate(keys) )
+            next_id = len(keys)
+        new_running = dict( (ids[key], Token.from_dict(tdata, compiled, ids))
+                            for key, tdata in running.items() )
+        new_pending = dict( (ids[key], Token.from_dict(tdata, compiled, ids))
+                            for key, tdata in pending.items() )
+        inhibitors = {}
+        for token in new_running.values():
+            if token.inhibits is not None:
+                inhibitors[token.inhibits] = inhibitors.get(token.inhibits, 0) + 1
+        self.clock = data.get('clock')
+        self.position = 0
+        self.running = new_running
+        self.pending = new_pending
+        self.next_id = next_id
+        self.inhibitors = inhibitors
+        self._rebuild_deadlines()
+
+    def fingerprint(self):
+        """Return a shallow copy of the current tokens, to be passed later
+        to :meth:`as_delta`.
+
+        Tokens and histories are not copied,
+        only the attributes that a token changes in place.
+        """
+        return tuple(
+            dict( (tokenid, (token, token.history_events, token.history_states,
+                             _mutable(token)))
+                  for tokenid, token in group.items() )
+            for group in (self.running, self.pending) )
+
+    def as_delta(self, fingerprint=None):
+        """Return the changes since `fingerprint` (see :meth:`fingerprint`)
+        in the dict/JSON format.
+
+        The delta has the following keys:
+
+        * ``clock`` and ``next_id``;
+        * ``running`` and ``pending`` map the identifiers of new tokens
+          (or tokens that changed too much) to the dict format of the token;
+        * ``moved`` maps the identifiers of tokens which only moved forward
+          to a dict with their new ``state``, ``updated``, ``noise_state``,
+          ``noise_total`` and ``inhibits``,
+          and the events and states added to their histories;
+        * ``deleted`` lists the identifiers of the deleted tokens.
+
+        If `fingerprint` is None, the delta contains all tokens.
+        """
+        old_groups = fingerprint or ({}, {})
+        new = {}, {}
+        moved = {}
+        for group, old, out in zip((self.running, self.pending), old_groups,
+                                   new):
+            for tokenid, token in group.items():
+                before = old.get(tokenid)
+                if before is not None and before[0] is token:
+                    events = token.history_events
+                    states = token.history_states
+                    mutable = _mutable(token)
+                    if events is before[1] and states is before[2] \
+                    and mutable == before[3]:
+                        continue # unchanged
+                    events = events.tail(before[1])
+                    states = states.tail(before[2])
+                    if events is not None and states is not None:
+                        moved['%d' % tokenid] = {
+                            'state': token.state.id,
+                            'updated': token.updated,
+                            'noise_state': token.noise_state,
+                            'noise_total': token.noise_total,
+                            'inhibits': None if token.inhibits is None
+                                        else '%d' % token.inhibits,
+                            'history_events': events,
+                            'history_states': states,
+                        }
+                        continue
+                out['%d' % tokenid] = token.as_dict()
+        running, pending = self.running, self.pending
+        deleted = [ '%d' % tokenid
+                    for old in old_groups
+                    for tokenid in old
+                    if tokenid not in running and tokenid not in pending ]
+        return {
+            'clock': self.clock,
+            'next_id': self.next_id,
+            'running': new[0],
+            'pending': new[1],
+            'moved': moved,
+            'deleted': deleted,
+        }
+
+    def apply_delta(self, delta, compiled):
+        """Apply `delta` (see :meth:`as_delta`) to this token set.
+
+        `compiled` is the compiled structure the new tokens must be bound to.
+        """
+        running = self.running
+        pending = self.pending
+        for key in delta['deleted']:
+            tokenid = int(key)
+            running.pop(tokenid, None)
+            pending.pop(tokenid, None)
+        for group, other, name in ((running, pending, 'running'),
+                                   (pending, running, 'pending')):
+            tokens = delta[name]
+            ids = dict( (data['inhibits'], int(data['inhibits']))
+                        for data in tokens.values() if 'inhibits' in data )
+            for key, data in tokens.items():
+                tokenid = int(key)
+                other.pop(tokenid, None)
+                group[tokenid] = Token.from_dict(data, compiled, ids)
+        for key, data in delta['moved'].items():
+            tokenid = int(key)
+            token = running.get(tokenid)
+            if token is None:
+                token = pending[tokenid]
+            stateid = data['state']
+            index = compiled.index.get(stateid)
+            if index is None:
+                raise ValueError("Inconsistent position "
+                                 "(non-existing state %r)" % stateid)
+            token.state = compiled.states[index]
+            token.updated = data['updated']
+            token.noise_state = data['noise_state']
+            token.noise_total = data['noise_total']
+            inhibits = data['inhibits']
+            token.inhibits = None if inhibits is None else int(inhibits)
+            for event in data['history_events']:
+                token.history_events = token.history_events.push(event)
+            for stateid in data['history_states']:
+                token.history_states = token.history_states.push(stateid)
+        inhibitors = {}
+        for token in running.values():
+            if token.inhibits is not None:
+                inhibitors[token.inhibits] = inhibitors.get(token.inhibits, 0) + 1
+        self.clock = delta['clock']
+        self.next_id = delta['next_id']
+        self.inhibitors = inhibitors
+        self._rebuild_deadlines()
+
+
+def _mutable(token):
+    """The attributes of `token` changed in place, except its histories."""
+    return (token.state, token.updated, token.noise_state, token.noise_total,
+            token.inhibits)
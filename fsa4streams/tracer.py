@@ -0,0 +1,163 @@
+"""
+Tracing the execution of an FSA.
+
+A tracer is an object receiving a notification
+for everything that happens to the tokens of an FSA:
+creations, moves, drops, inhibitions and matches.
+It is attached to an FSA through its ``tracer`` attribute::
+
+    fsa.tracer = RecordingTracer()
+    fsa.feed_all(events)
+    print(fsa.tracer.records)
+
+Tracers should inherit :class:`Tracer`,
+and override the methods they are interested in.
+Every method receives the identifier of the token
+(or None if it has none anymore)
+and the token itself, as a :class:`~fsa4streams.tokens.Token` instance.
+Tokens are modified in place while the FSA runs,
+so a tracer must copy the information it wants to keep.
+
+When an FSA has no tracer, the tracing code is skipped altogether,
+unless debug messages are enabled on the ``fsa4streams.fsa`` logger,
+in which case a :class:`LoggingTracer` is used.
+"""
+from __future__ import unicode_literals
+
+import logging
+
+
+class Tracer(object):
+    """Base class of tracers, ignoring all notifications."""
+
+    def event(self, event, timestamp):
+        """An event is about to be processed."""
+
+    def advanced(self, timestamp):
+        """The clock is advanced to `timestamp` without any event."""
+
+    def created(self, tokenid, token):
+        """A new token was created in the state following 'start'."""
+
+    def moved(self, tokenid, token, oldstate, transition):
+        """A running token moved from `oldstate` through `transition`."""
+
+    def forked(self, tokenid, token, parentid):
+        """A copy of token `parentid` followed another transition."""
+
+    def noise(self, tokenid, token):
+        """A running token ignored the event."""
+
+    def pending(self, tokenid, token, inhibitorid):
+        """A token was kept pending, inhibited by running token `inhibitorid`.
+        """
+
+    def dropped(self, tokenid, token, reason):
+        """A token was discarded.
+
+        `reason` is one of 'max_duration', 'max_total_duration', 'max_noise',
+        'max_total_noise', 'superseded' (a pending token replaced by a longer
+        one), 'overlap' or 'finish' (a non-terminal token still running
+        when the FSA is finished).
+        """
+
+    def matched(self, tokenid, token):
+        """A token became a match."""
+
+    def finishing(self):
+        """The FSA is being finished."""
+
+
+class LoggingTracer(Tracer):
+    """A tracer sending every notification as a debug message to `logger`.
+    """
+
+    def __init__(self, logger=None):
+        if logger is None:
+            logger = logging.getLogger('fsa4streams.fsa')
+        self.logger = logger
+
+    def event(self, event, timestamp):
+        self.logger.debug('event %r at timestamp %s', event, timestamp)
+
+    def advanced(self, timestamp):
+        self.logger.debug('clock advanced to %s', timestamp)
+
+    def created(self, tokenid, token):
+        self.logger.debug('  new token %s in %r', tokenid, token.state.id)
+
+    def moved(self, tokenid, token, oldstate, transition):
+        self.logger.debug('  token %s in %r moved to %r%s',
+                          tokenid, oldstate.id, token.state.id,
+                          ' (silently)' if transition.silent else '')
+
+    def forked(self, tokenid, token, parentid):
+        self.logger.debug('  token %s also moved to %r (as token %s)',
+                          parentid, token.state.id, tokenid)
+
+    def noise(self, tokenid, token):
+        self.logger.debug('  token %s in %r added noise',
+                          tokenid, token.state.id)
+
+    def pending(self, tokenid, token, inhibitorid):
+        self.logger.debug('  token %s in %r is kept pending '
+                          '(inhibited by token %s)',
+                          tokenid, token.state.id, inhibitorid)
+
+    def dropped(self, tokenid, token, reason):
+        self.logger.debug('  token %s in %r was dropped (%s)',
+                          tokenid, token.state.id, reason)
+
+    def matched(self, tokenid, token):
+        self.logger.debug('  token %s in %r matched',
+                          tokenid, token.state.id)
+
+    def finishing(self):
+        self.logger.debug('finishing')
+
+
+class RecordingTracer(Tracer):
+    """A tracer storing every notification in its ``records`` list.
+
+    Each record is a tuple,
+    whose first item is the name of the notification method,
+    followed by the token identifier and the identifier of its state.
+    Moves also record the identifier of the previous state;
+    pending tokens record the identifier of their inhibitor,
+    and drops record their reason.
+    Events are recorded as ('event', event, timestamp),
+    and clock advances as ('advanced', timestamp).
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def event(self, event, timestamp):
+        self.records.append(('event', event, timestamp))
+
+    def advanced(self, timestamp):
+        self.records.append(('advanced', timestamp))
+
+    def created(self, tokenid, token):
+        self.records.append(('created', tokenid, token.state.id))
+
+    def moved(self, tokenid, token, oldstate, transition):
+        self.records.append(('moved', tokenid, token.state.id, oldstate.id))
+
+    def forked(self, tokenid, token, parentid):
+        self.records.append(('forked', tokenid, token.state.id, parentid))
+
+    def noise(self, tokenid, token):
+        self.records.append(('noise', tokenid, token.state.id))
+
+    def pending(self, tokenid, token, inhibitorid):
+        self.records.append(('pending', tokenid, token.state.id, inhibitorid))
+
+    def dropped(self, tokenid, token, reason):
+        self.records.append(('dropped', tokenid, token.state.id, reason))
+
+    def matched(self, tokenid, token):
+        self.records.append(('matched', tokenid, token.state.id))
+
+    def finishing(self):
+        self.records.append(('finishing',))
@@ -0,0 +1,333 @@
+"""
+Vectorized execution on integer-encoded event streams.
+
+This module requires numpy (``pip install fsa4streams[numpy]``).
+
+When events come from a small vocabulary,
+:class:`VectorizedFSA` encodes them once as integers
+(see :meth:`VectorizedFSA.encode`),
+then runs a whole array of event codes at once
+(see :meth:`VectorizedFSA.run`),
+returning the matches as arrays rather than dicts.
+
+For structures eligible to the deterministic fast path
+(see :mod:`fsa4streams.dfa`),
+the events that can not start a token are located over the whole array
+with numpy, so that the stretches of the stream where no token is running
+are skipped altogether;
+the other events are processed with integer table lookups.
+Other structures fall back to the token engine,
+with the same results.
+
+Note that the interactions between tokens
+(a token is not created in a state already occupied,
+matches remove the tokens they overlap)
+make the result at each event depend on all previous events,
+so the events where tokens are running are processed sequentially.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .tokens import TokenSet
+
+
+class Matches(namedtuple('Matches', ['index', 'start', 'end', 'state',
+                                       'created', 'updated'])):
+    """Matches found by :meth:`VectorizedFSA.run`, as arrays.
+
+    ``index`` is the position of the event that produced each match
+    (or the length of the stream for matches produced by the end of the stream).
+    ``start`` and ``end`` are the positions in the stream
+    of the first and last event of each match
+    (see :class:`~fsa4streams.tokens.Match`).
+    ``state`` is the index of the state of each match
+    in :attr:`VectorizedFSA.state_ids`.
+    ``created`` and ``updated`` are the timestamps of the same events;
+    when no timestamps are given, they are equal to ``start`` and ``end``.
+    """
+    __slots__ = ()
+
+
+class VectorizedFSA(object):
+    """Run an FSA on arrays of integer-encoded events.
+
+    The vocabulary maps each code to an event;
+    it initially contains all the events used by the structure
+    (if it is eligible to the fast path), followed by `vocabulary`,
+    and grows whenever :meth:`encode` meets a new event.
+
+    ``problems`` lists the reasons why the structure can not be vectorized
+    (see :meth:`FSA.check_dfa <fsa4streams.fsa.FSA.check_dfa>`);
+    if it is not empty, :meth:`run` falls back to the token engine.
+    The structure of the FSA must not be modified afterwards.
+    """
+
+    def __init__(self, fsa, vocabulary=()):
+        if numpy is None:
+            raise ImportError("VectorizedFSA requires numpy")
+        self.fsa = fsa
+        compiled = fsa._compiled_for_running()
+        self.state_ids = [ state.id for state in compiled.states ]
+        self._state_index = compiled.index
+        dfa = compiled.dfa()
+        self.problems = list(dfa.problems)
+        self.vocabulary = []
+        self._codes = {}
+        if not self.problems:
+            self._dfa = dfa
+            for row in dfa.table:
+                if row is None:
+                    continue # unreachable state
+                for event in row:
+                    self._add(event)
+        # events with a code >= _known satisfy no transition
+        self._known = len(self.vocabulary)
+        for event in vocabulary:
+            self._add(event)
+        if not self.problems:
+            known = self._known
+            self._table = table = []
+            for row in dfa.table:
+                codes = [-1] * known
+                if row is not None: # else unreachable state
+                    for event, target in row.items():
+                        codes[self._codes[event]] = target
+                table.append(codes)
+            self._starters = numpy.array([ code >= 0 for code in table[0] ]
+                                         + [False], dtype=bool)
+
+    def _add(self, event):
+        code = self._codes.get(event)
+        if code is None:
+            code = self._codes[event] = len(self.vocabulary)
+            self.vocabulary.append(event)
+        return code
+
+    def encode(self, events):
+        """Return an array with the code of each event in `events`.
+
+        Events must be hashable.
+        """
+        codes = self._codes
+        add = self._add
+        return numpy.array([ codes[event] if event in codes else add(event)
+                             for event in events ], dtype=numpy.intp)
+
+    def decode(self, codes):
+        """Return the list of events encoded by `codes`."""
+        vocabulary = self.vocabulary
+        return [ vocabulary[code] for code in codes ]
+
+    def run(self, codes, timestamps=None):
+        """Ingest the events encoded by `codes`, then finish,
+        and return the resulting :class:`Matches`.
+
+        If provided, `timestamps` is an array with the same length as `codes`,
+        which must be non-decreasing.
+        The matches are the same (and in the same order) as the ones
+        returned by :meth:`FSA.feed_all <fsa4streams.fsa.FSA.feed_all>`
+        (or :meth:`~fsa4streams.fsa.FSA.feed_all_timestamps`)
+        on a fresh FSA;
+        the tokens of the FSA itself are not used.
+        As they are not returned as dicts,
+        the matches are not written to the sink of the FSA
+        (see :mod:`fsa4streams.sink`), whichever path is used.
+        """
+        codes = numpy.asarray(codes, dtype=numpy.intp)
+        if timestamps is not None:
+            timestamps = numpy.asarray(timestamps)
+            if len(timestamps) != len(codes):
+                raise ValueError("codes and timestamps have different lengths")
+            if len(timestamps) > 1 and (numpy.diff(timestamps) < 0).any():
+                raise ValueError("timestamps must be non-decreasing")
+        if self.problems:
+            records = self._run_tokens(codes, timestamps)
+        else:
+            records = self._run_table(codes, timestamps)
+        if not records:
+            empty = numpy.array([], dtype=numpy.intp)
+            if timestamps is None:
+                return Matches(empty, empty, empty, empty, empty, empty)
+            empty_stamps = timestamps[:0]
+            return Matches(empty, empty, empty, empty,
+                           empty_stamps, empty_stamps)
+        index, start, end, state = (
+            numpy.array(column, dtype=numpy.intp) for column in zip(*records)
+        )
+        if timestamps is None:
+            return Matches(index, start, end, state, start, end)
+        return Matches(index, start, end, state,
+                       timestamps[start], timestamps[end])
+
+    def _run_tokens(self, codes, timestamps):
+        """Implementation of :meth:`run` with the token engine,
+        returning a list of (index, start, end, state) records.
+        """
+        fsa = self.fsa
+        compiled = fsa._compiled_for_running()
+        trace = fsa._get_tracer()
+        events = self.decode(codes)
+        tokens = TokenSet()
+        # the fast path is not eligible, and the sink is not used
+        if timestamps is None:
+            matches = fsa._run_tokens(compiled, tokens, events, False, trace)
+        else:
+            matches = fsa._run_tokens(compiled, tokens,
+                                      zip(events, timestamps.tolist()), True,
+                                      trace)
+        matches = list(matches)
+        matches += [ (len(codes), match)
+                     for match in fsa._finish(tokens, False) ]
+        state_index = self._state_index
+        return [ (i, match.start, match.end, state_index[match['state']])
+                 for i, match in matches ]
+
+    def _run_table(self, codes, timestamps):
+        """Implementation of :meth:`run` with integer tables,
+        returning a list of (index, start, end, state) records.
+
+        This mirrors :meth:`DFA.run <fsa4streams.dfa.DFA.run>`,
+        allocating token identifiers in the same way,
+        so that tokens are processed in the same order.
+        Tokens are lists [state, created, updated, inhibits],
+        pending tokens are tuples (state, created, updated).
+        """
+        dfa = self._dfa
+        table = self._table
+        start_row = table[0]
+        known = self._known
+        terminal = dfa.terminal
+        final = dfa.final
+        allow_overlap = dfa.allow_overlap
+        if timestamps is None:
+            stamp = lambda pos: pos
+        else:
+            stamp = timestamps.tolist().__getitem__
+        code_list = codes.tolist()
+        n = len(code_list)
+        # events that can start a token
+        starters = numpy.flatnonzero(
+            self._starters[numpy.minimum(codes, known)]).tolist()
+        nstarters = len(starters)
+        next_starter = 0
+
+        running = {}
+        pending = {}
+        occupied = [0] * len(table)
+        next_id = 0
+        records = []
+        pos = 0
+        while pos < n:
+            if not running:
+                # skip all events until the next one starting a token
+                while next_starter < nstarters and starters[next_starter] < pos:
+                    next_starter += 1
+                if next_starter == nstarters:
+                    break
+                pos = starters[next_starter]
+                next_starter += 1
+            code = code_list[pos]
+            if code >= known:
+                code = None
+            matches = []
+            skip_create = False
+            arrived = None
+
+            for tokenid, token in list(running.items()):
+                state = token[0]
+                target = -1 if code is None else table[state][code]
+                if target < 0:
+                    del running[tokenid]
+                    occupied[state] -= 1
+                    inhibits = token[3]
+                    if terminal[state]:
+                        matches.append((pos, token[1], token[2], state))
+                        if inhibits is not None:
+                            pending.pop(inhibits, None)
+                    elif inhibits is not None:
+                        other = pending.pop(inhibits, None)
+                        if other is not None:
+                            matches.append((pos, other[1], other[2], other[0]))
+                    continue
+                if state == 0:
+                    skip_create = True
+                if terminal[state]:
+                    if token[3] is not None:
+                        pending.pop(token[3], None)
+                    pending[next_id] = (state, token[1], token[2])
+                    token[3] = next_id
+                    next_id += 1
+                occupied[state] -= 1
+                occupied[target] += 1
+                token[0] = target
+                token[2] = pos
+                if final[target]:
+                    if arrived is None:
+                        arrived = []
+                    arrived.append(tokenid)
+
+            if not skip_create and code is not None:
+                target = start_row[code]
+                if target >= 0 and not occupied[target]:
+                    running[next_id] = [target, pos, pos, None]
+                    occupied[target] += 1
+                    if final[target]:
+                        if arrived is None:
+                            arrived = []
+                        arrived.append(next_id)
+                    next_id += 1
+
+            if arrived is not None:
+                if len(arrived) > 1:
+                    arrived = set(arrived)
+                    arrived = [ tokenid for tokenid in running
+                                if tokenid in arrived ]
+                for tokenid in arrived:
+                    token = running.pop(tokenid)
+                    occupied[token[0]] -= 1
+                    matches.append((pos, token[1], token[2], token[0]))
+                    if token[3] is not None:
+                        pending.pop(token[3], None)
+
+            if matches and not allow_overlap:
+                max_updated = max( stamp(match[2]) for match in matches )
+                for tokenid, token in list(running.items()):
+                    if stamp(token[1]) <= max_updated:
+                        del running[tokenid]
+                        occupied[token[0]] -= 1
+                for tokenid, token in list(pending.items()):
+                    if stamp(token[1]) <= max_updated:
+                        del pending[tokenid]
+                if len(matches) > 1:
+                    min_created = min( stamp(match[1]) for match in matches )
+                    matches = [ match for match in matches
+                                if stamp(match[1]) == min_created ][:1]
+
+            if not running and not pending:
+                next_id = 0
+
+            records += matches
+            pos += 1
+
+        # finish
+        matches = []
+        for tokenid, token in list(running.items()):
+            state = token[0]
+            if terminal[state]:
+                matches.append((n, token[1], token[2], state))
+            elif token[3] is not None:
+                other = pending.pop(token[3], None)
+                if other is not None:
+                    matches.append((n, other[1], other[2], other[0]))
+        if matches and not allow_overlap:
+            min_created = min( stamp(match[1]) for match in matches )
+            matches = [ match for match in matches
+                        if stamp(match[1]) == min_created ]
+        records += matches
+        return records
@@ -24,6 +24,9 @@ setup(
     #url='TODO',
     platforms='OS Independant',
     install_requires = [],
+    extras_require = {
+        "numpy": ["numpy"],
+    },
     setup_requires = ["pytest-runner"],
     tests_require = ["pytest"],
 )
@@ -0,0 +1,6 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    # require async generators and asyncio.run
+    collect_ignore += [ "test_aio.py", "test_aioserver.py" ]
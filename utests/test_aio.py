@@ -0,0 +1,161 @@
+from fsa4streams import FSA
+from fsa4streams.aio import AsyncFSA
+
+import asyncio
+from time import monotonic
+
+from pytest import raises
+
+from .test_multi import STRUCTURE
+
+
+async def source(items, delay=0, log=None):
+    for item in items:
+        if log is not None:
+            log.append(item)
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+async def collect(matches):
+    return [ match async for match in matches ]
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_iter_feed():
+    events = "abbcab" * 100
+    expected = FSA.from_dict(STRUCTURE).feed_all(events)
+    afsa = AsyncFSA(FSA.from_dict(STRUCTURE), maxsize=10, batch_size=7)
+    assert expected == run(collect(afsa.iter_feed(source(events))))
+    assert not afsa.fsa.is_busy()
+
+def test_iter_feed_timestamps():
+    events = [ (event, 3*i) for i, event in enumerate("abbcabaabbxabbb") ]
+    expected = FSA.from_dict(STRUCTURE).feed_all_timestamps(events)
+    afsa = AsyncFSA(FSA.from_dict(STRUCTURE), batch_size=4)
+    assert expected == run(collect(afsa.iter_feed_timestamps(source(events))))
+
+def test_no_finish():
+    afsa = AsyncFSA(FSA.from_dict(STRUCTURE))
+    assert [] == run(collect(afsa.iter_feed(source("abb"), finish=False)))
+    assert afsa.fsa.is_busy()
+    assert 1 == len(afsa.fsa.finish())
+
+def test_backpressure():
+    log = []
+    afsa = AsyncFSA(FSA.from_dict(STRUCTURE), maxsize=5, batch_size=3)
+    async def consume():
+        read = []
+        async for match in afsa.iter_feed(source("abbx" * 100, log=log)):
+            # give the reader plenty of time to fill the queue
+            await asyncio.sleep(0.001)
+            read.append(len(log))
+        return read
+    read = run(consume())
+    assert 100 == len(read)
+    for i, count in enumerate(read):
+        # match i was produced by event 4*i+3, possibly in a batch of 3;
+        # the queue holds 5 more events, and 1 is waiting to be queued
+        assert count <= 4*i+4 + 2 + 5 + 1
+
+def test_source_error():
+    async def failing():
+        yield "a"
+        yield "b"
+        raise ValueError("broken")
+    afsa = AsyncFSA(FSA.from_dict(STRUCTURE))
+    with raises(ValueError):
+        run(collect(afsa.iter_feed(failing())))
+
+def test_early_stop():
+    afsa = AsyncFSA(FSA.from_dict(STRUCTURE), maxsize=2)
+    async def first():
+        matches = afsa.iter_feed(source("abbxabbx" * 10))
+        async for match in matches:
+            await matches.aclose()
+            return match
+    assert "abb" == "".join(run(first())['history_events'])
+
+def test_clock_expires_tokens():
+    fsa = FSA.from_dict({
+        "states": {
+            "start": {
+                "transitions": [ { "condition": "a", "target": "s1" } ],
+            },
+            "s1": {
+                "terminal": True,
+                "max_duration": 0.05,
+                "transitions": [ { "condition": "b", "target": "s1" } ],
+            },
+        },
+    })
+    afsa = AsyncFSA(fsa, clock=monotonic)
+    log = []
+    async def slow():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.3)
+        log.append("late")
+        yield "c"
+    async def consume():
+        return [ (len(log), "".join(match['history_events']))
+                 async for match in afsa.iter_feed(slow()) ]
+    # the match is produced by the timer, before the last event
+    assert [(0, "ab")] == run(consume())
+
+def test_clock_events_near_deadline():
+    # events arrive when the token they continue expires:
+    # the timer must not advance the clock past an event already read
+    fsa = FSA.from_dict({
+        "states": {
+            "start": {
+                "transitions": [ { "condition": "a", "target": "s1" } ],
+            },
+            "s1": {
+                "max_duration": 0.01,
+                "transitions": [ { "condition": "a", "target": "s1" },
+                                 { "condition": "b", "target": "s2" } ],
+            },
+            "s2": { "terminal": True },
+        },
+    })
+    async def events():
+        for event in "aaaab":
+            await asyncio.sleep(0.01)
+            yield event
+    async def consume():
+        afsa = AsyncFSA(fsa, clock=asyncio.get_running_loop().time)
+        return await collect(afsa.iter_feed(events()))
+    for _ in range(20):
+        for match in run(consume()):
+            assert match['created'] <= match['updated']
+
+def test_clock_at_deadline():
+    # with an integer clock, the timer must wait for the tick
+    # after the deadline, rather than spin while the clock is on it
+    fsa = FSA.from_dict({
+        "states": {
+            "start": {
+                "transitions": [ { "condition": "a", "target": "s1" } ],
+            },
+            "s1": {
+                "terminal": True,
+                "max_duration": 1,
+                "transitions": [ { "condition": "b", "target": "s1" } ],
+            },
+        },
+    })
+    calls = []
+    def clock():
+        calls.append(1)
+        return 1
+    async def events():
+        yield ("a", 0)
+        await asyncio.sleep(0.1)
+        yield ("b", 1)
+    afsa = AsyncFSA(fsa, clock=clock)
+    matches = run(collect(afsa.iter_feed_timestamps(events())))
+    assert ["ab"] == [ "".join(match['history_events']) for match in matches ]
+    assert len(calls) < 10
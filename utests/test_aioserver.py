@@ -0,0 +1,135 @@
+from fsa4streams.aioserver import start_server
+
+import asyncio
+import json
+
+from .test_multi import STRUCTURE
+from .test_server import make_service, ndjson
+
+
+async def read_chunk(reader):
+    size = int((await reader.readline()).strip(), 16)
+    data = await reader.readexactly(size)
+    await reader.readexactly(2)
+    return data
+
+async def read_head(reader):
+    status = (await reader.readline()).decode()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode()
+        if line == '\r\n':
+            return status, headers
+        name, _, value = line.partition(':')
+        headers[name.lower()] = value.strip()
+
+def histories(data):
+    return [ "".join(json.loads(line)['history_events'])
+             for line in data.decode().splitlines() ]
+
+def run(test, connections=1):
+    """Run `test` with the (reader, writer) pairs of `connections`."""
+    async def wrapper():
+        server = await start_server(make_service(writable=True), 'localhost', 0)
+        port = server.sockets[0].getsockname()[1]
+        streams = []
+        for _ in range(connections):
+            streams += await asyncio.open_connection('localhost', port)
+        try:
+            await test(*streams)
+        finally:
+            for writer in streams[1::2]:
+                writer.close()
+            server.close()
+            await server.wait_closed()
+    asyncio.run(wrapper())
+
+
+def test_streaming():
+    async def test(reader, writer):
+        writer.write(b'POST /automata/abb/sessions/s1 HTTP/1.1\r\n'
+                     b'Transfer-Encoding: chunked\r\n\r\n')
+        body = ndjson("abbx")
+        writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+        status, headers = await read_head(reader)
+        assert 'HTTP/1.1 200 OK\r\n' == status
+        assert 'chunked' == headers['transfer-encoding']
+        # the match is received before the end of the request
+        assert ["abb"] == histories(await read_chunk(reader))
+        body = ndjson("ab")
+        writer.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+        assert b'' == await read_chunk(reader)
+
+        # same connection, same session
+        writer.write(b'DELETE /automata/abb/sessions/s1 HTTP/1.1\r\n\r\n')
+        status, headers = await read_head(reader)
+        data = await reader.readexactly(int(headers['content-length']))
+        assert ["ab"] == histories(data)
+    run(test)
+
+def test_session_serialized():
+    async def test(reader1, writer1, reader2, writer2):
+        writer1.write(b'POST /automata/abb/sessions/s1 HTTP/1.1\r\n'
+                      b'Transfer-Encoding: chunked\r\n\r\n')
+        body = ndjson("ab")
+        writer1.write(b'%x\r\n%s\r\n' % (len(body), body))
+        await read_head(reader1)
+        # a concurrent request on the same session waits for the first one
+        body = ndjson("cc")
+        writer2.write(b'POST /automata/abb/sessions/s1 HTTP/1.1\r\n'
+                      b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        try:
+            await asyncio.wait_for(reader2.readline(), .2)
+            assert False, "second request not serialized"
+        except asyncio.TimeoutError:
+            pass
+        body = ndjson("b")
+        writer1.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+        data = b''
+        while True:
+            chunk = await read_chunk(reader1)
+            if not chunk:
+                break
+            data += chunk
+        assert [] == histories(data)
+        status, headers = await read_head(reader2)
+        assert 'HTTP/1.1 200 OK\r\n' == status
+        assert ["abb"] == histories(await read_chunk(reader2))
+    run(test, 2)
+
+def test_feed_with_length():
+    async def test(reader, writer):
+        body = ndjson("abbcab")
+        writer.write(b'POST /automata/abb HTTP/1.1\r\n'
+                     b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        status, headers = await read_head(reader)
+        data = b''
+        while True:
+            chunk = await read_chunk(reader)
+            if not chunk:
+                break
+            data += chunk
+        assert ["abb", "ab"] == histories(data)
+    run(test)
+
+def test_errors():
+    async def test(reader, writer):
+        writer.write(b'GET /automata/nope HTTP/1.1\r\n\r\n')
+        status, headers = await read_head(reader)
+        assert status.startswith('HTTP/1.1 404')
+        assert 'close' == headers['connection']
+    run(test)
+
+def test_register():
+    async def test(reader, writer):
+        body = json.dumps(STRUCTURE).encode()
+        writer.write(b'PUT /automata/other HTTP/1.1\r\n'
+                     b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        status, headers = await read_head(reader)
+        assert 'HTTP/1.1 200 OK\r\n' == status
+        await reader.readexactly(int(headers['content-length']))
+        writer.write(b'GET /automata HTTP/1.1\r\n\r\n')
+        status, headers = await read_head(reader)
+        data = await reader.readexactly(int(headers['content-length']))
+        assert ['abb', 'other'] == json.loads(data)
+    run(test)
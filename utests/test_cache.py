@@ -0,0 +1,144 @@
+from fsa4streams import FSA
+from fsa4streams.cache import StructureCache
+
+from io import StringIO
+import json
+
+from pytest import raises
+
+from .test_multi import STRUCTURE
+
+
+class CachedFSA(FSA):
+    structure_cache = StructureCache(maxsize=4)
+
+def setup_function(_function):
+    CachedFSA.structure_cache = StructureCache(maxsize=4)
+
+
+def test_shared():
+    fsa1 = CachedFSA.from_dict(STRUCTURE)
+    fsa2 = CachedFSA.from_dict(STRUCTURE)
+    assert fsa1._structure is fsa2._structure
+    assert fsa1._compiled is fsa2._compiled
+    assert fsa1._tokens is not fsa2._tokens
+    assert 1 == CachedFSA.structure_cache.hits
+    assert fsa1.feed_all("abbcab") == FSA.from_dict(STRUCTURE).feed_all("abbcab")
+
+def test_canonical():
+    text = json.dumps(STRUCTURE)
+    fsa1 = CachedFSA.from_str(text)
+    fsa2 = CachedFSA.from_str(json.dumps(STRUCTURE, indent=2))
+    fsa3 = CachedFSA.from_file(StringIO(u"%s" % text))
+    fsa4 = CachedFSA.from_dict(json.loads(text))
+    assert fsa1._compiled is fsa2._compiled
+    assert fsa1._compiled is fsa3._compiled
+    assert fsa1._compiled is fsa4._compiled
+
+def test_dict_not_kept():
+    structure = json.loads(json.dumps(STRUCTURE))
+    fsa = CachedFSA.from_dict(structure)
+    structure['states']['s1']['max_noise'] = 5
+    assert 1 == fsa['s1'].max_noise
+    assert 5 == CachedFSA.from_dict(structure)['s1'].max_noise
+    assert 1 == CachedFSA.from_dict(STRUCTURE)['s1'].max_noise
+
+def test_copy_on_write():
+    fsa1 = CachedFSA.from_dict(STRUCTURE)
+    fsa2 = CachedFSA.from_dict(STRUCTURE)
+    state = fsa1['s1']
+    state.max_noise = 3
+    assert 3 == fsa1['s1'].max_noise
+    assert 1 == fsa2['s1'].max_noise
+    assert fsa1._structure is not fsa2._structure
+    assert fsa1._compiled is not fsa2._compiled
+    fsa2['s2'].add_transition("c", "s1")
+    fsa2.add_state("s3", terminal=True)
+    fsa2['start'].transitions.append({ "condition": "d", "target": "s3" })
+    fsa2.allow_overlap = True
+    fsa3 = CachedFSA.from_dict(STRUCTURE)
+    assert STRUCTURE == fsa3.export_structure_as_dict()
+    assert 1 == fsa3['s1'].max_noise
+
+def test_transitions_copy_on_write():
+    fsa1 = CachedFSA.from_dict(STRUCTURE)
+    fsa2 = CachedFSA.from_dict(STRUCTURE)
+    transitions = fsa1['s1'].transitions
+    # reading does not copy the shared structure
+    assert STRUCTURE['states']['s1']['transitions'] == transitions
+    assert "b" == transitions[0]['condition']
+    assert fsa1._structure is fsa2._structure
+    # modifying an item does not change the structure
+    transitions[0]['condition'] = "z"
+    assert fsa1._structure is fsa2._structure
+    assert "b" == transitions[0]['condition']
+    # modifying the list copies the structure and recompiles it
+    compiled = fsa1._compile()
+    transitions[0] = { "condition": "c", "target": "s2" }
+    assert fsa1._structure is not fsa2._structure
+    assert fsa1._compile() is not compiled
+    assert 1 == len(fsa1.feed_all("acc"))
+    assert [] == fsa2.feed_all("acc")
+    fsa2['s1'].transitions = []
+    assert [] == fsa2['s1'].transitions
+    assert STRUCTURE == CachedFSA.from_dict(STRUCTURE) \
+        .export_structure_as_dict()
+
+def test_lru():
+    cache = CachedFSA.structure_cache
+    structures = []
+    for i in range(6):
+        structure = json.loads(json.dumps(STRUCTURE))
+        structure['states']['s1']['max_noise'] = i
+        structures.append(structure)
+        CachedFSA.from_dict(structure)
+    assert 4 == len(cache)
+    assert 6 == cache.misses
+    CachedFSA.from_dict(structures[5])
+    assert 1 == cache.hits
+    # the oldest entries were evicted
+    CachedFSA.from_dict(structures[0])
+    assert 7 == cache.misses
+    cache.clear()
+    assert 0 == len(cache)
+
+def test_str_counts():
+    cache = CachedFSA.structure_cache
+    text = json.dumps(STRUCTURE)
+    CachedFSA.from_str(text)
+    assert (0, 1, 1) == (cache.hits, cache.misses, len(cache))
+    CachedFSA.from_str(text)
+    CachedFSA.from_str(json.dumps(STRUCTURE, indent=2))
+    CachedFSA.from_dict(STRUCTURE)
+    assert (3, 1, 1) == (cache.hits, cache.misses, len(cache))
+    # texts whose structure was evicted are parsed again
+    for i in range(4):
+        structure = json.loads(text)
+        structure['states']['s1']['max_noise'] = i + 2
+        CachedFSA.from_dict(structure)
+    CachedFSA.from_str(text)
+    assert (3, 6, 4) == (cache.hits, cache.misses, len(cache))
+
+def test_invalid_not_cached():
+    structure = { "states": { "start": { "transitions": [] } } }
+    for _ in range(2):
+        with raises(ValueError):
+            CachedFSA.from_dict(structure)
+        with raises(ValueError):
+            CachedFSA.from_str(json.dumps(structure))
+    assert 0 == len(CachedFSA.structure_cache)
+
+def test_not_json():
+    structure = json.loads(json.dumps(STRUCTURE))
+    structure['states']['s1']['transitions'][0]['extra'] = set()
+    fsa = CachedFSA.from_dict(structure)
+    assert fsa['s1'].transitions[0]['extra'] == set()
+    assert 0 == len(CachedFSA.structure_cache)
+
+def test_disabled():
+    class UncachedFSA(FSA):
+        structure_cache = None
+    fsa1 = UncachedFSA.from_dict(STRUCTURE)
+    fsa2 = UncachedFSA.from_str(json.dumps(STRUCTURE))
+    assert fsa1._structure is not fsa2._structure
+    assert not fsa1._shared
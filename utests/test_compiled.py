@@ -0,0 +1,137 @@
+from fsa4streams import FSA
+
+from pytest import raises
+
+
+class TestCompiledStructure(object):
+
+    def setup_method(self, _method):
+        self.fsa = FSA.make_empty(state_defaults={'max_noise': 2})
+        (self.fsa
+         .add_state("s1", max_noise=0)
+           .add_transition("b", "finish")
+         .add_state("start")
+           .add_transition("a", "s1")
+         .add_state("finish", terminal=True)
+         .check_structure()
+        )
+
+    def test_start_first(self):
+        compiled = self.fsa._compile()
+        assert 'start' == compiled.states[0].id
+        assert compiled.start is compiled.states[0]
+
+    def test_index(self):
+        compiled = self.fsa._compile()
+        for i, state in enumerate(compiled.states):
+            assert i == state.index
+            assert i == compiled.index[state.id]
+
+    def test_resolved_defaults(self):
+        compiled = self.fsa._compile()
+        assert 2 == compiled.states[compiled.index['start']].max_noise
+        assert 0 == compiled.states[compiled.index['s1']].max_noise
+        assert compiled.states[compiled.index['finish']].terminal
+        assert compiled.states[compiled.index['finish']].final
+
+    def test_resolved_targets(self):
+        compiled = self.fsa._compile()
+        transition, = compiled.start.transitions
+        assert 's1' == compiled.states[transition.target].id
+
+    def test_cached(self):
+        assert self.fsa._compile() is self.fsa._compile()
+        self.fsa.feed("a")
+        assert self.fsa._compile() is self.fsa._compile()
+
+    def test_add_transition_recompiles(self):
+        before = self.fsa._compile()
+        self.fsa['start'].add_transition("b", "finish")
+        after = self.fsa._compile()
+        assert before is not after
+        assert 2 == len(after.start.transitions)
+        assert ["b"] == self.fsa.feed("b")[0]['history_events']
+
+    def test_add_state_recompiles(self):
+        before = self.fsa._compile()
+        self.fsa.add_state("other", terminal=True)
+        assert before is not self.fsa._compile()
+
+    def test_state_setter_recompiles(self):
+        before = self.fsa._compile()
+        self.fsa['s1'].max_noise = 1
+        after = self.fsa._compile()
+        assert before is not after
+        assert 1 == after.states[after.index['s1']].max_noise
+
+    def test_fsa_setter_recompiles(self):
+        before = self.fsa._compile()
+        self.fsa.allow_overlap = True
+        after = self.fsa._compile()
+        assert before is not after
+        assert after.allow_overlap
+
+    def test_invalid_structure(self):
+        self.fsa['s1'].add_transition("c", "nowhere")
+        with raises(ValueError):
+            self.fsa.check_structure()
+        with raises(ValueError):
+            self.fsa.feed("a")
+
+
+class TestDispatch(object):
+
+    def setup_method(self, _method):
+        self.fsa = FSA.make_empty(allow_overlap=True)
+        (self.fsa
+         .add_state("start")
+           .add_transition("[ab]", "s1", matcher="regexp")
+           .add_transition("a", "s2")
+           .add_transition(["a", "c"], "s3", matcher="multiple-choices")
+           .add_transition("abc", "s4", matcher="multiple-choices")
+         .add_state("s1", terminal=True)
+         .add_state("s2", terminal=True)
+         .add_state("s3", terminal=True)
+         .add_state("s4", terminal=True)
+         .check_structure()
+        )
+        self.start = self.fsa._compile().start
+
+    def targets(self, event):
+        states = self.fsa._compile().states
+        return [ states[t.target].id
+                 for t in self.start.matching_transitions(event, None,
+                                                          self.fsa) ]
+
+    def test_indexed(self):
+        assert {"a", "c"} == set(self.start.dispatch)
+        assert 2 == len(self.start.scanned)
+
+    def test_order_preserved(self):
+        assert ["s1", "s2", "s3", "s4"] == self.targets("a")
+        assert ["s1", "s4"] == self.targets("b")
+        assert ["s3", "s4"] == self.targets("c")
+
+    def test_no_match(self):
+        assert [] == self.targets("z")
+
+    def test_substring_condition(self):
+        assert ["s4"] == self.targets("bc")
+
+    def test_unhashable(self):
+        fsa = FSA.make_empty()
+        (fsa
+         .add_state("start")
+           .add_transition("a", "s1")
+           .add_transition({"x": 1}, "s1")
+         .add_state("s1", terminal=True)
+         .check_structure()
+        )
+        start = fsa._compile().start
+        assert 1 == len(start.scanned)
+        assert 1 == len(start.matching_transitions({"x": 1}, None, fsa))
+        assert 1 == len(start.matching_transitions("a", None, fsa))
+
+    def test_feed(self):
+        matches = self.fsa.feed("a")
+        assert {"s1", "s2", "s3", "s4"} == set(m['state'] for m in matches)
@@ -0,0 +1,195 @@
+from fsa4streams import FSA
+
+from random import Random
+
+from pytest import mark
+
+def make_fsa(**kw):
+    fsa = FSA.make_empty(**kw)
+    (fsa
+     .add_state("start")
+       .add_transition("a", "s1")
+     .add_state("s1")
+       .add_transition("b", "finish")
+     .add_state("finish", terminal=True)
+       .add_transition("b", "finish")
+     .check_structure()
+    )
+    return fsa
+
+
+def test_eligible():
+    assert [] == make_fsa().check_dfa()
+
+def test_multiple_choices_eligible():
+    fsa = make_fsa()
+    fsa['s1'].add_transition(["c", "d"], "finish", matcher="multiple-choices")
+    assert [] == fsa.check_dfa()
+
+@mark.parametrize("change, problem", [
+    (lambda fsa: setattr(fsa['s1'], 'max_noise', 1),
+     "State 's1' has max_noise > 0"),
+    (lambda fsa: setattr(fsa['finish'], 'max_duration', 3),
+     "State 'finish' has a duration constraint"),
+    (lambda fsa: setattr(fsa['finish'], 'max_total_duration', 3),
+     "State 'finish' has a duration constraint"),
+    (lambda fsa: fsa['s1'].set_default_transition("start"),
+     "State 's1' has a default transition"),
+    (lambda fsa: fsa['s1'].add_transition("c", "finish", silent=True),
+     "Transition from 's1' to 'finish' is silent"),
+    (lambda fsa: fsa['s1'].add_transition("c.*", "finish", matcher="regexp"),
+     "Transition from 's1' to 'finish' can not be indexed (matcher 'regexp')"),
+    (lambda fsa: fsa['s1'].add_transition("b", "s1"),
+     "Event 'b' leads from state 's1' to several states ('finish', 's1')"),
+])
+def test_not_eligible(change, problem):
+    fsa = make_fsa()
+    change(fsa)
+    assert [problem] == fsa.check_dfa()
+
+@mark.parametrize("attribute", ['max_duration', 'max_total_duration'])
+def test_zero_duration_not_eligible(attribute):
+    # the token engine checks max_total_duration when entering a state,
+    # even if it is 0
+    structure = make_fsa().export_structure_as_dict()
+    structure['states']['finish'][attribute] = 0
+    fsa = FSA.from_dict(structure)
+    assert ["State 'finish' has a duration constraint"] == fsa.check_dfa()
+    expected = FSA.from_dict(structure)
+    expected.use_dfa = False
+    events = [("a", 0), ("b", 1)]
+    assert expected.feed_all_timestamps(events) \
+        == fsa.feed_all_timestamps(events)
+
+def test_unreachable_state_ignored():
+    fsa = make_fsa()
+    (fsa.add_state("orphan", max_noise=3)
+         .add_transition("x.*", "finish", matcher="regexp"))
+    assert [] == fsa.check_dfa()
+
+def test_busy_fsa_uses_tokens():
+    fsa = make_fsa()
+    fsa.feed("a")
+    run = fsa._run(fsa._tokens, "b")
+    assert "_run_tokens" == run.__name__
+    run = fsa._run(fsa._tokens, "b", False, True)
+    assert "_run_tokens" == run.__name__
+
+def test_eager_only():
+    fsa = make_fsa()
+    assert "run" == fsa._run(fsa._tokens, "ab", False, True).__name__
+    assert "_run_tokens" == fsa._run(fsa._tokens, "ab").__name__
+
+def test_suspended_iter_feed():
+    # the tokens must be up to date while iter_feed is suspended
+    fsa = FSA.make_empty(allow_overlap=True)
+    (fsa
+     .add_state("start")
+       .add_transition("a", "end")
+       .add_transition("x", "t")
+     .add_state("t")
+       .add_transition("a", "u")
+     .add_state("u")
+       .add_transition("y", "end")
+     .add_state("end", terminal=True)
+     .check_structure()
+    )
+    assert [] == fsa.check_dfa()
+    it = fsa.iter_feed(iter("xaz"), finish=False)
+    assert ["a"] == next(it)['history_events']
+    assert fsa.is_busy()
+    tokens = fsa.export_tokens_as_dict()
+    assert 1 == tokens['clock']
+    assert ["u"] == [ token['state'] for token in tokens['running'].values() ]
+    assert [["x", "a", "y"]] == [ match['history_events']
+                                  for match in fsa.feed("y") ]
+    assert [] == list(it)
+
+
+def random_structure(rnd):
+    alphabet = "abcd"
+    stateids = [ "start" ] + [ "s%d" % i for i in range(rnd.randint(1, 5)) ]
+    states = {}
+    for stateid in stateids:
+        events = rnd.sample(alphabet, rnd.randint(0, len(alphabet)))
+        transitions = []
+        while events:
+            target = rnd.choice(stateids[1:] + [ "start" ] * (rnd.random() < .1))
+            if len(events) > 1 and rnd.random() < .3:
+                transitions.append({ "condition": events[:2], "target": target,
+                                     "matcher": "multiple-choices" })
+                events = events[2:]
+            else:
+                transitions.append({ "condition": events.pop(),
+                                     "target": target })
+        terminal = rnd.random() < .4 or not transitions
+        states[stateid] = { "transitions": transitions, "terminal": terminal }
+    if not states["start"]["transitions"]:
+        states["start"]["transitions"].append({ "condition": "a",
+                                                "target": stateids[1] })
+        states["start"]["terminal"] = False
+    if not any(state["terminal"] for state in states.values()):
+        states[stateids[-1]]["terminal"] = True
+    return { "states": states, "allow_overlap": rnd.random() < .5 }
+
+def random_events(rnd):
+    events = []
+    for _ in range(rnd.randint(0, 40)):
+        if rnd.random() < .05:
+            events.append([ "a" ]) # unhashable
+        else:
+            events.append(rnd.choice("abcdz"))
+    return events
+
+def run(structure, events, cut, timestamps, use_dfa):
+    fsa = FSA.from_dict(structure)
+    fsa.use_dfa = use_dfa
+    if timestamps is None:
+        ret = fsa.feed_batch(events[:cut])
+    else:
+        ret = fsa.feed_batch(events[:cut], timestamps[:cut])
+    saved = fsa.export_tokens_as_dict()
+    if timestamps is None:
+        ret += fsa.feed_batch(events[cut:])
+    else:
+        ret += fsa.feed_batch(events[cut:], timestamps[cut:])
+    ret += [ (None, match) for match in fsa.finish() ]
+    return ret, saved
+
+def test_same_as_tokens():
+    rnd = Random(42)
+    for _ in range(500):
+        structure = random_structure(rnd)
+        if FSA.from_dict(structure).check_dfa():
+            continue
+        events = random_events(rnd)
+        cut = rnd.randint(0, len(events))
+        timestamps = None
+        if rnd.random() < .3:
+            timestamps = []
+            timestamp = 0
+            for _ in events:
+                timestamp += rnd.randint(0, 2)
+                timestamps.append(timestamp)
+        expected = run(structure, events, cut, timestamps, False)
+        assert expected == run(structure, events, cut, timestamps, True), \
+            (structure, events, cut, timestamps)
+
+def test_long_stream():
+    fsa = make_fsa()
+    events = "abbbxab" * 1000
+    expected = fsa.feed_all(events)
+    fsa.use_dfa = False
+    assert expected == fsa.feed_all(events)
+    assert 2000 == len(expected)
+
+def test_early_stop():
+    fsa = make_fsa()
+    it = fsa.iter_feed("abxabbab", finish=False)
+    assert ["a", "b"] == next(it)['history_events']
+    it.close()
+    assert not fsa.is_busy()
+    assert 2 == fsa._tokens.clock
+    fsa.feed_all("ab", finish=False)
+    assert fsa.is_busy()
+    assert 4 == fsa._tokens.clock
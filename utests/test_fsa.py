@@ -698,3 +698,143 @@ def test_equal_timestamp():
      .check_structure()
     )
     assert_matches(fsa, "ab", ["ab"], True, [42, 42])
+
+
+class TestFeedBatch:
+    fsa = FSA.make_empty(allow_overlap=True)
+    (fsa
+     .add_state("start")
+       .add_transition("a", "finish")
+     .add_state("finish", terminal=True)
+       .add_transition("b", "finish")
+     .check_structure()
+    )
+
+    def setup_method(self, _method):
+        self.fsa.reset()
+
+    def test_indexes(self):
+        got = self.fsa.feed_batch("abbcab")
+        assert [3] == [ i for i, _ in got ]
+        assert ["abb"] == [ "".join(match['history_events'])
+                            for _, match in got ]
+        assert self.fsa.is_busy()
+
+    def test_same_as_feed(self):
+        def summary(i, match):
+            return (i, match['created'], match['updated'],
+                    match['history_events'], match['history_states'])
+        expected = []
+        for i, event in enumerate("abcaabbc"):
+            expected += [ summary(i, match) for match in self.fsa.feed(event) ]
+        self.fsa.reset()
+        got = [ summary(i, match)
+                for i, match in self.fsa.feed_batch("abcaabbc") ]
+        assert expected
+        assert expected == got
+
+    def test_consecutive_batches(self):
+        first = self.fsa.feed_batch("ab")
+        second = self.fsa.feed_batch(iter("bcab"))
+        assert [] == first
+        assert [(1, 'abb')] == [ (i, "".join(match['history_events']))
+                                 for i, match in second ]
+        assert 0 == second[0][1]['created']
+        assert 5 == self.fsa._tokens.clock
+
+    def test_timestamps(self):
+        got = self.fsa.feed_batch("abc", [10, 20, 20])
+        assert 1 == len(got)
+        assert 2 == got[0][0]
+        assert 10 == got[0][1]['created']
+        assert 20 == got[0][1]['updated']
+
+
+class TestIterFeed:
+    fsa = TestFeedBatch.fsa
+
+    def setup_method(self, _method):
+        self.fsa.reset()
+
+    def test_lazy(self):
+        consumed = []
+        def events():
+            for event in "abcab":
+                consumed.append(event)
+                yield event
+        it = self.fsa.iter_feed(events())
+        first = next(it)
+        assert "ab" == "".join(first['history_events'])
+        assert "abc" == "".join(consumed)
+        last = list(it)
+        assert ["ab"] == [ "".join(match['history_events']) for match in last ]
+        assert not self.fsa.is_busy()
+
+    def test_unbounded(self):
+        from itertools import cycle, islice
+        matches = list(islice(self.fsa.iter_feed(cycle("abbc")), 3))
+        assert ["abb"] * 3 == [ "".join(match['history_events'])
+                                for match in matches ]
+        assert 11 == self.fsa._tokens.clock
+
+    def test_same_as_feed_all(self):
+        expected = self.fsa.feed_all("abcaabbcab")
+        assert expected == list(self.fsa.iter_feed("abcaabbcab"))
+
+    def test_no_finish(self):
+        assert [] == list(self.fsa.iter_feed("ab", finish=False))
+        assert self.fsa.is_busy()
+
+    def test_timestamps(self):
+        it = self.fsa.iter_feed_timestamps(zip("abcab", [1, 3, 3, 7, 8]))
+        assert [(1, 3), (7, 8)] == [ (match['created'], match['updated'])
+                                     for match in it ]
+
+
+class TestAdvanceClock:
+
+    def setup_method(self, _method):
+        self.fsa = fsa = FSA.make_empty()
+        (fsa
+         .add_state("start")
+           .add_transition("a", "s1")
+         .add_state("s1", max_duration=5)
+           .add_transition("b", "finish")
+         .add_state("finish", terminal=True, max_duration=2)
+           .add_transition("b", "finish")
+         .check_structure()
+        )
+
+    def test_match(self):
+        assert [] == self.fsa.feed("a", 0)
+        assert [] == self.fsa.feed("b", 1)
+        assert [] == self.fsa.advance_clock(3)
+        assert self.fsa.is_busy()
+        matches = self.fsa.advance_clock(4)
+        assert ["ab"] == [ "".join(match['history_events'])
+                           for match in matches ]
+        assert not self.fsa.is_busy()
+
+    def test_drop(self):
+        self.fsa.feed("a", 0)
+        assert [] == self.fsa.advance_clock(6)
+        assert not self.fsa.is_busy()
+
+    def test_clock(self):
+        assert [] == self.fsa.advance_clock(10)
+        self.fsa.feed("a")
+        assert 11 == self.fsa._tokens.clock
+        assert [] == self.fsa.advance_clock(15)
+        assert [] == self.fsa.advance_clock(16)
+        assert self.fsa.is_busy()
+        assert [] == self.fsa.advance_clock(17)
+        assert not self.fsa.is_busy()
+
+    def test_same_as_next_event(self):
+        self.fsa.feed_all_timestamps([("a", 0), ("b", 1)], finish=False)
+        expected = self.fsa.feed("a", 10)
+        self.fsa.reset()
+        self.fsa.feed_all_timestamps([("a", 0), ("b", 1)], finish=False)
+        assert expected == self.fsa.advance_clock(10)
+        assert [] == self.fsa.feed("a", 10)
+        assert self.fsa.is_busy()
@@ -0,0 +1,211 @@
+from fsa4streams import FSA
+from fsa4streams.history import EMPTY, History, retention
+
+from copy import deepcopy
+import random
+
+from pytest import raises
+
+
+def test_empty():
+    assert 0 == len(EMPTY)
+    assert [] == EMPTY.to_list()
+    assert 'a' not in EMPTY
+
+def test_push():
+    h1 = EMPTY.push('a')
+    h2 = h1.push('b')
+    assert ['a'] == h1.to_list()
+    assert ['a', 'b'] == h2.to_list()
+    assert 2 == len(h2)
+    assert h2.parent is h1
+
+def test_to_list_limit():
+    history = History.from_list('abcd')
+    assert ['c', 'd'] == history.to_list(2)
+    assert ['a', 'b', 'c', 'd'] == history.to_list(10)
+    assert [] == EMPTY.to_list(3)
+
+def test_from_list():
+    assert ['a', 'b', 'c'] == History.from_list('abc').to_list()
+
+def test_contains():
+    history = History.from_list('abc')
+    assert 'a' in history
+    assert 'c' in history
+    assert 'd' not in history
+
+def test_tail():
+    base = History.from_list('ab')
+    history = base.push('c').push('d')
+    assert ['c', 'd'] == history.tail(base)
+    assert [] == base.tail(base)
+    assert ['a', 'b'] == base.tail(EMPTY)
+    assert history.tail(History.from_list('ab')) is None
+    assert base.tail(history) is None
+
+def test_equal():
+    h1 = History.from_list('abc')
+    h2 = History.from_list('abc')
+    assert h1 == h2
+    assert not h1 != h2
+    assert h1.push('d') == h2.push('d')
+    assert h1 != h2.push('d')
+    assert h1 != History.from_list('abd')
+    assert h1 != History.from_list('xbc')
+
+def test_shared_prefix():
+    base = History.from_list('ab')
+    h1 = base.push('c')
+    h2 = base.push('c')
+    assert h1 == h2
+    assert h1.push('d') != h2.push('e')
+
+def test_forks_share_history():
+    fsa = FSA.make_empty()
+    (fsa
+     .add_state("start")
+       .add_transition("a", "s1")
+     .add_state("s1")
+       .add_transition("b", "s2")
+       .add_transition("b", "s3")
+     .add_state("s2")
+       .add_transition("c", "finish")
+     .add_state("s3")
+       .add_transition("d", "finish")
+     .add_state("finish", terminal=True)
+     .check_structure()
+    )
+    fsa.feed_all("ab", False)
+    token1, token2 = fsa._tokens.running.values()
+    assert token1.history_events is token2.history_events
+    assert token1.history_states is token2.history_states
+
+def test_hash():
+    h1 = History.from_list('abc')
+    h2 = EMPTY.push('a').push('b').push('c')
+    assert hash(h1) == hash(h2)
+    assert 1 == len(set([h1, h2]))
+    assert 2 == len(set([h1, h2.push('d')]))
+
+def test_hash_unhashable_items():
+    h1 = History.from_list([{'a': 1}, 'b'])
+    h2 = History.from_list([{'a': 1}, 'b'])
+    assert h1 == h2
+    assert hash(h1) == hash(h2)
+
+
+# history retention
+
+RETENTION = {
+    "states": {
+        "start": { "transitions": [ { "condition": "a", "target": "s1" } ] },
+        "s1": {
+            "max_duration": 30,
+            "transitions": [ { "condition": "b", "target": "s2" } ],
+            "default_transition": { "target": "s1" },
+        },
+        "s2": {
+            "terminal": True,
+            "transitions": [
+                { "condition": "b", "target": "s2" },
+                { "condition": "c", "target": "s3" },
+            ],
+        },
+        "s3": { "terminal": True },
+    },
+}
+
+def with_history(spec, allow_overlap=False):
+    structure = deepcopy(RETENTION)
+    structure['history'] = spec
+    structure['allow_overlap'] = allow_overlap
+    return structure
+
+def test_retention_specs():
+    assert retention(None) is None
+    assert retention("full") is None
+    assert 3 == retention({ "last": 3 }).limit
+    assert retention({ "first": 3 }).limit is None
+    for spec in ("some", { "last": 0 }, { "last": True }, { "last": "3" },
+                 { "first": 1, "last": 2 }, { "middle": 2 }, ["last", 2]):
+        with raises(ValueError):
+            retention(spec)
+        with raises(ValueError):
+            FSA.from_dict(with_history(spec))
+
+def test_retention_checked():
+    base = with_history("none")
+    FSA.from_dict(base)
+    noisy = deepcopy(base)
+    noisy['states']['s2']['max_noise'] = 1
+    silent = deepcopy(base)
+    silent['states']['s2']['transitions'][1]['silent'] = True
+    forked = deepcopy(base)
+    forked['states']['s2']['transitions'][1]['condition'] = "b"
+    started = deepcopy(base)
+    started['states']['start']['transitions'].append(
+        { "condition": "a", "target": "s2" })
+    scanned = deepcopy(base)
+    scanned['states']['s2']['transitions'][1]['matcher'] = "regexp"
+    for structure in (noisy, silent, forked, started, scanned):
+        with raises(ValueError):
+            FSA.from_dict(structure)
+        del structure['history']
+        FSA.from_dict(structure)
+
+def test_retention_same_matches():
+    rng = random.Random(42)
+    for allow_overlap in (False, True):
+        events = [ rng.choice("aabbcxy") for _ in range(3000) ]
+        full = FSA.from_dict(with_history("full", allow_overlap)) \
+            .feed_all(events)
+        assert len(full) > 50
+        assert any( len(match['history_events']) > 6 for match in full )
+        for spec in ("timestamps", { "first": 3 }, { "last": 3 }, "none"):
+            matches = FSA.from_dict(with_history(spec, allow_overlap)) \
+                .feed_all(events)
+            assert len(full) == len(matches)
+            for expected, match in zip(full, matches):
+                kept_events, kept_states = expected['history_events'], \
+                    expected['history_states']
+                if spec == "timestamps":
+                    kept_events = list(range(match['created'],
+                                             match['updated'] + 1))
+                elif spec == "none":
+                    kept_events, kept_states = [], []
+                elif "first" in spec:
+                    kept_events, kept_states = kept_events[:3], kept_states[:3]
+                else:
+                    kept_events, kept_states = kept_events[-3:], kept_states[-3:]
+                expected = dict(expected, history_events=kept_events,
+                                history_states=kept_states)
+                assert expected == match
+
+def test_retention_bounded():
+    fsa = FSA.from_dict(with_history({ "last": 4 }))
+    fsa.feed_all("a" + "x" * 25, False)
+    token, = fsa._tokens.running.values()
+    assert len(token.history_events) < 8
+    assert ["x"] * 4 == fsa.export_tokens_as_dict()['running']['0'] \
+        ['history_events']
+    fsa.feed_all("x" * 4 + "bc")
+    fsa = FSA.from_dict(with_history("none"))
+    fsa.feed_all("a" + "x" * 25, False)
+    token, = fsa._tokens.running.values()
+    assert token.history_events is EMPTY
+    assert token.history_states is EMPTY
+
+def test_retention_tokens_reloaded():
+    events = "axxxbbxaxxbbbc"
+    expected = FSA.from_dict(with_history({ "last": 2 })).feed_all(events)
+    fsa = FSA.from_dict(with_history({ "last": 2 }))
+    matches = fsa.feed_all(events[:6], False)
+    tokens = fsa.export_tokens_as_string()
+    fsa = FSA.from_dict(with_history({ "last": 2 }))
+    fsa.load_tokens_from_str(tokens)
+    assert expected == matches + fsa.feed_all(events[6:])
+
+def test_retention_no_dfa():
+    fsa = FSA.from_dict(with_history("timestamps"))
+    assert fsa._compile().dfa().problems
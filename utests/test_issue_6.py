@@ -1,5 +1,5 @@
 from fsa4streams.fsa import FSA
-from test_fsa import assert_matches
+from .test_fsa import assert_matches
 from unittest import skip
 
 @skip('not fixed yet')
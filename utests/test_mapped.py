@@ -0,0 +1,149 @@
+from fsa4streams import FSA, MultiStreamFSA
+from fsa4streams.mapped import MappedStructure
+
+import json
+import random
+
+from pytest import raises
+
+from .test_multi import STRUCTURE
+
+
+BIG = {
+    "state_defaults": { "max_noise": 1 },
+    "states": {
+        "start": {
+            "transitions": [
+                { "condition": "s%d" % i, "target": "s%d" % i }
+                for i in range(50)
+            ] + [ { "condition": "x", "target": u"\xe9t\xe9" } ],
+        },
+        u"\xe9t\xe9": { "terminal": True, "max_duration": 3 },
+        "end": { "terminal": True },
+    },
+}
+for i in range(50):
+    j = (i * 7 + 3) % 50
+    BIG["states"]["s%d" % i] = {
+        "transitions": [
+            { "condition": "s%d" % j, "target": "s%d" % j },
+            { "condition": ["e", "s%d" % i], "matcher": "multiple-choices",
+              "target": "end" },
+        ],
+    }
+
+
+def export(structure, tmpdir):
+    path = str(tmpdir.join("structure.fsac"))
+    FSA.from_dict(structure).export_compiled(path)
+    return path
+
+
+def test_same_matches(tmpdir):
+    path = export(BIG, tmpdir)
+    rand = random.Random(3)
+    events = [ rand.choice(["s%d" % i for i in range(50)] + ["e", "x", "y"])
+               for _ in range(500) ]
+    reference = FSA.from_dict(BIG)
+    reference.use_dfa = False
+    fsa = FSA.open_compiled(path)
+    fsa.use_dfa = False
+    assert reference.feed_all(events) == fsa.feed_all(events)
+    # with the DFA fast path
+    assert reference.feed_all(events) == FSA.open_compiled(path).feed_all(events)
+
+def test_history(tmpdir):
+    structure = json.loads(json.dumps(STRUCTURE))
+    structure['history'] = { "last": 1 }
+    for state in structure['states'].values():
+        state['max_noise'] = 0
+    path = export(structure, tmpdir)
+    events = "abbbcab"
+    fsa = FSA.open_compiled(path)
+    matches = fsa.feed_all(events)
+    assert matches
+    assert all( 1 == len(match['history_events']) for match in matches )
+    assert FSA.from_dict(structure).feed_all(events) == matches
+
+def test_lazy_states(tmpdir):
+    path = export(BIG, tmpdir)
+    fsa = FSA.open_compiled(path)
+    compiled = fsa._compiled
+    assert isinstance(compiled, MappedStructure)
+    assert len(BIG['states']) == len(compiled.states)
+    fsa.feed("s3")
+    loaded = [ state for state in compiled.states if _is_loaded(state) ]
+    assert 2 <= len(loaded) < 10
+    assert fsa._structure_data is None
+
+def test_lazy_states_dfa(tmpdir):
+    structure = json.loads(json.dumps(STRUCTURE))
+    for state in structure['states'].values():
+        state.pop('max_noise', None)
+        state.pop('max_duration', None)
+    for i in range(200):
+        structure['states']['orphan%d' % i] = { "terminal": True }
+    path = export(structure, tmpdir)
+    fsa = FSA.open_compiled(path)
+    compiled = fsa._compiled
+    assert [] == fsa.check_dfa()
+    assert FSA.from_dict(structure).feed_all("abbab") == fsa.feed_all("abbab")
+    loaded = [ state.id for state in compiled.states if _is_loaded(state) ]
+    assert ['s1', 's2', 'start'] == sorted(loaded)
+
+def _is_loaded(state):
+    # without triggering the loading
+    try:
+        object.__getattribute__(state, 'terminal')
+    except AttributeError:
+        return False
+    return True
+
+def test_index(tmpdir):
+    path = export(BIG, tmpdir)
+    compiled = MappedStructure(path)
+    reference = FSA.from_dict(BIG)._compile()
+    for stateid, index in reference.index.items():
+        assert index == compiled.index[stateid]
+        assert stateid == compiled.states[index].id
+    assert None is compiled.index.get("nowhere")
+    assert "nowhere" not in compiled.index
+    assert sorted(reference.index) == sorted(compiled.index)
+
+def test_structure(tmpdir):
+    path = export(BIG, tmpdir)
+    fsa = FSA.open_compiled(path)
+    assert json.loads(json.dumps(BIG)) == fsa.export_structure_as_dict()
+    # the structure can be modified as usual
+    fsa["end"].max_noise = 2
+    assert not isinstance(fsa._compile(), MappedStructure)
+    assert 2 == fsa._compile().states[fsa._compile().index["end"]].max_noise
+
+def test_verify(tmpdir):
+    path = export(STRUCTURE, tmpdir)
+    FSA.open_compiled(path, STRUCTURE)
+    other = json.loads(json.dumps(STRUCTURE))
+    other['states']['s1']['max_noise'] = 2
+    with raises(ValueError):
+        FSA.open_compiled(path, other)
+
+def test_invalid(tmpdir):
+    fsa = FSA.make_empty()
+    fsa.add_state("start")
+    with raises(ValueError):
+        fsa.export_compiled(str(tmpdir.join("invalid.fsac")))
+    path = tmpdir.join("not.fsac")
+    path.write("{}" * 20)
+    with raises(ValueError):
+        FSA.open_compiled(str(path))
+
+def test_tokens(tmpdir):
+    path = export(STRUCTURE, tmpdir)
+    reference = FSA.from_dict(STRUCTURE)
+    reference.feed_all("abbab", False)
+    fsa = FSA.open_compiled(path)
+    fsa.load_tokens_from_dict(reference.export_tokens_as_dict())
+    assert reference.export_tokens_as_dict() == fsa.export_tokens_as_dict()
+    assert reference.feed_all("bcab") == fsa.feed_all("bcab")
+    multi = MultiStreamFSA(FSA.open_compiled(path))
+    assert reference.feed_all("abbab") == multi.feed_all("k", "abbab")
@@ -1,8 +1,9 @@
 from fsa4streams.fsa import FSA, LOG
+from fsa4streams.matcher import DIRECTORY
 
 from .test_fsa import assert_matches
 
-from pytest import mark
+from pytest import mark, raises
 
 @mark.parametrize("string, matches", [
     ("a",    []),
@@ -51,3 +52,89 @@ def test_regexp_matcher(string, matches):
      .check_structure()
     )
     assert_matches(fsa, string, matches)
+
+@mark.parametrize("string, matches", [
+    ("ab",   ['ab']),
+    ("b",    []),
+    ("c",    []),
+    ("cd",   ['cd']),
+    ("abcd", ['ab', 'cd']),
+])
+def test_regexp_matcher_whole_event(string, matches):
+    # the alternation must not escape the implicit anchoring
+    fsa = FSA.make_empty()
+    (fsa
+     .add_state("start")
+       .add_transition("a|c", "s1", matcher="regexp")
+     .add_state("s1")
+       .add_transition("b|d", "finish", matcher="regexp")
+     .add_state("finish", terminal=True)
+     .check_structure()
+    )
+    assert_matches(fsa, string, matches)
+
+def test_regexp_matcher_trailing_newline():
+    fsa = FSA.make_empty()
+    (fsa
+     .add_state("start")
+       .add_transition("a", "finish", matcher="regexp")
+     .add_state("finish", terminal=True)
+     .check_structure()
+    )
+    assert_matches(fsa, ["a\n"], [])
+
+def test_regexp_matcher_shared():
+    fsa = FSA.make_empty(default_matcher="regexp")
+    (fsa
+     .add_state("start")
+       .add_transition("[ab]", "s1")
+       .add_transition("[ab]", "s2")
+     .add_state("s1", terminal=True)
+     .add_state("s2", terminal=True)
+     .check_structure()
+    )
+    first, second = fsa._compile().start.transitions
+    assert first.matcher is second.matcher
+
+@mark.parametrize("condition", [ "(a", "a)", "*", 42 ])
+def test_regexp_matcher_invalid(condition):
+    fsa = FSA.make_empty()
+    (fsa
+     .add_state("start")
+       .add_transition(condition, "finish", matcher="regexp")
+     .add_state("finish", terminal=True)
+    )
+    with raises(ValueError):
+        fsa.check_structure()
+
+def test_regexp_default_matcher_default_transition():
+    fsa = FSA.make_empty(default_matcher="regexp")
+    (fsa
+     .add_state("start")
+       .add_transition("a", "s1")
+     .add_state("s1", default_transition={'target': 'finish'})
+       .add_transition("b", "finish")
+     .add_state("finish", terminal=True)
+     .check_structure()
+    )
+    assert_matches(fsa, "ac", ["ac"])
+
+def test_custom_matcher_token_history():
+    # custom matchers written when tokens were plain dicts
+    def match_repeat(transition, event, token, _fsa):
+        return event == token['history_events'][-1]
+    DIRECTORY['repeat'] = match_repeat
+    try:
+        fsa = FSA.make_empty()
+        (fsa
+         .add_state("start")
+           .add_transition("a", "s1")
+         .add_state("s1")
+           .add_transition(None, "finish", matcher="repeat")
+         .add_state("finish", terminal=True)
+         .check_structure()
+        )
+        assert_matches(fsa, "aa", ["aa"])
+        assert_matches(fsa, "ab", [])
+    finally:
+        del DIRECTORY['repeat']
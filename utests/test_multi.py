@@ -0,0 +1,154 @@
+from fsa4streams import FSA, MultiStreamFSA
+
+from pytest import raises
+
+STRUCTURE = {
+    "states": {
+        "start": {
+            "transitions": [
+                { "condition": "a", "target": "s1" },
+            ],
+        },
+        "s1": {
+            "max_noise": 1,
+            "max_duration": 5,
+            "transitions": [
+                { "condition": "b", "target": "s2" },
+            ],
+        },
+        "s2": {
+            "terminal": True,
+            "transitions": [
+                { "condition": "b", "target": "s2" },
+            ],
+        },
+    },
+}
+
+STREAMS = {
+    'alice': "abbcab",
+    'bob':   "aabcbbb",
+    'carol': "xaxbb",
+}
+
+
+def histories(matches):
+    return [ "".join(match['history_events']) for match in matches ]
+
+
+def test_independent_streams():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    got = dict( (key, []) for key in STREAMS )
+    for i in range(max(len(events) for events in STREAMS.values())):
+        for key, events in sorted(STREAMS.items()):
+            if i < len(events):
+                got[key] += multi.feed(key, events[i])
+    for key, matches in multi.finish_all().items():
+        got[key] += matches
+    for key, events in STREAMS.items():
+        expected = FSA.from_dict(STRUCTURE).feed_all(events)
+        assert histories(expected) == histories(got[key])
+    assert 0 == len(multi)
+
+
+def test_feed_all():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    for key, events in STREAMS.items():
+        expected = FSA.from_dict(STRUCTURE).feed_all(events)
+        assert expected == multi.feed_all(key, events)
+        assert key not in multi
+
+
+def test_idle_stream_keeps_clock():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.feed('alice', 'x', 42)
+    assert not multi.is_busy('alice')
+    assert 42 == multi.clock('alice')
+    assert (42, 1) == multi._streams['alice']
+    multi.feed('alice', 'a')
+    assert multi.is_busy('alice')
+    matches = multi.feed('alice', 'b')
+    assert [] == matches
+    matches = multi.finish('alice')
+    assert 43 == matches[0]['created']
+    assert 44 == matches[0]['updated']
+    assert (1, 2) == (matches[0].start, matches[0].end)
+
+
+def test_evict():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.feed_all_timestamps('alice', zip("ab", [1, 2]), False)
+    multi.feed_all_timestamps('bob', zip("ab", [5, 6]), False)
+    multi.feed_all_timestamps('carol', zip("xx", [1, 2]), False)
+    evicted = multi.evict(5)
+    assert ['alice'] == list(evicted)
+    assert ['ab'] == histories(evicted['alice'])
+    assert ['bob'] == multi.keys()
+
+
+def test_export_load_tokens():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.feed_all('alice', "ab", False)
+    saved = multi.export_tokens_as_string('alice')
+    multi.reset('alice')
+    assert 'alice' not in multi
+    multi.load_tokens_from_str('bob', saved)
+    with raises(ValueError):
+        multi.load_tokens_from_str('bob', saved)
+    assert ['abb'] == histories(multi.feed_all('bob', "b"))
+
+
+def test_structure_change():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.feed('alice', 'a')
+    multi.fsa['s1'].add_transition("c", "s2")
+    assert ['acb'] == histories(multi.feed_all('alice', "cb"))
+
+
+def test_iter_feed():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    it = multi.iter_feed('alice', "abbcab", finish=False)
+    assert ['abb'] == histories([next(it)])
+    assert [] == list(it)
+    assert multi.is_busy('alice')
+    assert ['ab'] == histories(multi.iter_feed('alice', ""))
+    assert 'alice' not in multi
+
+
+
+def test_iter_feed_suspended():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    it = multi.iter_feed('alice', "abcb", finish=False)
+    assert ['ab'] == histories([next(it)])
+    # a concurrent feed uses the same tokens as the suspended generator,
+    # and its effect is visible
+    assert [] == multi.feed('alice', 'a')
+    assert multi.is_busy('alice')
+    assert multi.export_tokens_as_dict('alice')['running']
+    assert [] == list(it)
+    assert ['ab'] == histories(multi.finish('alice'))
+
+
+def test_iter_feed_evicted():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    it = multi.iter_feed_timestamps('alice', zip("abcab", range(5)),
+                                    finish=False)
+    assert ['ab'] == histories([next(it)])
+    multi.feed('alice', 'a', 2)
+    multi.evict(10)
+    assert 'alice' not in multi
+    list(it)
+    # the evicted stream is not brought back
+    assert 'alice' not in multi
+
+def test_advance_clock():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.feed('alice', 'a', 0)
+    multi.feed('bob', 'a', 0)
+    multi.feed('bob', 'b', 1)
+    assert [] == multi.advance_clock('alice', 6)
+    assert not multi.is_busy('alice')
+    assert 6 == multi.clock('alice')
+    assert multi.is_busy('bob')
+    assert [] == multi.advance_clock('carol', 3)
+    assert 3 == multi.clock('carol')
@@ -0,0 +1,128 @@
+from fsa4streams import FSA
+from fsa4streams.parallel import parallel_feed_all, parallel_feed_chunks
+
+from random import Random
+
+from .test_dfa import random_events, random_structure
+from .test_multi import STREAMS, STRUCTURE
+from .test_tokens import EVENTS_DELETED_INHIBITED, STRUCTURE_DELETED_INHIBITED
+
+
+def load_stream(key):
+    return STREAMS[key]
+
+
+def expected(timestamped=False):
+    ret = {}
+    for key, events in STREAMS.items():
+        if timestamped:
+            events = [ (event, 2*i) for i, event in enumerate(events) ]
+            ret[key] = FSA.from_dict(STRUCTURE).feed_all_timestamps(events)
+        else:
+            ret[key] = FSA.from_dict(STRUCTURE).feed_all(events)
+    return ret
+
+def test_parallel_feed_all():
+    fsa = FSA.from_dict(STRUCTURE)
+    partitions = sorted(STREAMS.items())
+    got = list(parallel_feed_all(fsa, partitions, processes=2))
+    assert sorted(STREAMS) == [ key for key, _ in got ]
+    assert expected() == dict(got)
+    assert not fsa.is_busy()
+
+def test_unordered_dict():
+    fsa = FSA.from_dict(STRUCTURE)
+    got = dict(parallel_feed_all(fsa, STREAMS, processes=2, ordered=False))
+    assert expected() == got
+
+def test_timestamped():
+    fsa = FSA.from_dict(STRUCTURE)
+    partitions = [ (key, [ (event, 2*i) for i, event in enumerate(events) ])
+                   for key, events in STREAMS.items() ]
+    got = dict(parallel_feed_all(fsa, partitions, processes=2,
+                                 timestamped=True))
+    assert expected(True) == got
+
+def test_load():
+    fsa = FSA.from_dict(STRUCTURE)
+    partitions = [ (key, key) for key in STREAMS ]
+    got = dict(parallel_feed_all(fsa, partitions, processes=2,
+                                 load=load_stream))
+    assert expected() == got
+
+def test_early_stop():
+    fsa = FSA.from_dict(STRUCTURE)
+    results = parallel_feed_all(fsa, sorted(STREAMS.items()) * 10, processes=2)
+    key, _ = next(results)
+    assert sorted(STREAMS)[0] == key
+    results.close()
+
+
+CHUNKS = [ "xab", "bbca", "bxxab", "", "bcaab", "b" ]
+
+def load_chunk(i):
+    return CHUNKS[i]
+
+def test_chunks():
+    fsa = FSA.from_dict(STRUCTURE)
+    expected = fsa.feed_all("".join(CHUNKS))
+    assert 4 == len(expected)
+    got = list(parallel_feed_chunks(fsa, CHUNKS, processes=2))
+    assert expected == got
+
+def test_chunks_load():
+    fsa = FSA.from_dict(STRUCTURE)
+    expected = fsa.feed_all("".join(CHUNKS))
+    got = list(parallel_feed_chunks(fsa, range(len(CHUNKS)), processes=2,
+                                    load=load_chunk))
+    assert expected == got
+
+def test_chunks_timestamped():
+    fsa = FSA.from_dict(STRUCTURE)
+    events = [ (event, 3*i//2) for i, event in enumerate("".join(CHUNKS)) ]
+    expected = fsa.feed_all_timestamps(events)
+    chunks = []
+    for chunk in CHUNKS:
+        chunks.append(events[:len(chunk)])
+        events = events[len(chunk):]
+    got = list(parallel_feed_chunks(fsa, chunks, processes=2, timestamped=True))
+    assert expected == got
+
+def test_chunks_deleted_inhibited():
+    fsa = FSA.from_dict(STRUCTURE_DELETED_INHIBITED)
+    events = EVENTS_DELETED_INHIBITED
+    expected = fsa.feed_all_timestamps(events)
+    assert [ 'inhibits' in match for match in expected ] == [True]
+    for chunks in ([events], [events[:1], events[1:]]):
+        got = list(parallel_feed_chunks(fsa, chunks, processes=2,
+                                        timestamped=True))
+        assert expected == got
+
+def test_chunks_random():
+    rnd = Random(42)
+    for _ in range(30):
+        structure = random_structure(rnd)
+        for state in structure["states"].values():
+            if rnd.random() < .3:
+                state["max_noise"] = rnd.randint(1, 2)
+            if rnd.random() < .2:
+                state["max_duration"] = rnd.randint(1, 3)
+            for transition in state["transitions"]:
+                if rnd.random() < .2:
+                    transition["silent"] = True
+        events = random_events(rnd) * 3
+        timestamped = rnd.random() < .5
+        if timestamped:
+            events = [ (event, i//2) for i, event in enumerate(events) ]
+        cuts = sorted(rnd.randint(0, len(events)) for _ in range(3))
+        chunks = [ events[i:j] for i, j in zip([0] + cuts, cuts + [None]) ]
+        fsa = FSA.from_dict(structure)
+        fsa.use_dfa = False
+        if timestamped:
+            expected = fsa.feed_all_timestamps(events)
+        else:
+            expected = fsa.feed_all(events)
+        got = list(parallel_feed_chunks(fsa, chunks, processes=2,
+                                        timestamped=timestamped))
+        # matches are compared as a whole, including their 'inhibits' key
+        assert expected == got, (structure, chunks)
@@ -0,0 +1,113 @@
+from fsa4streams import FSA
+from fsa4streams import reader
+from fsa4streams.reader import iter_events
+
+import gzip
+from io import BytesIO
+import json
+import socket
+import threading
+
+from pytest import raises
+
+from .test_multi import STRUCTURE
+
+
+EVENTS = [ { "ev": e, "ts": 100 * i, "extra": u"\xe9" * i }
+           for i, e in enumerate("abbcabxcab") ]
+
+def ndjson(events=EVENTS):
+    return "".join("%s\n" % json.dumps(e) for e in events).encode('utf-8')
+
+def array(events=EVENTS, indent=None):
+    return json.dumps(events, indent=indent).encode('utf-8')
+
+
+def test_ndjson():
+    data = b"\n" + ndjson() + b"  \n"
+    assert EVENTS == list(iter_events(BytesIO(data), 'ndjson'))
+    assert EVENTS == list(iter_events(BytesIO(data)))
+
+def test_array():
+    for indent in (None, 2):
+        assert EVENTS == list(iter_events(BytesIO(array(indent=indent))))
+        assert EVENTS == list(iter_events(BytesIO(array(indent=indent)),
+                                          'array'))
+    assert [] == list(iter_events(BytesIO(b" [ ] ")))
+
+def test_array_chunks(monkeypatch):
+    # values and multi-byte characters split across chunks
+    events = EVENTS + [ 12345, 1.5e10, "x" * 50, [1, [2]], None, True ]
+    expected = json.loads(array(events).decode('utf-8'))
+    for size in (1, 2, 3, 7):
+        monkeypatch.setattr(reader, 'CHUNK_SIZE', size)
+        assert expected == list(iter_events(BytesIO(array(events, 1))))
+
+def test_files(tmpdir):
+    for name, data in [ ("events.ndjson", ndjson()),
+                        ("events.json", array()),
+                        ("events.jsonl.gz", ndjson()),
+                        ("events.dat", array()), ]:
+        path = str(tmpdir.join(name))
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wb') as f:
+            f.write(data)
+        assert EVENTS == list(iter_events(path))
+        with open(path, 'rb') as f:
+            if name.endswith('.gz'):
+                f = gzip.GzipFile(fileobj=f)
+            assert EVENTS == list(iter_events(f))
+
+def test_gzip_detected(tmpdir):
+    path = str(tmpdir.join("events"))
+    with gzip.open(path, 'wb') as f:
+        f.write(array())
+    assert EVENTS == list(iter_events(path))
+
+def test_ndjson_of_arrays():
+    data = b'["a", 1]\n["b", 2]\n'
+    assert [["a", 1], ["b", 2]] == list(iter_events(BytesIO(data), 'ndjson'))
+    assert [("a", 1), ("b", 2)] == \
+        list(iter_events(BytesIO(data), 'ndjson', timestamp=1, event=0))
+
+def test_socket():
+    server, client = socket.socketpair()
+    data = ndjson()
+    def send():
+        for i in range(0, len(data), 10):
+            client.sendall(data[i:i+10])
+        client.close()
+    thread = threading.Thread(target=send)
+    thread.start()
+    try:
+        assert list("abbcabxcab") == list(iter_events(server, event='ev'))
+    finally:
+        thread.join()
+        server.close()
+
+def test_timestamps():
+    events = iter_events(BytesIO(ndjson()), event='ev', timestamp='ts')
+    fsa = FSA.from_dict(STRUCTURE)
+    expected = FSA.from_dict(STRUCTURE).feed_all_timestamps(
+        (e['ev'], e['ts']) for e in EVENTS)
+    assert expected == fsa.feed_all_timestamps(events)
+    records = list(iter_events(BytesIO(array()), timestamp='ts'))
+    assert [ (e, e['ts']) for e in EVENTS ] == records
+
+def test_lazy(monkeypatch):
+    monkeypatch.setattr(reader, 'CHUNK_SIZE', 16)
+    for data in (array(), ndjson()):
+        stream = BytesIO(data * 100)
+        events = iter_events(stream)
+        assert EVENTS[0] == next(events)
+        assert stream.tell() < 1000
+
+def test_errors():
+    for data in (b'[1, 2', b'[1 2]', b'[1,, 2]', b'[1, ]', b'[{"a": }]',
+                 b'{"a": 1}\n{"a":', b'[1.5e]'):
+        with raises(ValueError):
+            list(iter_events(BytesIO(data)))
+    with raises(ValueError):
+        list(iter_events(BytesIO(b'{"a": 1}'), 'array'))
+    with raises(ValueError):
+        list(iter_events(BytesIO(b''), 'xml'))
@@ -0,0 +1,148 @@
+from fsa4streams.server import MatchService, make_server
+
+from io import BytesIO
+import json
+from threading import Thread
+try:
+    from http.client import HTTPConnection
+except ImportError: # Python 2
+    from httplib import HTTPConnection
+from wsgiref.util import setup_testing_defaults
+
+from .test_multi import STRUCTURE
+
+
+def make_service(**kw):
+    service = MatchService(**kw)
+    service.register('abb', STRUCTURE)
+    return service
+
+def ndjson(items):
+    return b''.join( json.dumps(item).encode('utf-8') + b'\n'
+                     for item in items )
+
+def call(service, method, path, body=b'', query='', **extra):
+    environ = {
+        'REQUEST_METHOD': str(method),
+        'PATH_INFO': str(path),
+        'QUERY_STRING': str(query),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    }
+    environ.update(extra)
+    setup_testing_defaults(environ)
+    response = {}
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    data = b''.join(service(environ, start_response))
+    if response['headers']['Content-Type'] == 'application/x-ndjson':
+        result = [ json.loads(line.decode('utf-8'))
+                   for line in data.splitlines() ]
+    else:
+        result = json.loads(data.decode('utf-8'))
+    return response['status'], result
+
+
+def test_names_and_structure():
+    service = make_service()
+    assert ('200 OK', ['abb']) == call(service, 'GET', '/automata')
+    status, structure = call(service, 'GET', '/automata/abb')
+    assert '200 OK' == status
+    assert sorted(STRUCTURE['states']) == sorted(structure['states'])
+
+def test_feed():
+    service = make_service()
+    expected = service._automata['abb'].fsa.feed_all("abbcab")
+    status, matches = call(service, 'POST', '/automata/abb',
+                           ndjson("abbcab"))
+    assert '200 OK' == status
+    assert expected == matches
+    assert 2 == len(matches)
+    assert 0 == len(service._automata['abb'])
+
+def test_feed_timestamps():
+    service = make_service()
+    events = [ ("a", 0), ("b", 10), ("a", 12), ("b", 14) ]
+    status, matches = call(service, 'POST', '/automata/abb',
+                           ndjson(events), 'timestamped=1')
+    assert ["ab"] == [ "".join(m['history_events']) for m in matches ]
+
+def test_sessions():
+    service = make_service()
+    path = '/automata/abb/sessions/s1'
+    assert [] == call(service, 'POST', path, ndjson("ab"))[1]
+    assert [] == call(service, 'POST', path, ndjson("b"))[1]
+    status, tokens = call(service, 'GET', path)
+    assert 1 == len(tokens['running'])
+    matches = call(service, 'POST', path, ndjson("x"))[1]
+    assert ["abb"] == [ "".join(m['history_events']) for m in matches ]
+    assert [] == call(service, 'POST', path, ndjson("ab"))[1]
+    matches = call(service, 'DELETE', path)[1]
+    assert ["ab"] == [ "".join(m['history_events']) for m in matches ]
+    assert 0 == len(service._automata['abb'])
+    assert {} == service._locks
+
+def test_malformed_input():
+    service = make_service()
+    status, result = call(service, 'POST', '/automata/abb/sessions/s1',
+                          b'"a"\n"b"\nnot json\n"b"\n')
+    assert '200 OK' == status
+    assert 'error' in result[-1]
+    # the events before the error were fed
+    tokens = call(service, 'GET', '/automata/abb/sessions/s1')[1]
+    assert ["a", "b"] == list(tokens['running'].values())[0]['history_events']
+
+def test_errors():
+    service = make_service()
+    assert '404 Not Found' == call(service, 'GET', '/automata/nope')[0]
+    assert '404 Not Found' == call(service, 'GET', '/foo')[0]
+    assert '405 Method Not Allowed' == call(service, 'PATCH', '/automata')[0]
+    assert '403 Forbidden' == call(service, 'PUT', '/automata/x', b'{}')[0]
+
+def test_body_length():
+    service = make_service(writable=True)
+    body = ndjson("abbcab")
+    expected = call(service, 'POST', '/automata/abb', body)
+    assert '411 Length Required' == call(service, 'POST', '/automata/abb',
+                                         body, CONTENT_LENGTH='')[0]
+    assert '411 Length Required' == call(service, 'PUT', '/automata/x',
+                                         b'{}', CONTENT_LENGTH='')[0]
+    assert expected == call(service, 'POST', '/automata/abb', body,
+                            CONTENT_LENGTH='',
+                            **{ 'wsgi.input_terminated': True })
+    assert ('200 OK', []) == call(service, 'POST', '/automata/abb', b'')
+
+def test_register():
+    service = make_service(writable=True)
+    body = json.dumps(STRUCTURE).encode('utf-8')
+    assert '200 OK' == call(service, 'PUT', '/automata/other', body)[0]
+    assert ['abb', 'other'] == call(service, 'GET', '/automata')[1]
+    status, result = call(service, 'PUT', '/automata/bad',
+                          b'{"states": {"start": {"transitions": '
+                          b'[{"condition": "a", "target": "nowhere"}]}}}')
+    assert '400 Bad Request' == status
+    for body in [ b'{}', b'[]', b'42', b'nope', b'{"states": 3}',
+                  b'{"states": {"start": 1}}',
+                  b'{"states": {"start": {"transitions": 5}}}' ]:
+        status, result = call(service, 'PUT', '/automata/bad', body)
+        assert '400 Bad Request' == status, body
+        assert 'error' in result
+    assert '200 OK' == call(service, 'DELETE', '/automata/other')[0]
+    assert ['abb'] == call(service, 'GET', '/automata')[1]
+
+def test_server():
+    service = make_service()
+    server = make_server(service, "localhost", 0, quiet=True)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        connection = HTTPConnection('localhost', server.server_port)
+        connection.request('POST', '/automata/abb', ndjson("abbcab"))
+        response = connection.getresponse()
+        assert 200 == response.status
+        assert 2 == len(response.read().splitlines())
+    finally:
+        server.shutdown()
+        server.server_close()
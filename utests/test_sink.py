@@ -0,0 +1,192 @@
+from fsa4streams import FSA, MultiStreamFSA
+from fsa4streams.parallel import parallel_feed_all, parallel_feed_chunks
+from fsa4streams.sink import CallbackSink, NDJSONSink, RingBufferSink, \
+    RotatingSink, Sink, compact
+
+from io import BytesIO
+import json
+import os
+
+from pytest import raises
+
+from .test_multi import STRUCTURE
+
+
+EVENTS = "abbcabxcab" * 3
+
+def expected():
+    return FSA.from_dict(STRUCTURE).feed_all(EVENTS)
+
+def read_ndjson(data):
+    return [ json.loads(line) for line in data.decode('utf-8').splitlines() ]
+
+
+def test_callback():
+    batches = []
+    fsa = FSA.from_dict(STRUCTURE)
+    with CallbackSink(batches.append, batch_size=4) as sink:
+        fsa.sink = sink
+        matches = fsa.feed_all(EVENTS)
+        assert all( len(batch) == 4 for batch in batches )
+    assert matches == expected()
+    assert matches == sum(batches, [])
+    assert len(batches) == (len(matches) + 3) // 4
+
+def test_all_paths():
+    sink = RingBufferSink()
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.sink = sink
+    fsa.use_dfa = False
+    returned = []
+    for event in EVENTS:
+        returned += fsa.feed(event)
+    returned += fsa.advance_clock(100)
+    returned += fsa.finish()
+    returned += fsa.feed_all(EVENTS)
+    returned += [ match for _, match in fsa.feed_batch(EVENTS) ]
+    returned += fsa.finish()
+    assert returned == sink.matches
+    assert returned[:len(expected())] == expected()
+
+def test_multi():
+    sink = RingBufferSink()
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.fsa.sink = sink
+    returned = multi.feed_all(1, EVENTS, False)
+    returned += multi.feed(2, "a") + multi.feed(2, "b")
+    returned += sum(multi.finish_all().values(), [])
+    key = lambda match: json.dumps(match, sort_keys=True)
+    assert returned
+    assert sorted(returned, key=key) == sorted(sink.matches, key=key)
+
+def test_write_all():
+    sink = RingBufferSink(maxlen=3, projection='compact')
+    fsa = FSA.from_dict(STRUCTURE)
+    assert len(expected()) == sink.write_all(fsa.iter_feed(EVENTS))
+    assert [ compact(match) for match in expected()[-3:] ] == sink.matches
+    sink.clear()
+    assert [] == sink.matches
+
+def test_projection():
+    match = expected()[0]
+    assert {
+        'state': match['state'],
+        'created': match['created'],
+        'updated': match['updated'],
+        'start': match['created'],
+        'end': match['updated'],
+    } == compact(match)
+    # the offsets locate the first and last events of every match
+    for match in expected():
+        projected = compact(match)
+        assert match['history_events'][0] == EVENTS[projected['start']]
+        assert match['history_events'][-1] == EVENTS[projected['end']]
+    # offsets are unknown for plain dicts, e.g. read back from JSON
+    projected = compact(json.loads(json.dumps(match)))
+    assert (None, None) == (projected['start'], projected['end'])
+    sink = RingBufferSink(projection=lambda match: match['created'])
+    sink.write_all(expected())
+    assert [ match['created'] for match in expected() ] == sink.matches
+    with raises(ValueError):
+        RingBufferSink(projection='unknown')
+
+def test_projection_timestamps():
+    timestamps = [ 1000 + 2*i + i%2 for i in range(len(EVENTS)) ]
+    fsa = FSA.from_dict(STRUCTURE)
+    matches = fsa.feed_all_timestamps(zip(EVENTS, timestamps))
+    assert matches
+    for match in matches:
+        projected = compact(match)
+        start, end = projected['start'], projected['end']
+        assert timestamps[start] == projected['created']
+        assert timestamps[end] == projected['updated']
+        assert match['history_events'][0] == EVENTS[start]
+        assert match['history_events'][-1] == EVENTS[end]
+
+def test_ndjson():
+    output = BytesIO()
+    fsa = FSA.from_dict(STRUCTURE)
+    sink = NDJSONSink(output, batch_size=1000)
+    fsa.sink = sink
+    fsa.feed_all(EVENTS)
+    assert b'' == output.getvalue()
+    sink.flush()
+    assert expected() == read_ndjson(output.getvalue())
+    sink.close()
+    assert not output.closed
+
+def test_ndjson_file(tmpdir):
+    path = str(tmpdir.join("matches.ndjson"))
+    for _ in range(2):
+        with NDJSONSink(path, projection='compact') as sink:
+            sink.write_all(expected())
+    assert sink._file.closed
+    with open(path, 'rb') as f:
+        assert 2 * [ compact(m) for m in expected() ] == read_ndjson(f.read())
+
+def test_rotating(tmpdir):
+    pattern = str(tmpdir.join("matches-%d.ndjson"))
+    matches = expected() * 10
+    with RotatingSink(pattern, max_bytes=2000, batch_size=5) as sink:
+        sink.write_all(matches)
+    assert sink.index > 1
+    written = []
+    for i in range(sink.index + 1):
+        with open(pattern % i, 'rb') as f:
+            data = f.read()
+        assert len(data) <= 2000 or i == sink.index
+        written += read_ndjson(data)
+    assert matches == written
+
+def test_rotating_backups(tmpdir):
+    pattern = str(tmpdir.join("matches-%d.ndjson"))
+    with RotatingSink(pattern, max_bytes=500, backup_count=2,
+                      batch_size=1) as sink:
+        sink.write_all(expected() * 5)
+    assert sink.index > 3
+    kept = sorted(os.listdir(str(tmpdir)))
+    assert [ os.path.basename(pattern % i)
+             for i in range(sink.index - 2, sink.index + 1) ] == kept
+
+def test_rotating_resume(tmpdir):
+    pattern = str(tmpdir.join("matches-%d.ndjson"))
+    matches = expected() * 10
+    with RotatingSink(pattern, max_bytes=2000, batch_size=5) as sink:
+        sink.write_all(matches)
+    last = sink.index
+    assert last > 1
+    # after a restart, the sink resumes with the last file
+    with RotatingSink(pattern, max_bytes=2000, batch_size=5) as sink:
+        assert last == sink.index
+        sink.write_all(matches)
+    assert sink.index > last
+    written = []
+    for i in range(sink.index + 1):
+        with open(pattern % i, 'rb') as f:
+            written += read_ndjson(f.read())
+    assert matches * 2 == written
+
+def test_parallel_chunks():
+    sink = RingBufferSink()
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.sink = sink
+    chunks = [ EVENTS[i:i+7] for i in range(0, len(EVENTS), 7) ]
+    matches = list(parallel_feed_chunks(fsa, chunks, 2))
+    assert expected() == matches
+    assert matches == sink.matches
+    assert [ compact(m) for m in expected() ] \
+        == [ compact(m) for m in matches ]
+
+def test_parallel_all():
+    sink = RingBufferSink()
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.sink = sink
+    got = list(parallel_feed_all(fsa, [(1, EVENTS), (2, EVENTS[:7])], 2))
+    assert expected() == got[0][1]
+    assert FSA.from_dict(STRUCTURE).feed_all(EVENTS[:7]) == got[1][1]
+    assert got[0][1] + got[1][1] == sink.matches
+
+def test_abstract():
+    with raises(NotImplementedError):
+        with Sink(batch_size=1) as sink:
+            sink.write({})
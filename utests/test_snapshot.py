@@ -0,0 +1,158 @@
+from fsa4streams import FSA, MultiStreamFSA
+from fsa4streams.snapshot import MAGIC
+
+import json
+import random
+
+from pytest import raises
+
+from .test_multi import STRUCTURE
+from .test_tokens import make_fsa
+
+
+def busy_fsa(events="abbab"):
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.feed_all(events, False)
+    return fsa
+
+
+def count_nodes(fsa):
+    nodes = set()
+    for token in fsa._tokens.all_tokens():
+        node = token.history_events
+        while node.length:
+            nodes.add(id(node))
+            node = node.parent
+    return len(nodes)
+
+
+def test_round_trip():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    data = fsa.export_tokens_as_bytes()
+    assert data.startswith(MAGIC)
+    other = make_fsa()
+    other.load_tokens_from_bytes(data)
+    assert fsa.export_tokens_as_dict() == other.export_tokens_as_dict()
+    assert fsa.feed_all("bd") == other.feed_all("bd")
+
+def test_same_as_json():
+    fsa = busy_fsa()
+    from_json = FSA.from_dict(STRUCTURE)
+    from_json.load_tokens_from_str(fsa.export_tokens_as_string())
+    from_bytes = FSA.from_dict(STRUCTURE)
+    from_bytes.load_tokens_from_bytes(fsa.export_tokens_as_bytes())
+    assert from_json.export_tokens_as_dict() \
+        == from_bytes.export_tokens_as_dict()
+    assert from_json.feed_all("bcab") == from_bytes.feed_all("bcab")
+
+def test_buffers():
+    data = busy_fsa().export_tokens_as_bytes()
+    expected = busy_fsa().export_tokens_as_dict()
+    for buf in (bytearray(data), memoryview(data),
+                memoryview(b'xx' + data)[2:]):
+        fsa = FSA.from_dict(STRUCTURE)
+        fsa.load_tokens_from_bytes(buf)
+        assert expected == fsa.export_tokens_as_dict()
+
+def test_values():
+    fsa = FSA.from_dict({
+        "states": {
+            "start": {
+                "default_transition": { "target": "s1" },
+            },
+            "s1": {
+                "max_noise": 10,
+                "transitions": [ { "condition": "end", "target": "s2" } ],
+            },
+            "s2": { "terminal": True },
+        },
+    })
+    events = [ None, True, False, 0, -1, 2**70, -2**70, 1.5, u"\xe9t\xe9",
+               [1, [u"a", None]], { u"key": { u"\u2603": [2.5] } }, 300 ]
+    for i, event in enumerate(events):
+        # integer and float timestamps, negative and positive
+        fsa.feed(event, -1000 + 200*i + (0.5 if i % 2 else 0))
+    data = fsa.export_tokens_as_bytes()
+    other = FSA.from_dict(fsa.export_structure_as_dict())
+    other.load_tokens_from_bytes(data)
+    assert fsa.export_tokens_as_dict() == other.export_tokens_as_dict()
+    assert json.loads(fsa.export_tokens_as_string()) \
+        == other.export_tokens_as_dict()
+
+def test_unsupported_value():
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.feed("a", 0)
+    fsa._tokens.running[0].history_events = \
+        fsa._tokens.running[0].history_events.push(object())
+    with raises(TypeError):
+        fsa.export_tokens_as_bytes()
+
+def test_idle():
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.feed_all("abbx")
+    other = FSA.from_dict(STRUCTURE)
+    other.load_tokens_from_bytes(fsa.export_tokens_as_bytes())
+    assert not other.is_busy()
+    assert fsa.export_tokens_as_dict() == other.export_tokens_as_dict()
+
+def test_shared_histories():
+    fsa = FSA.from_dict(STRUCTURE)
+    fsa.feed_all("a" * 20 + "b" * 20, False)
+    other = FSA.from_dict(STRUCTURE)
+    other.load_tokens_from_bytes(fsa.export_tokens_as_bytes())
+    assert fsa.export_tokens_as_dict() == other.export_tokens_as_dict()
+    # prefixes shared in memory are still shared once loaded
+    assert count_nodes(fsa) == count_nodes(other)
+    assert count_nodes(fsa) < sum(
+        len(token.history_events) for token in fsa._tokens.all_tokens())
+    assert len(fsa.export_tokens_as_bytes()) \
+        < len(fsa.export_tokens_as_string()) / 4
+
+def test_random():
+    rand = random.Random(42)
+    for _ in range(50):
+        events = "".join(rand.choice("abcx") for _ in range(rand.randint(1, 30)))
+        fsa = busy_fsa(events)
+        other = FSA.from_dict(STRUCTURE)
+        other.load_tokens_from_bytes(fsa.export_tokens_as_bytes())
+        assert fsa.export_tokens_as_dict() == other.export_tokens_as_dict()
+        assert fsa.feed_all("abcab") == other.feed_all("abcab")
+
+def test_invalid():
+    data = busy_fsa().export_tokens_as_bytes()
+    fsa = FSA.from_dict(STRUCTURE)
+    for bad in (b'', b'XXXX\x01', MAGIC + b'\x09', data[:-3]):
+        with raises(ValueError):
+            fsa.load_tokens_from_bytes(bad)
+
+def test_unknown_state():
+    data = busy_fsa().export_tokens_as_bytes()
+    fsa = FSA.from_dict({
+        "states": {
+            "start": { "transitions": [ { "condition": "a", "target": "s3" } ] },
+            "s3": { "terminal": True },
+        },
+    })
+    with raises(ValueError):
+        fsa.load_tokens_from_bytes(data)
+
+def test_busy():
+    data = busy_fsa().export_tokens_as_bytes()
+    fsa = busy_fsa()
+    with raises(ValueError):
+        fsa.load_tokens_from_bytes(data)
+    fsa.load_tokens_from_bytes(data, force=True)
+
+def test_multi():
+    multi = MultiStreamFSA.from_dict(STRUCTURE)
+    multi.feed_all("s1", "abbab", False)
+    multi.feed_all("s2", "abbx")
+    other = MultiStreamFSA.from_dict(STRUCTURE)
+    for key in ("s1", "s2", "s3"):
+        other.load_tokens_from_bytes(key, multi.export_tokens_as_bytes(key))
+        assert multi.export_tokens_as_dict(key) \
+            == other.export_tokens_as_dict(key)
+    assert other.is_busy("s1")
+    assert not other.is_busy("s2")
+    assert multi.finish("s1") == other.finish("s1")
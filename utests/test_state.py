@@ -2,7 +2,7 @@ from fsa4streams import FSA
 
 class TestGlobalDefaults(object):
 
-    def setup(self):
+    def setup_method(self, _method):
         self.to_error = {'target': 'error'}
         self.fsa = FSA.make_empty()
         (self.fsa
@@ -41,7 +41,7 @@ class TestLocalDefaults1(object):
     # as they are mutually incompatible.
     # So we have two variants of this test case.
 
-    def setup(self):
+    def setup_method(self, _method):
         self.defaults = {
             'max_noise': 7,
             'terminal': True,
@@ -73,7 +73,7 @@ class TestLocalDefaults1(object):
 
 class TestLocalDefaults2(object):
 
-    def setup(self):
+    def setup_method(self, _method):
         self.defaults = {
             'default_transition': {
                 'target': 'error'
@@ -0,0 +1,402 @@
+from fsa4streams import FSA
+
+import json
+import random
+
+from pytest import raises
+
+from .test_dfa import random_events, random_structure
+
+
+def make_fsa():
+    fsa = FSA.make_empty(allow_overlap=True)
+    (fsa
+     .add_state("start")
+       .add_transition("a", "s1")
+     .add_state("s1", terminal=True)
+       .add_transition("b", "s1")
+       .add_transition("b", "s2")
+     .add_state("s2", max_noise=1)
+       .add_transition("d", "finish")
+     .add_state("finish", terminal=True)
+     .check_structure()
+    )
+    return fsa
+
+
+# the pending token inhibited by the match is deleted before finish
+STRUCTURE_DELETED_INHIBITED = {
+    "allow_overlap": True,
+    "states": {
+        "start": { "transitions": [
+            { "condition": ".", "matcher": "regexp", "target": "s1" },
+            { "condition": "b", "matcher": "regexp", "target": "s1",
+              "silent": True },
+            { "condition": "a", "matcher": "regexp", "target": "s2" },
+        ]},
+        "s1": { "max_noise": 1, "transitions": [
+            { "condition": "b", "matcher": "regexp", "target": "s2" },
+            { "condition": "b", "matcher": "regexp", "target": "s2" },
+            { "condition": "b", "matcher": "regexp", "target": "s1" },
+        ]},
+        "s2": { "terminal": True, "max_noise": 1 },
+    },
+}
+EVENTS_DELETED_INHIBITED = [('c', 100), ('b', 101), ('c', 103)]
+
+
+def test_export_format():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    exported = fsa.export_tokens_as_dict()
+    assert 1 == exported['clock']
+    assert 2 == len(exported['running'])
+    assert 1 == len(exported['pending'])
+    pendingid, = exported['pending']
+    for tokenid, token in exported['running'].items():
+        assert isinstance(tokenid, type(u''))
+        assert pendingid == token['inhibits']
+        assert ['a', 'b'] == token['history_events']
+        assert ['s1'] == token['history_states']
+        assert token['state'] in ('s1', 's2')
+    pending = exported['pending'][pendingid]
+    assert 's1' == pending['state']
+    assert ['a'] == pending['history_events']
+    assert 'inhibits' not in pending
+
+
+def test_export_is_a_copy():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    exported = fsa.export_tokens_as_dict()
+    for token in exported['running'].values():
+        token['history_events'].append('z')
+    assert exported != fsa.export_tokens_as_dict()
+
+
+def test_round_trip():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    exported = fsa.export_tokens_as_dict()
+    other = make_fsa()
+    other.load_tokens_from_dict(exported)
+    assert exported == other.export_tokens_as_dict()
+    assert fsa.feed_all("bd") == other.feed_all("bd")
+
+
+def test_renumbering():
+    fsa = make_fsa()
+    fsa.load_tokens_from_dict({
+        'clock': 3,
+        'running': {
+            'foo': {
+                'state': 's1', 'created': 0, 'updated': 3,
+                'noise_state': 0, 'noise_total': 0,
+                'history_events': ['a', 'b'], 'history_states': ['start'],
+                'inhibits': 'bar',
+            },
+        },
+        'pending': {
+            'bar': {
+                'state': 's1', 'created': 0, 'updated': 0,
+                'noise_state': 0, 'noise_total': 0,
+                'history_events': ['a'], 'history_states': [],
+            },
+        },
+    })
+    exported = fsa.export_tokens_as_dict()
+    runningid, = exported['running']
+    pendingid, = exported['pending']
+    assert runningid != pendingid
+    assert pendingid == exported['running'][runningid]['inhibits']
+    # new ids do not collide with loaded ones
+    fsa.feed("b")
+    ids = list(fsa.export_tokens_as_dict()['running'])
+    assert len(ids) == len(set(ids))
+
+
+
+def test_round_trip_deleted_inhibited():
+    structure = STRUCTURE_DELETED_INHIBITED
+    events = EVENTS_DELETED_INHIBITED
+    fsa = FSA.from_dict(structure)
+    fsa.feed_all_timestamps(events, False)
+    exported = json.loads(json.dumps(fsa.export_tokens_as_dict()))
+    other = FSA.from_dict(structure)
+    other.load_tokens_from_dict(exported)
+    assert exported == other.export_tokens_as_dict()
+    expected = fsa.finish()
+    assert [ 'inhibits' in match for match in expected ] == [True]
+    assert expected == other.finish()
+
+
+def test_renumbering_deleted_inhibited():
+    fsa = make_fsa()
+    fsa.load_tokens_from_dict({
+        'clock': 3,
+        'running': {
+            '0': {
+                'state': 's2', 'created': 0, 'updated': 3,
+                'noise_state': 0, 'noise_total': 0,
+                'history_events': ['a', 'b'], 'history_states': ['s1'],
+                'inhibits': '7',
+            },
+        },
+        'pending': {},
+    })
+    assert '7' == fsa.export_tokens_as_dict()['running']['0']['inhibits']
+    # new ids do not collide with the deleted one
+    fsa.feed("a")
+    ids = list(fsa.export_tokens_as_dict()['running'])
+    assert '7' not in ids
+
+def test_non_existing_state():
+    fsa = make_fsa()
+    with raises(ValueError):
+        fsa.load_tokens_from_dict({
+            'clock': 0,
+            'running': {
+                '0': {
+                    'state': 'nowhere', 'created': 0, 'updated': 0,
+                    'noise_state': 0, 'noise_total': 0,
+                    'history_events': ['a'], 'history_states': [],
+                },
+            },
+            'pending': {},
+        })
+
+
+def test_recompile_keeps_tokens():
+    fsa = make_fsa()
+    fsa.feed("a")
+    fsa.add_state("aaa", terminal=True)
+    fsa['s1'].add_transition("c", "aaa")
+    matches = fsa.feed("c")
+    assert 1 == len(matches)
+    assert 'aaa' == matches[0]['state']
+
+
+def check_inhibitors(fsa):
+    tokens = fsa._tokens
+    expected = {}
+    for token in tokens.running.values():
+        if token.inhibits is not None:
+            expected[token.inhibits] = expected.get(token.inhibits, 0) + 1
+    assert expected == tokens.inhibitors
+
+
+def test_inhibitors_index():
+    fsa = FSA.from_dict({
+        "allow_overlap": True,
+        "states": {
+            "start": {
+                "transitions": [
+                    { "condition": "a", "target": "s1" },
+                    { "condition": "a", "target": "s2" },
+                ],
+            },
+            "s1": {
+                "terminal": True,
+                "transitions": [
+                    { "condition": "b", "target": "s1" },
+                    { "condition": "b", "target": "s2" },
+                    { "condition": "c", "target": "s3" },
+                ],
+            },
+            "s2": {
+                "terminal": True,
+                "max_noise": 1,
+                "transitions": [
+                    { "condition": "b", "target": "s3" },
+                ],
+            },
+            "s3": {
+                "terminal": True,
+            },
+        },
+    })
+    for event in "abbabcbbacbbbcaab":
+        fsa.feed(event)
+        check_inhibitors(fsa)
+    saved = fsa.export_tokens_as_dict()
+    fsa.reset()
+    check_inhibitors(fsa)
+    fsa.load_tokens_from_dict(saved)
+    check_inhibitors(fsa)
+    fsa.finish()
+    check_inhibitors(fsa)
+
+
+def check_deadlines(fsa):
+    tokens = fsa._tokens
+    entries = set(tokens.deadlines)
+    for tokenid, token in tokens.running.items():
+        if token.state.timed:
+            assert (token.deadline(), tokenid) in entries
+
+
+def test_deadlines_index():
+    fsa = FSA.from_dict({
+        "allow_overlap": True,
+        "states": {
+            "start": {
+                "transitions": [
+                    { "condition": "a", "target": "s1" },
+                    { "condition": "a", "target": "s2" },
+                ],
+            },
+            "s1": {
+                "max_duration": 3,
+                "max_noise": 2,
+                "transitions": [
+                    { "condition": "b", "target": "s1" },
+                    { "condition": "c", "target": "s2" },
+                ],
+            },
+            "s2": {
+                "terminal": True,
+                "max_total_duration": 100,
+                "transitions": [
+                    { "condition": "b", "target": "s2" },
+                ],
+            },
+        },
+    })
+    peak = 0
+    for i, event in enumerate("abbabcbbacbbbcaab" * 20):
+        fsa.feed(event, i // 2)
+        check_deadlines(fsa)
+        peak = max(peak, len(fsa._tokens.running))
+        # outdated entries are eventually discarded
+        assert len(fsa._tokens.deadlines) <= 2*peak + 64
+    saved = fsa.export_tokens_as_dict()
+    fsa.reset()
+    assert [] == fsa._tokens.deadlines
+    fsa.load_tokens_from_dict(saved)
+    check_deadlines(fsa)
+    fsa['s1'].max_duration = 4
+    fsa.feed("b")
+    check_deadlines(fsa)
+
+
+def test_ids_reset_when_idle():
+    fsa = make_fsa()
+    fsa.feed_all("abxx", False)
+    assert not fsa.is_busy()
+    assert 0 == fsa._tokens.next_id
+    # an idle FSA behaves as a fresh one (up to its clock)
+    expected = make_fsa().feed_all("abbdab")
+    for match in expected:
+        match['created'] += 4
+        match['updated'] += 4
+    assert expected == fsa.feed_all("abbdab")
+
+
+def test_match_offsets():
+    rnd = random.Random(5)
+    for _ in range(200):
+        structure = random_structure(rnd)
+        events = random_events(rnd)
+        for use_dfa in (True, False):
+            fsa = FSA.from_dict(structure)
+            fsa.use_dfa = use_dfa
+            # without timestamps, timestamps are the offsets of the events
+            for match in fsa.feed_all(events):
+                assert (match['created'], match['updated']) \
+                    == (match.start, match.end), (structure, events)
+            fsa = FSA.from_dict(structure)
+            fsa.use_dfa = use_dfa
+            timestamps = [ 10*i for i in range(len(events)) ]
+            for match in fsa.feed_all_timestamps(zip(events, timestamps)):
+                assert (match['created'], match['updated']) \
+                    == (10*match.start, 10*match.end), (structure, events)
+
+def test_match_offsets_loaded():
+    fsa = make_fsa()
+    fsa.feed_all("xab", False)
+    assert 3 == fsa._tokens.position
+    exported = fsa.export_tokens_as_dict()
+    fsa = make_fsa()
+    fsa.load_tokens_from_dict(exported)
+    assert 0 == fsa._tokens.position
+    matches = fsa.feed_all("bdab")
+    # offsets are counted from the load,
+    # and the first events of loaded tokens are unknown
+    assert [(None, 0), (None, 1), (None, 1), (2, 3)] \
+        == [ (match.start, match.end) for match in matches ]
+    assert [ dict(match) for match in matches ] == json.loads(json.dumps(matches))
+
+
+def test_delta_full():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    delta = fsa.export_token_delta()
+    assert delta['since'] is None
+    assert 1 == delta['checkpoint']
+    assert 2 == len(delta['running'])
+    assert 1 == len(delta['pending'])
+    other = make_fsa()
+    other.apply_token_delta(delta)
+    assert fsa.export_tokens_as_dict() == other.export_tokens_as_dict()
+    assert fsa.feed_all("bd") == other.feed_all("bd")
+
+
+def test_delta_unchanged():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    checkpoint = fsa.export_token_delta()['checkpoint']
+    delta = fsa.export_token_delta(checkpoint)
+    assert checkpoint == delta['since']
+    assert {} == delta['running']
+    assert {} == delta['pending']
+    assert {} == delta['moved']
+    assert [] == delta['deleted']
+
+
+def test_delta_moved():
+    fsa = make_fsa()
+    fsa.feed_all("ab", False)
+    checkpoint = fsa.export_token_delta()['checkpoint']
+    fsa.feed("b")
+    delta = fsa.export_token_delta(checkpoint)
+    # only the new parts of the histories are exported
+    tails = sorted( moved['history_events']
+                    for moved in delta['moved'].values() )
+    assert [[], ['b']] == tails
+
+
+def test_delta_replay():
+    from .test_multi import STRUCTURE
+    rand = random.Random(7)
+    fsa = FSA.from_dict(STRUCTURE)
+    recovered = FSA.from_dict(STRUCTURE)
+    checkpoint = None
+    timestamp = 0
+    for _ in range(100):
+        for _ in range(rand.randint(0, 5)):
+            timestamp += rand.randint(0, 3)
+            fsa.feed(rand.choice("abbcx"), timestamp)
+        delta = fsa.export_token_delta(checkpoint)
+        checkpoint = delta['checkpoint']
+        recovered.apply_token_delta(json.loads(json.dumps(delta)))
+        assert fsa.export_tokens_as_dict() == recovered.export_tokens_as_dict()
+    assert fsa.feed_all("abbcab", False) == recovered.feed_all("abbcab", False)
+    check_inhibitors(recovered)
+    check_deadlines(recovered)
+    # the recovered FSA can make its own deltas
+    delta = recovered.export_token_delta(checkpoint)
+    assert checkpoint + 1 == delta['checkpoint']
+
+
+def test_delta_wrong_checkpoint():
+    fsa = make_fsa()
+    fsa.feed("a")
+    with raises(ValueError):
+        fsa.export_token_delta(1)
+    first = fsa.export_token_delta()
+    second = fsa.export_token_delta(first['checkpoint'])
+    with raises(ValueError):
+        fsa.export_token_delta(first['checkpoint'])
+    other = make_fsa()
+    with raises(ValueError):
+        other.apply_token_delta(second)
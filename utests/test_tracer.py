@@ -0,0 +1,70 @@
+import logging
+
+from fsa4streams import FSA
+from fsa4streams.fsa import LOG
+from fsa4streams.tracer import LoggingTracer, RecordingTracer, Tracer
+
+def make_fsa(**kw):
+    fsa = FSA.make_empty(**kw)
+    (fsa
+     .add_state("start")
+       .add_transition("a", "s1")
+     .add_state("s1", max_noise=1)
+       .add_transition("b", "finish")
+       .add_transition("b", "s1")
+     .add_state("finish", terminal=True)
+       .add_transition("c", "finish")
+     .check_structure()
+    )
+    return fsa
+
+
+def test_no_tracer():
+    fsa = make_fsa()
+    assert fsa.tracer is None
+    assert fsa._get_tracer() is None
+
+def test_records():
+    fsa = make_fsa()
+    fsa.tracer = tracer = RecordingTracer()
+    matches = fsa.feed_all("abx")
+    assert 1 == len(matches)
+    assert [
+        ('event', 'a', 0),
+        ('created', 0, 's1'),
+        ('event', 'b', 1),
+        ('moved', 0, 'finish', 's1'),
+        ('forked', 1, 's1', 0),
+        ('event', 'x', 2),
+        ('noise', 0, 'finish'),
+        ('matched', 0, 'finish'),
+        ('noise', 1, 's1'),
+        ('dropped', 1, 's1', 'overlap'),
+        ('finishing',),
+    ] == tracer.records
+
+def test_pending_and_finish():
+    fsa = make_fsa()
+    fsa.tracer = tracer = RecordingTracer()
+    assert ["abc"] == [ "".join(match['history_events'])
+                        for match in fsa.feed_all("abc") ]
+    assert ('pending', 2, 'finish', 0) in tracer.records
+    assert ('dropped', 2, 'finish', 'superseded') in tracer.records
+    assert ('matched', 0, 'finish') in tracer.records
+    assert ('dropped', 1, 's1', 'finish') in tracer.records
+
+def test_base_tracer_does_not_change_matches():
+    fsa = make_fsa(allow_overlap=True)
+    expected = fsa.feed_all("abcabbxab")
+    fsa.tracer = Tracer()
+    assert expected == fsa.feed_all("abcabbxab")
+
+def test_logging_tracer(caplog):
+    fsa = make_fsa()
+    with caplog.at_level(logging.DEBUG, logger=LOG.name):
+        assert isinstance(fsa._get_tracer(), LoggingTracer)
+        fsa.feed_all("ab")
+    messages = [ record.getMessage() for record in caplog.records ]
+    assert "event 'a' at timestamp 0" in messages
+    assert "  token 0 in 's1' moved to 'finish'" in messages
+    assert "finishing" in messages
@@ -0,0 +1,139 @@
+from fsa4streams import FSA
+
+from random import Random
+
+from pytest import importorskip, raises
+
+numpy = importorskip("numpy")
+
+from fsa4streams.sink import RingBufferSink
+from fsa4streams.vectorized import VectorizedFSA
+from .test_dfa import make_fsa, random_events, random_structure
+
+
+def as_records(matches):
+    return list(zip(*[ column.tolist() for column in matches ]))
+
+def expected_records(fsa, events, timestamps=None):
+    """Run `events` through the token engine,
+    and return the matches as (index, start, end, state, created, updated)
+    records."""
+    fsa = FSA.from_dict(fsa.export_structure_as_dict())
+    fsa.use_dfa = False
+    if timestamps is None:
+        matches = fsa.feed_batch(events)
+    else:
+        matches = fsa.feed_batch(events, timestamps)
+    matches += [ (len(events), match) for match in fsa.finish() ]
+    index = sorted(fsa._compile().index, key=fsa._compile().index.get)
+    return [ (i, match.start, match.end, index.index(match['state']),
+              match['created'], match['updated'])
+             for i, match in matches ]
+
+
+def test_encode_decode():
+    vfsa = VectorizedFSA(make_fsa(), ["x"])
+    assert ["a", "b", "x"] == sorted(vfsa.vocabulary)
+    codes = vfsa.encode("abxyab")
+    assert codes.dtype.kind == 'i'
+    assert list("abxyab") == vfsa.decode(codes)
+    assert "y" == vfsa.vocabulary[-1]
+
+def test_run():
+    fsa = make_fsa()
+    vfsa = VectorizedFSA(fsa)
+    assert [] == vfsa.problems
+    events = "xxabbxxxabyyyab"
+    matches = vfsa.run(vfsa.encode(events))
+    assert [5, 10, 15] == matches.index.tolist()
+    assert [2, 8, 13] == matches.start.tolist()
+    assert [4, 9, 14] == matches.end.tolist()
+    assert [2, 8, 13] == matches.created.tolist()
+    assert [4, 9, 14] == matches.updated.tolist()
+    assert ["finish"] * 3 == [ vfsa.state_ids[i] for i in matches.state ]
+    assert expected_records(fsa, events) == as_records(matches)
+
+def test_timestamps():
+    fsa = make_fsa()
+    vfsa = VectorizedFSA(fsa)
+    events = "abxab"
+    timestamps = [10, 11, 11, 20, 25]
+    matches = vfsa.run(vfsa.encode(events), numpy.array(timestamps))
+    assert [0, 3] == matches.start.tolist()
+    assert [1, 4] == matches.end.tolist()
+    assert [10, 20] == matches.created.tolist()
+    assert [11, 25] == matches.updated.tolist()
+    assert expected_records(fsa, events, timestamps) == as_records(matches)
+
+def test_unreachable_state():
+    fsa = make_fsa()
+    (fsa.add_state("orphan")
+         .add_transition("z", "finish"))
+    vfsa = VectorizedFSA(fsa)
+    assert [] == vfsa.problems
+    assert "z" not in vfsa.vocabulary
+    events = "abzab"
+    assert expected_records(fsa, events) \
+        == as_records(vfsa.run(vfsa.encode(events)))
+
+def test_bad_timestamps():
+    vfsa = VectorizedFSA(make_fsa())
+    with raises(ValueError):
+        vfsa.run(vfsa.encode("ab"), [2, 1])
+    with raises(ValueError):
+        vfsa.run(vfsa.encode("ab"), [1])
+
+def test_no_match():
+    vfsa = VectorizedFSA(make_fsa())
+    matches = vfsa.run(vfsa.encode("xyz"))
+    assert 0 == len(matches.index)
+
+def test_fallback():
+    fsa = make_fsa()
+    fsa['s1'].max_noise = 1
+    fsa['finish'].add_transition("c.*", "finish", matcher="regexp")
+    vfsa = VectorizedFSA(fsa)
+    assert vfsa.problems
+    events = ["a", "x", "b", "cat", "b", "y", "a", "b"]
+    matches = vfsa.run(vfsa.encode(events))
+    assert 2 == len(matches.index)
+    assert expected_records(fsa, events) == as_records(matches)
+    timestamps = [ 10*i for i in range(len(events)) ]
+    matches = vfsa.run(vfsa.encode(events), timestamps)
+    assert [0, 6] == matches.start.tolist()
+    assert [4, 7] == matches.end.tolist()
+    assert [0, 60] == matches.created.tolist()
+    assert [40, 70] == matches.updated.tolist()
+
+def test_no_sink():
+    fsa = make_fsa()
+    fsa.sink = sink = RingBufferSink()
+    events = ["a", "x", "b", "c", "b", "y", "a", "b"]
+    vfsa = VectorizedFSA(fsa)
+    assert not vfsa.problems
+    assert len(vfsa.run(vfsa.encode(events)).index)
+    fsa['s1'].max_noise = 1
+    fsa['finish'].add_transition("c.*", "finish", matcher="regexp")
+    vfsa = VectorizedFSA(fsa)
+    assert vfsa.problems
+    assert len(vfsa.run(vfsa.encode(events)).index)
+    assert [] == sink.matches
+
+def test_same_as_tokens():
+    rnd = Random(4)
+    for _ in range(300):
+        structure = random_structure(rnd)
+        fsa = FSA.from_dict(structure)
+        events = [ event for event in random_events(rnd)
+                   if not isinstance(event, list) ]
+        timestamps = None
+        if rnd.random() < .5:
+            timestamps = []
+            timestamp = 0
+            for _ in events:
+                timestamp += rnd.randint(0, 2)
+                timestamps.append(timestamp)
+        vfsa = VectorizedFSA(fsa)
+        got = vfsa.run(vfsa.encode(events), timestamps)
+        assert expected_records(fsa, events, timestamps) == as_records(got), \
+            (structure, events, timestamps)